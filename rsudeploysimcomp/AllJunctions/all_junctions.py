@@ -28,10 +28,8 @@ class AllJunctions:
         self.run()
 
     def run(self):
-        self.picked_junctions = [
-            (junction["x"] - self.sumoparser.x_offset, junction["y"] - self.sumoparser.y_offset)
-            for junction in self.sumoparser.junctions
-        ]
+        adjusted_junctions = self.sumoparser.junction_xy - (self.sumoparser.x_offset, self.sumoparser.y_offset)
+        self.picked_junctions = [(float(x), float(y)) for x, y in adjusted_junctions]
         self.coverage, self.avg_distance = run_pipeline(
             picked_junctions=self.picked_junctions,
             deployment_csv_path=self.deployment_csv_path,
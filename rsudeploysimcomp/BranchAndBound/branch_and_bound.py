@@ -1,6 +1,6 @@
 import numpy as np
 
-from rsudeploysimcomp.Utils.utils import adjust_coordinates_by_offsets, find_closest_junction, load_config
+from rsudeploysimcomp.Utils.utils import grid_cells_to_junction_coordinates, load_config
 from rsudeploysimcomp.VanetSimulatorInterface.vanet_sim_interface import (
     VanetSimulatorInterface,
     generate_deployment_file,
@@ -37,7 +37,12 @@ class BranchAndBound:
     def objective_function(self, solution):
         # Example: minimize the negative sum (simulating coverage maximization)
         junctions = self.to_junction_coordinates(solution)
-        generate_deployment_file(junctions, self.deployment_csv_path, self.deployment_parquet_path)
+        generate_deployment_file(
+            junctions,
+            self.deployment_csv_path,
+            self.deployment_parquet_path,
+            write_csv=self.config["VanetInterface"]["write_deployment_csv"],
+        )
         self.rsu_sim_interface.trigger_rsu_simulator()
         coverage, avg_distance = self.rsu_sim_interface.get_metrics_from_simulator()
         return coverage / avg_distance
@@ -65,14 +70,9 @@ class BranchAndBound:
         return grid_coords
 
     def grid_coord_to_junction_coordinates(self, solution):
-        junctions = []
-        for x, y in solution:
-            center_x = (x + 0.5) * (self.sumoparser.x_max / self.grid_size)
-            center_y = (y + 0.5) * (self.sumoparser.y_max / self.grid_size)
-            rsu_location = find_closest_junction(self.sumoparser, center_x, center_y)
-            adjusted_center_x, adjusted_center_y = adjust_coordinates_by_offsets(self.sumoparser, rsu_location)
-            junctions.append((adjusted_center_x, adjusted_center_y))
-        return junctions
+        return grid_cells_to_junction_coordinates(
+            self.sumoparser, [x for x, _ in solution], [y for _, y in solution]
+        )
 
     def run(self):
         # Initial setup
@@ -1,8 +1,7 @@
 import time
 
 from rsudeploysimcomp.Utils.utils import (
-    adjust_coordinates_by_offsets,
-    find_closest_junction,
+    grid_cells_to_junction_coordinates,
     load_config,
     new_location_is_within_reach,
     track_algorithm_exec_time,
@@ -56,17 +55,17 @@ class DensityBased:
         # Sort the list by density in descending order
         density_list.sort(key=lambda item: item[2], reverse=True)
 
+        # Get the junctions closest to the centers of all grid cells in one query
+        candidate_junctions = grid_cells_to_junction_coordinates(
+            self.sumoparser, [item[0] for item in density_list], [item[1] for item in density_list]
+        )
+
         # Pick the top locations based on vehicle density
         for i in range(len(density_list)):
             if len(self.picked_junctions) >= self.num_rsus:
                 break
 
-            x, y, _ = density_list[i]
-            # Get the junction closest to the center of the grid cell
-            center_x = (x + 0.5) * (self.sumoparser.x_max / self.grid_size)
-            center_y = (y + 0.5) * (self.sumoparser.y_max / self.grid_size)
-            rsu_location = find_closest_junction(self.sumoparser, center_x, center_y)
-            adjusted_center_x, adjusted_center_y = adjust_coordinates_by_offsets(self.sumoparser, rsu_location)
+            adjusted_center_x, adjusted_center_y = candidate_junctions[i]
             # Check if the location is within the reach of any already picked RSU
             if not new_location_is_within_reach(
                 (adjusted_center_x, adjusted_center_y), self.picked_junctions, self.rsu_radius
@@ -5,12 +5,7 @@ from collections import OrderedDict
 
 import pygad
 
-from rsudeploysimcomp.Utils.utils import (
-    adjust_coordinates_by_offsets,
-    find_closest_junction,
-    load_config,
-    track_algorithm_exec_time,
-)
+from rsudeploysimcomp.Utils.utils import load_config, track_algorithm_exec_time
 from rsudeploysimcomp.VanetSimulatorInterface.vanet_sim_interface import VanetSimulatorInterface, run_pipeline
 
 
@@ -158,16 +153,7 @@ class GARSUD:
         print(f"Number of Pipeline-Calls: {self.pipeline_counter}")
 
     def grid_index_to_junction_coordinates(self, solution):
-        junctions = []
-        for index in solution:
-            x = int(index % self.grid_size)
-            y = int(index // self.grid_size)
-            center_x = (x + 0.5) * (self.sumoparser.x_max / self.grid_size)
-            center_y = (y + 0.5) * (self.sumoparser.y_max / self.grid_size)
-            rsu_location = find_closest_junction(self.sumoparser, center_x, center_y)
-            adjusted_center_x, adjusted_center_y = adjust_coordinates_by_offsets(self.sumoparser, rsu_location)
-            junctions.append((adjusted_center_x, adjusted_center_y))
-        return junctions
+        return [(float(x), float(y)) for x, y in self.sumoparser.decode_population([solution])[0]]
 
     def solution_to_metrics(self, solution):
         junctions = self.grid_index_to_junction_coordinates(solution)
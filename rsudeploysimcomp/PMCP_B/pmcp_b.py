@@ -2,12 +2,7 @@ import time
 
 import numpy as np
 
-from rsudeploysimcomp.Utils.utils import (
-    adjust_coordinates_by_offsets,
-    find_closest_junction,
-    load_config,
-    track_algorithm_exec_time,
-)
+from rsudeploysimcomp.Utils.utils import load_config, track_algorithm_exec_time
 from rsudeploysimcomp.VanetSimulatorInterface.vanet_sim_interface import VanetSimulatorInterface, run_pipeline
 
 
@@ -30,8 +25,9 @@ class PMCB_P:
         self.grid_size = self.config["General"]["grid_size"]
 
         self.M = sumoparser.M  # 2D array with vehicle counts
-        self.P = sumoparser.P  # 2D array (sparsed) with migration ratios between locations
+        self.P = sumoparser.P  # Migration ratios between locations (sparse or stencil matrix)
         self.location_flows = np.zeros((self.grid_size, self.grid_size))
+        self.removed_vehicles = np.zeros(sumoparser.num_vehicles, dtype=bool)  # Vehicles already handled
         self.remaining_locations = set((x, y) for x in range(self.grid_size) for y in range(self.grid_size))
         self.picked_locations = set()
         self.picked_junctions = set()
@@ -116,12 +112,9 @@ class PMCB_P:
         # Find the location with the highest projected flow
         next_location = np.unravel_index(np.argmax(self.location_flows, axis=None), self.location_flows.shape)
 
-        # Get the junction closest to the center of the grid cell
-        center_x = (next_location[0] + 0.5) * (self.sumoparser.x_max / self.grid_size)
-        center_y = (next_location[1] + 0.5) * (self.sumoparser.y_max / self.grid_size)
-        rsu_location = find_closest_junction(self.sumoparser, center_x, center_y)
-
-        adjusted_center_x, adjusted_center_y = adjust_coordinates_by_offsets(self.sumoparser, rsu_location)
+        # Get the (offset-adjusted) junction closest to the center of the grid cell
+        rsu_location = self.sumoparser.cell_to_junction(next_location[0] * self.grid_size + next_location[1])
+        adjusted_center_x, adjusted_center_y = float(rsu_location[0]), float(rsu_location[1])
         # Add the best location to picked_locations
         self.picked_junctions.add((adjusted_center_x, adjusted_center_y))
         self.picked_locations.add(next_location)
@@ -131,16 +124,9 @@ class PMCB_P:
         # print(f"Picked location {next_location} with projected flow {self.location_flows[next_location]}")
 
     def update_M(self, picked_location):
-        if picked_location in self.sumoparser.location_vehicles:
-            location_vehicle = self.sumoparser.location_vehicles[picked_location]
-            for vehicle in location_vehicle:
-                if vehicle in self.sumoparser.vehicle_paths:
-                    self.sumoparser.vehicle_paths.pop(vehicle)
-            self.M = self.generate_M(self.sumoparser.vehicle_paths)
-
-    def generate_M(self, vehicle_paths):
-        new_M = np.zeros((self.grid_size, self.grid_size), dtype=int)  # Reset the matrix
-        for vehicle_id, path in vehicle_paths.items():
-            for cell in path:
-                new_M[cell[0], cell[1]] += 1
-        return new_M
+        # Remove the vehicles that pass the picked location from M
+        location_vehicles = self.sumoparser.vehicles_in_cell(picked_location)
+        location_vehicles = location_vehicles[~self.removed_vehicles[location_vehicles]]
+        if len(location_vehicles) > 0:
+            self.removed_vehicles[location_vehicles] = True
+            self.M = self.M - self.sumoparser.count_vehicles_per_cell(location_vehicles)
@@ -186,9 +186,9 @@ class Plotter:
     def run(self, algorithm_name, rsu_positions, coverage, avg_distance, save_path=None):
         if self.all_junctions is not None and self.run_plot_deployment_map:
             self.plot_deployment_map(rsu_positions, algorithm_name, coverage, avg_distance, save_path)
-        self.collect_coverage_data(algorithm_name, coverage, avg_distance)
+        self.collect_coverage_data(algorithm_name, rsu_positions, coverage, avg_distance)
 
-    def collect_coverage_data(self, algorithm_name, coverage, avg_distance):
+    def collect_coverage_data(self, algorithm_name, rsu_positions, coverage, avg_distance):
         """
         Collect coverage data for each simulation run to be used for aggregated plotting.
         """
@@ -196,25 +196,12 @@ class Plotter:
         num_rsus = self.rsu_sim_interface.num_rsus
         grid_size = self.rsu_sim_interface.grid_size
 
-        # Step 1: Parse relevant data from the RSU simulator interface
-        relevant_data = self.rsu_sim_interface.parse_relevant_data()
+        # Step 1: Aggregate the metrics of the deployment per time step
+        summary = self.rsu_sim_interface.summarize_deployment(rsu_positions)
 
-        # Step 2: Determine coverage - filter data based on RSU radius
-        relevant_data["within_coverage"] = relevant_data["distance"] <= rsu_radius
-
-        # Step 3: Calculate coverage percentage per RSU per time step
-        coverage_per_timestep_rsu = relevant_data.groupby(["time_step"])["within_coverage"].mean() * 100
-
-        # Step 4: Calculate average distance per RSU per time step
-        avg_distance_per_timestep_rsu = relevant_data.groupby("time_step")["distance"].mean()
-
-        # Step 5: Average these across RSUs to get a general view per timestep
-        coverage_per_timestep = coverage_per_timestep_rsu.groupby("time_step").mean()
-        avg_distance_per_timestep = avg_distance_per_timestep_rsu.groupby("time_step").mean()
-
-        # Convert these Series to lists for serialization
-        coverage_per_timestep_list = coverage_per_timestep.tolist()
-        avg_distance_per_timestep_list = avg_distance_per_timestep.tolist()
+        # Step 2: Coverage percentage and average distance per time step (empty if unavailable)
+        coverage_per_timestep_list = [] if summary is None else summary.coverage_per_time_step()
+        avg_distance_per_timestep_list = [] if summary is None else summary.avg_distance_per_time_step()
 
         if algorithm_name == "GARSUD":
             # Prepare the data to be saved
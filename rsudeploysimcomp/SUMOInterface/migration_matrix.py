@@ -0,0 +1,108 @@
+import numpy as np
+from scipy.sparse import coo_matrix, csr_matrix
+
+# Number of stencil entries per cell: the cell itself and its 8 neighbours
+STENCIL_SIZE = 9
+
+
+def stencil_index(dx, dy):
+    """Index into the stencil of the move by (dx, dy) cells, for -1 <= dx, dy <= 1."""
+    return (dx + 1) * 3 + (dy + 1)
+
+
+class StencilMigrationMatrix:
+    """
+    Compact migration matrix for large grids.
+
+    Almost all transitions between consecutive samples end in one of the 8 neighbouring cells, so the ratios
+    are kept in a dense (grid_size, grid_size, 9) stencil array, indexed by the from-cell and the move
+    (dx, dy). The few long jumps are kept in a sparse overflow matrix. Lookups use flat cell indices
+    (x_index * grid_size + y_index) exactly like the G² x G² sparse matrix.
+    """
+
+    def __init__(self, grid_size, stencil, overflow):
+        """
+        Args:
+            grid_size (int): Number of grid cells per axis.
+            stencil (numpy.ndarray): (grid_size, grid_size, 9) ratios of the moves to neighbouring cells.
+            overflow (scipy.sparse.csr_matrix): G² x G² ratios of all other moves.
+        """
+        self.grid_size = grid_size
+        self.stencil = stencil
+        self.overflow = overflow
+
+    @classmethod
+    def from_transition_counts(cls, transition_counts, grid_size):
+        """
+        Splits transition counts into stencil and overflow and scales each row to sum up to one, like
+        `normalize_migration_matrix`.
+
+        Args:
+            transition_counts (scipy.sparse.csr_matrix): Number of transitions between grid cells.
+            grid_size (int): Number of grid cells per axis.
+
+        Returns:
+            StencilMigrationMatrix: Migration ratios between grid cells.
+        """
+        num_cells = grid_size * grid_size
+        counts = transition_counts.tocoo()
+        from_x, from_y = np.divmod(counts.row.astype(np.int64), grid_size)
+        to_x, to_y = np.divmod(counts.col.astype(np.int64), grid_size)
+        dx = to_x - from_x
+        dy = to_y - from_y
+        local = (np.abs(dx) <= 1) & (np.abs(dy) <= 1)
+
+        stencil = np.zeros((grid_size, grid_size, STENCIL_SIZE), dtype=float)
+        np.add.at(stencil, (from_x[local], from_y[local], stencil_index(dx[local], dy[local])), counts.data[local])
+        overflow = coo_matrix(
+            (counts.data[~local], (counts.row[~local], counts.col[~local])), shape=(num_cells, num_cells)
+        ).tocsr()
+
+        row_sums = stencil.sum(axis=2).ravel() + np.asarray(overflow.sum(axis=1)).ravel()
+        inverse_row_sums = np.divide(1.0, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0)
+        stencil *= inverse_row_sums.reshape(grid_size, grid_size, 1)
+        overflow = csr_matrix(overflow.multiply(inverse_row_sums.reshape(-1, 1)))
+        return cls(grid_size, stencil, overflow)
+
+    @property
+    def shape(self):
+        num_cells = self.grid_size * self.grid_size
+        return num_cells, num_cells
+
+    def __getitem__(self, index):
+        """
+        Args:
+            index (tuple): (from, to) flat cell indices.
+
+        Returns:
+            float: Migration ratio from the first to the second cell.
+        """
+        from_cell, to_cell = index
+        from_x, from_y = divmod(int(from_cell), self.grid_size)
+        to_x, to_y = divmod(int(to_cell), self.grid_size)
+        dx = to_x - from_x
+        dy = to_y - from_y
+        if abs(dx) <= 1 and abs(dy) <= 1:
+            return float(self.stencil[from_x, from_y, stencil_index(dx, dy)])
+        return float(self.overflow[from_cell, to_cell])
+
+    def tocsr(self):
+        """
+        Returns:
+            scipy.sparse.csr_matrix: The migration ratios as G² x G² sparse matrix.
+        """
+        from_x, from_y, moves = np.nonzero(self.stencil)
+        dx, dy = np.divmod(moves, 3)
+        to_x = from_x + dx - 1
+        to_y = from_y + dy - 1
+        local = coo_matrix(
+            (
+                self.stencil[from_x, from_y, moves],
+                (from_x * self.grid_size + from_y, to_x * self.grid_size + to_y),
+            ),
+            shape=self.shape,
+        )
+        return (local.tocsr() + self.overflow).tocsr()
+
+    def toarray(self):
+        return self.tocsr().toarray()
@@ -0,0 +1,194 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from rsudeploysimcomp.Utils.utils import atomic_output_path
+
+# Layout of a record in the cell-sorted store
+RECORD_DTYPE = np.dtype([("time", np.float64), ("vehicle", np.int64), ("x", np.float64), ("y", np.float64)])
+
+# Layout of a record in the unsorted spill file, which additionally keeps the flat cell index
+SPILL_DTYPE = np.dtype(RECORD_DTYPE.descr + [("cell", np.int64)])
+
+# Number of spilled records scattered into the store at a time
+RECORD_SORT_BLOCK_SIZE = 1 << 20
+
+RECORDS_FILE = "records.npy"
+OFFSETS_FILE = "offsets.npy"
+VEHICLE_IDS_FILE = "vehicle_ids.npy"
+SPILL_FILE = "records.unsorted"
+
+# File in the store directory naming the version directory that holds the current records
+CURRENT_VERSION_FILE = "CURRENT"
+
+
+def write_record_store(store_path, batches, num_cells, vehicle_codes=None):
+    """
+    Writes FCD records to a store sorted by grid cell, using an external counting sort.
+
+    The records are spilled unsorted to disk while counting the records per cell. The prefix sum of these
+    counts gives the CSR offsets (cell -> record range), after which the spilled records are scattered into
+    a memory-mapped file block by block. Within each cell, records keep their original (time) order.
+
+    All files are written to a new version directory, which CURRENT_VERSION_FILE is atomically pointed to
+    once complete. Readers thus never see records and offsets of different writes, and concurrent writers
+    never share a file.
+
+    Args:
+        store_path (str): Directory of the store.
+        batches (iterable): (time, vehicle codes, xs, ys, flat cell indices) per batch of records, with a
+            scalar or per-record time.
+        num_cells (int): Number of grid cells.
+        vehicle_codes (dict, optional): Vehicle id -> code mapping the batches are coded with. Saved as the
+            vehicle ids of the store once all batches have been consumed.
+
+    Returns:
+        CellRecordStore: The written store.
+    """
+    os.makedirs(store_path, exist_ok=True)
+    version_path = tempfile.mkdtemp(prefix="version.", dir=store_path)
+    try:
+        write_record_files(version_path, batches, num_cells, vehicle_codes)
+        previous_version = read_current_version(store_path)
+        with atomic_output_path(os.path.join(store_path, CURRENT_VERSION_FILE)) as tmp_path:
+            with open(tmp_path, "w") as file:
+                file.write(os.path.basename(version_path))
+    except BaseException:
+        shutil.rmtree(version_path, ignore_errors=True)
+        raise
+    if previous_version is not None:
+        # Readers that still map the previous records keep them until they are closed
+        shutil.rmtree(os.path.join(store_path, previous_version), ignore_errors=True)
+    return CellRecordStore(store_path)
+
+
+def read_current_version(store_path):
+    """
+    Returns:
+        str: Name of the version directory holding the current records of a store, or None if there is none.
+    """
+    try:
+        with open(os.path.join(store_path, CURRENT_VERSION_FILE)) as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def write_record_files(version_path, batches, num_cells, vehicle_codes=None):
+    """
+    Writes the records, offsets and vehicle ids of `write_record_store` to a directory no one else writes to.
+    """
+    spill_path = os.path.join(version_path, SPILL_FILE)
+    counts = np.zeros(num_cells, dtype=np.int64)
+    num_records = 0
+    with open(spill_path, "wb") as spill:
+        for times, codes, xs, ys, cells in batches:
+            block = np.empty(len(cells), dtype=SPILL_DTYPE)
+            block["time"] = times
+            block["vehicle"] = codes
+            block["x"] = xs
+            block["y"] = ys
+            block["cell"] = cells
+            block.tofile(spill)
+            # Scatter-add instead of a full-length bincount, which would cost O(num_cells) per time step batch
+            np.add.at(counts, cells, 1)
+            num_records += len(cells)
+
+    offsets = np.zeros(num_cells + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    records = np.lib.format.open_memmap(
+        os.path.join(version_path, RECORDS_FILE), mode="w+", dtype=RECORD_DTYPE, shape=(num_records,)
+    )
+    if num_records > 0:
+        spilled = np.memmap(spill_path, dtype=SPILL_DTYPE, mode="r")
+        cursors = offsets[:-1].copy()
+        for start in range(0, num_records, RECORD_SORT_BLOCK_SIZE):
+            block = spilled[start : start + RECORD_SORT_BLOCK_SIZE]
+            order = np.argsort(block["cell"], kind="stable")
+            cells = block["cell"][order]
+            # Rank of each record within its cell in this block, appended after the records of earlier blocks
+            block_counts = np.bincount(cells, minlength=num_cells)
+            group_starts = np.cumsum(block_counts) - block_counts
+            targets = cursors[cells] + np.arange(len(cells)) - group_starts[cells]
+            sorted_block = block[order]
+            for field in RECORD_DTYPE.names:
+                records[field][targets] = sorted_block[field]
+            cursors += block_counts
+        del spilled
+    records.flush()
+    del records
+    os.remove(spill_path)
+
+    np.save(os.path.join(version_path, OFFSETS_FILE), offsets)
+    if vehicle_codes is not None:
+        np.save(os.path.join(version_path, VEHICLE_IDS_FILE), np.array(list(vehicle_codes), dtype=str))
+
+
+class CellRecordStore:
+    """
+    Read access to a cell-sorted record store written by `write_record_store`.
+
+    The records are memory-mapped, so the records of a cell are a zero-copy view and only the pages that are
+    actually read are loaded.
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        version = read_current_version(store_path)
+        if version is None:
+            raise FileNotFoundError(f"No record store at {store_path}")
+        version_path = os.path.join(store_path, version)
+        self.records = np.load(os.path.join(version_path, RECORDS_FILE), mmap_mode="r")
+        self.offsets = np.load(os.path.join(version_path, OFFSETS_FILE))
+        self.grid_size = int(round(np.sqrt(len(self.offsets) - 1)))
+        vehicle_ids_path = os.path.join(version_path, VEHICLE_IDS_FILE)
+        self.vehicle_ids = np.load(vehicle_ids_path) if os.path.exists(vehicle_ids_path) else None
+
+    @property
+    def num_records(self):
+        return len(self.records)
+
+    def count_records_per_cell(self):
+        """
+        Returns:
+            numpy.ndarray: 2D matrix of the number of records per grid cell.
+        """
+        return np.diff(self.offsets).reshape(self.grid_size, self.grid_size)
+
+    def records_in_cell(self, cell):
+        """
+        Returns the records of a grid cell, in time order.
+
+        Args:
+            cell (tuple): (x_index, y_index) of the grid cell.
+
+        Returns:
+            numpy.memmap: Zero-copy view of RECORD_DTYPE records.
+        """
+        flat_index = cell[0] * self.grid_size + cell[1]
+        return self.records[self.offsets[flat_index] : self.offsets[flat_index + 1]]
+
+    def records_in_neighborhood(self, cell, radius=1):
+        """
+        Returns the records of all grid cells within `radius` cells (Chebyshev distance) of a cell.
+
+        Cells with the same x_index and consecutive y_indices are stored back to back, so each row of the
+        neighborhood is a single zero-copy view.
+
+        Args:
+            cell (tuple): (x_index, y_index) of the center cell.
+            radius (int): Number of cells around the center cell in each direction.
+
+        Returns:
+            list: One view of RECORD_DTYPE records per x_index of the neighborhood.
+        """
+        y_start = max(0, cell[1] - radius)
+        y_end = min(self.grid_size, cell[1] + radius + 1)
+        rows = []
+        for x_index in range(max(0, cell[0] - radius), min(self.grid_size, cell[0] + radius + 1)):
+            start = self.offsets[x_index * self.grid_size + y_start]
+            end = self.offsets[x_index * self.grid_size + y_end]
+            rows.append(self.records[start:end])
+        return rows
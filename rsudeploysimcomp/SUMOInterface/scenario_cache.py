@@ -0,0 +1,137 @@
+import hashlib
+import os
+
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+from rsudeploysimcomp.Utils.utils import atomic_output_path
+
+# Bump whenever the layout of the cached arrays changes, so stale caches are never reused
+CACHE_FORMAT_VERSION = 7
+
+# Number of bytes hashed from the head and the tail of each source file
+FINGERPRINT_SAMPLE_SIZE = 1 << 20
+
+
+def file_fingerprint(file_path):
+    """
+    Computes a cheap content fingerprint of a (potentially multi-GB) file.
+
+    The fingerprint covers the file size, its modification time and the first and last
+    FINGERPRINT_SAMPLE_SIZE bytes, so any rewrite of the file invalidates it without hashing the whole trace.
+
+    Args:
+        file_path (str): Path to the file.
+
+    Returns:
+        str: Hex digest identifying the current content of the file.
+    """
+    stat = os.stat(file_path)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(file_path, "rb") as file:
+        digest.update(file.read(FINGERPRINT_SAMPLE_SIZE))
+        if stat.st_size > FINGERPRINT_SAMPLE_SIZE:
+            file.seek(max(FINGERPRINT_SAMPLE_SIZE, stat.st_size - FINGERPRINT_SAMPLE_SIZE))
+            digest.update(file.read(FINGERPRINT_SAMPLE_SIZE))
+    return digest.hexdigest()
+
+
+def directory_fingerprint(directory_path):
+    """
+    Combines the fingerprints of all files below a directory, including their relative paths.
+
+    Args:
+        directory_path (str): Path to the directory.
+
+    Returns:
+        str: Hex digest identifying the current content of the directory.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for directory, _, file_names in sorted(os.walk(directory_path)):
+        for file_name in sorted(file_names):
+            file_path = os.path.join(directory, file_name)
+            digest.update(f"{os.path.relpath(file_path, directory_path)}:".encode())
+            digest.update(file_fingerprint(file_path).encode())
+    return digest.hexdigest()
+
+
+def scenario_cache_key(source_paths, grid_size, bounds, options=None):
+    """
+    Builds the cache key of a preprocessed scenario.
+
+    Args:
+        source_paths (list): Paths of the source files (FCD, net) the scenario is derived from.
+        grid_size (int): Number of grid cells per axis.
+        bounds (tuple): (x_min, y_min, x_max, y_max) of the grid.
+        options (dict, optional): Further settings that change the cached products.
+
+    Returns:
+        str: Hex digest used as file name of the cache entry.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"v{CACHE_FORMAT_VERSION}|{grid_size}|{','.join(repr(float(b)) for b in bounds)}".encode())
+    for name in sorted(options or {}):
+        digest.update(f"|{name}={options[name]!r}".encode())
+    for source_path in source_paths:
+        digest.update(file_fingerprint(source_path).encode())
+    return digest.hexdigest()
+
+
+def save_scenario(cache_file_path, products):
+    """
+    Persists the preprocessed scenario products as an uncompressed .npz archive.
+
+    Sparse matrices are stored as their CSR data, indices, indptr and shape arrays. The archive is written to
+    a temporary file first and moved into place afterwards, so concurrent readers never observe a partially
+    written cache entry.
+
+    Args:
+        cache_file_path (str): Target path of the .npz archive.
+        products (dict): Product name -> numpy.ndarray or scipy.sparse matrix.
+    """
+    arrays = {}
+    for name, product in products.items():
+        if issparse(product):
+            product = product.tocsr()
+            arrays[f"{name}__data"] = product.data
+            arrays[f"{name}__indices"] = product.indices
+            arrays[f"{name}__indptr"] = product.indptr
+            arrays[f"{name}__shape"] = np.array(product.shape)
+        else:
+            arrays[name] = product
+
+    # np.savez appends .npz to paths without it
+    with atomic_output_path(cache_file_path, suffix=".tmp.npz") as tmp_file_path:
+        np.savez(tmp_file_path, **arrays)
+
+
+def load_scenario(cache_file_path, names=None):
+    """
+    Loads a scenario persisted by `save_scenario`.
+
+    Args:
+        cache_file_path (str): Path of the .npz archive.
+        names (iterable, optional): Names of the products to load. All products if None.
+
+    Returns:
+        dict: Product name -> numpy.ndarray or scipy.sparse.csr_matrix, or None if there is no cache entry.
+            Requested products missing from the entry are left out.
+    """
+    if not os.path.exists(cache_file_path):
+        return None
+
+    products = {}
+    with np.load(cache_file_path, allow_pickle=False) as archive:
+        for name in archive.files:
+            if "__" not in name:
+                if names is None or name in names:
+                    products[name] = archive[name]
+            elif name.endswith("__shape"):
+                name = name[: -len("__shape")]
+                if names is None or name in names:
+                    products[name] = csr_matrix(
+                        (archive[f"{name}__data"], archive[f"{name}__indices"], archive[f"{name}__indptr"]),
+                        shape=tuple(archive[f"{name}__shape"]),
+                    )
+    return products
@@ -1,9 +1,21 @@
+import copy
+import gzip
+import itertools
 import math
+import os
+import time
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
-from scipy.sparse import lil_matrix
+import pyarrow as pa
+import pyarrow.parquet as pq
+from scipy.sparse import coo_matrix, csr_matrix, diags
+from scipy.spatial import cKDTree
 
+from rsudeploysimcomp.SUMOInterface.migration_matrix import StencilMigrationMatrix
+from rsudeploysimcomp.SUMOInterface.record_store import write_record_store
+from rsudeploysimcomp.SUMOInterface.scenario_cache import load_scenario, save_scenario, scenario_cache_key
 from rsudeploysimcomp.Utils.utils import load_config
 
 config = load_config()
@@ -15,6 +27,13 @@ path_to_fcd_xml = (
     + "/koln_fcd.xml"
 )
 
+path_to_fcd_parquet = (
+    config["General"]["base_path"]
+    + config["VanetInterface"]["input_path"]
+    + config["VanetInterface"]["scenario"]
+    + config["VanetInterface"]["fcd_parquet"]
+)
+
 path_to_net_xml_gx = (
     config["General"]["base_path"]
     + config["VanetInterface"]["raw_path"]
@@ -22,85 +41,1095 @@ path_to_net_xml_gx = (
     + "/koln.net.xml"
 )
 
+# Size of the blocks read from the FCD file when parsing byte ranges or searching chunk boundaries
+FCD_READ_BLOCK_SIZE = 1 << 20
+
+# Number of chunks per worker, so that unevenly dense parts of the trace are balanced across the pool
+FCD_CHUNKS_PER_WORKER = 4
+
+# Number of rows per record batch read from a columnar (Parquet) FCD file
+FCD_PARQUET_BATCH_SIZE = 1 << 20
 
-def find_element_attribute_in_xml_gz(gz_file_path, tag_name, attribute_name):
+# Number of buffered (vehicle, cell) pair keys before they are deduplicated during ingestion
+PAIR_KEY_BUFFER_SIZE = 1 << 22
+
+
+def open_xml(file_path):
+    """Opens a plain or gzip-compressed XML file for binary reading, detected by its magic bytes."""
+    with open(file_path, "rb") as file:
+        magic = file.read(2)
+    if magic == b"\x1f\x8b":
+        return gzip.open(file_path, "rb")
+    return open(file_path, "rb")
+
+
+class SUMONet:
+    """
+    Location and junctions of a SUMO network, as extracted by `parse_net_file`.
     """
-    Finds the specified attribute of the first occurrence of a given tag in an XML file.
+
+    def __init__(self):
+        self.conv_boundary = None  # (x_min, y_min, x_max, y_max) of the network in net coordinates
+        self.net_offset = None  # (x, y) offset between the original and the net coordinates
+        self.junction_ids = np.empty(0, dtype=str)
+        self.junction_xy = np.empty((0, 2), dtype=float)
+        self.junction_types = np.empty(0, dtype=np.int16)  # Codes into junction_type_names
+        self.junction_type_names = np.empty(0, dtype=str)
+
+
+def parse_net_file(net_path, skip_internal_junctions=False, location_only=False):
+    """
+    Extracts the location element and all junctions of a SUMO network in a single streaming pass.
+
+    Every top-level element is cleared once it has been consumed, so memory is bounded by the junction
+    arrays instead of the whole network tree.
 
     Args:
-        gz_file_path (str): Path to the .gz compressed XML file.
-        tag_name (str): The name of the XML tag to search for.
-        attribute_name (str): The name of the attribute to retrieve.
+        net_path (str): Path to the plain or .gz compressed net.xml file.
+        skip_internal_junctions (bool): Drop junctions of type "internal".
+        location_only (bool): Stop right after the location element, which precedes the junctions.
 
     Returns:
-        The value of the specified attribute, or None if the tag or attribute is not found.
+        SUMONet: Location and junctions of the network.
+    """
+    net = SUMONet()
+    junction_ids = []
+    junction_x = []
+    junction_y = []
+    junction_types = []
+    type_codes = {}
+    depth = 0
+    with open_xml(net_path) as file:
+        context = ET.iterparse(file, events=("start", "end"))
+        _, root = next(context)
+        for event, elem in context:
+            if event == "start":
+                depth += 1
+                continue
+            depth -= 1
+            if depth > 0:
+                continue
+            if elem.tag == "location":
+                conv_boundary = elem.get("convBoundary")
+                net_offset = elem.get("netOffset")
+                if conv_boundary is not None:
+                    net.conv_boundary = tuple(float(value) for value in conv_boundary.split(","))
+                if net_offset is not None:
+                    net.net_offset = tuple(float(value) for value in net_offset.split(","))
+                if location_only:
+                    break
+            elif elem.tag == "junction":
+                junction_type = elem.get("type")
+                if not (skip_internal_junctions and junction_type == "internal"):
+                    junction_ids.append(elem.get("id"))
+                    junction_x.append(elem.get("x"))
+                    junction_y.append(elem.get("y"))
+                    junction_types.append(type_codes.setdefault(junction_type, len(type_codes)))
+            # Drop the processed top-level element from the partially built tree
+            root.clear()
+
+    net.junction_ids = np.array(junction_ids, dtype=str)
+    net.junction_xy = np.column_stack(
+        (np.array(junction_x, dtype=float), np.array(junction_y, dtype=float))
+    ).reshape(-1, 2)
+    net.junction_types = np.array(junction_types, dtype=np.int16)
+    net.junction_type_names = np.array(list(type_codes), dtype=str)
+    return net
+
+
+def _timestep_records(elem):
+    vehicle_ids = []
+    xs = []
+    ys = []
+    for vehicle in elem.iter("vehicle"):
+        vehicle_ids.append(vehicle.get("id"))
+        xs.append(vehicle.get("x"))
+        ys.append(vehicle.get("y"))
+    return float(elem.get("time")), vehicle_ids, np.array(xs, dtype=float), np.array(ys, dtype=float)
+
+
+def iter_fcd_timesteps(fcd_path, byte_range=None):
     """
-    try:
-        # Create an iterator to parse the XML incrementally
-        context = ET.iterparse(gz_file_path, events=("start", "end"))
+    Incrementally parses a SUMO FCD file, yielding one <timestep> at a time.
+
+    Each timestep element (and everything parsed before it) is cleared from the tree once it has been
+    consumed, so peak memory is bounded by a single timestep instead of the whole trace.
+
+    Args:
+        fcd_path (str): Path to the FCD XML file.
+        byte_range (tuple, optional): (start, end) byte offsets of a run of complete <timestep> elements,
+            as returned by `find_fcd_chunk_boundaries`. Parses the whole file if None.
 
-        # Iterate through the parsed elements
+    Yields:
+        float, list, numpy.ndarray, numpy.ndarray: Simulation time, vehicle ids, x- and y-coordinates
+        of the timestep.
+    """
+    if byte_range is None:
+        context = ET.iterparse(fcd_path, events=("start", "end"))
+        _, root = next(context)
         for event, elem in context:
-            # Check if the current element matches the specified tag
-            if event == "start" and elem.tag == tag_name:
-                # Extract the specified attribute
-                attribute_value = elem.get(attribute_name)
+            if event == "end" and elem.tag == "timestep":
+                yield _timestep_records(elem)
+                # Drop the processed timestep (and any whitespace siblings) from the partially built tree
+                root.clear()
+        return
+
+    # A byte range is not a well-formed document on its own, so wrap it into a synthetic root element
+    start, end = byte_range
+    parser = ET.XMLPullParser(events=("start", "end"))
+    parser.feed(b"<fcd-export>")
+    _, root = next(parser.read_events())
+    with open(fcd_path, "rb") as file:
+        file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = file.read(min(FCD_READ_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            parser.feed(block)
+            for event, elem in parser.read_events():
+                if event == "end" and elem.tag == "timestep":
+                    yield _timestep_records(elem)
+                    root.clear()
+    parser.feed(b"</fcd-export>")
+    parser.close()
 
-                # Clear the element to free up memory
-                elem.clear()
 
-                return attribute_value
+def iter_fcd_parquet_timesteps(parquet_path, columns, time_scale=1.0, offset=(0.0, 0.0)):
+    """
+    Scans a columnar FCD file (e.g. the koln_fcd.parquet written by prep-disolv), yielding one timestep at a
+    time.
 
-            # Clear the element to free up memory
-            elem.clear()
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return None
+    Only the time, id, x and y columns are read, in record batches of FCD_PARQUET_BATCH_SIZE rows. The rows
+    must be ordered by time; a timestep spanning two batches is carried over and yielded once.
 
-    return None
+    Args:
+        parquet_path (str): Path to the Parquet file.
+        columns (dict): Column names of the "time", "id", "x" and "y" fields.
+        time_scale (float): Seconds per unit of the time column.
+        offset (tuple): (x, y) added to the coordinates to get back to net coordinates.
 
+    Yields:
+        float, list, numpy.ndarray, numpy.ndarray: Simulation time, vehicle ids, x- and y-coordinates
+        of the timestep.
 
-def parse_max_xy():
-    conv_boundary = find_element_attribute_in_xml_gz(path_to_net_xml_gx, "location", "convBoundary")
-    if conv_boundary is None:
-        return -1, -1
-    else:
-        conv_boundary_values = [float(x) for x in conv_boundary.split(",")]
-        x_max = conv_boundary_values[2]
-        y_max = conv_boundary_values[3]
-        return x_max, y_max
+    Raises:
+        ValueError: If the time decreases within or across record batches.
+    """
+    fields = [columns["time"], columns["id"], columns["x"], columns["y"]]
+    parquet_file = pq.ParquetFile(parquet_path)
+    pending = None
+    for batch in parquet_file.iter_batches(batch_size=FCD_PARQUET_BATCH_SIZE, columns=fields):
+        times, xs, ys = (batch.column(columns[name]).to_numpy(zero_copy_only=False) for name in ("time", "x", "y"))
+        # Vehicle ids are strings, as in the XML FCD
+        vehicle_ids = batch.column(columns["id"]).cast(pa.string()).to_numpy(zero_copy_only=False)
+        xs = xs + offset[0]
+        ys = ys + offset[1]
+        if pending is not None:
+            times, vehicle_ids, xs, ys = (
+                np.concatenate(arrays) for arrays in zip(pending, (times, vehicle_ids, xs, ys))
+            )
+        # The carried over timestep is part of the batch now, so this also covers the order across batches
+        if np.any(times[1:] < times[:-1]):
+            raise ValueError(f"The rows of {parquet_path} are not ordered by {columns['time']}")
+        # Rows at which a new timestep starts; the last timestep may continue in the next batch
+        starts = np.concatenate(([0], np.flatnonzero(times[1:] != times[:-1]) + 1))
+        for start, end in zip(starts[:-1], starts[1:]):
+            yield float(times[start]) * time_scale, vehicle_ids[start:end].tolist(), xs[start:end], ys[start:end]
+        last = starts[-1] if len(times) > 0 else 0
+        pending = (times[last:], vehicle_ids[last:], xs[last:], ys[last:])
+    if pending is not None and len(pending[0]) > 0:
+        times, vehicle_ids, xs, ys = pending
+        yield float(times[0]) * time_scale, vehicle_ids.tolist(), xs, ys
 
 
-def parse_net_offset():
-    net_offset = find_element_attribute_in_xml_gz(path_to_net_xml_gx, "location", "netOffset")
-    if net_offset is None:
-        return -1, -1
-    else:
-        net_offset_values = [float(x) for x in net_offset.split(",")]
-        x_offset = net_offset_values[0]
-        y_offset = net_offset_values[1]
-        return x_offset, y_offset
+def find_fcd_chunk_boundaries(fcd_path, num_chunks):
+    """
+    Splits an FCD file into byte ranges that each hold a run of complete <timestep> elements.
 
+    Args:
+        fcd_path (str): Path to the FCD XML file.
+        num_chunks (int): Desired number of chunks. Fewer are returned for small files.
+
+    Returns:
+        list: (start, end) byte offsets, ordered by simulation time.
+    """
+    file_size = os.path.getsize(fcd_path)
+    with open(fcd_path, "rb") as file:
+        first_timestep = _find_timestep_tag(file, 0)
+        if first_timestep is None:
+            return []
+        # The last chunk ends right after the last closing </timestep> tag
+        tail_start = max(0, file_size - FCD_READ_BLOCK_SIZE)
+        file.seek(tail_start)
+        tail = file.read()
+        closing = tail.rfind(b"</timestep>")
+        while closing < 0 and tail_start > 0:
+            tail_start = max(0, tail_start - FCD_READ_BLOCK_SIZE)
+            file.seek(tail_start)
+            tail = file.read()
+            closing = tail.rfind(b"</timestep>")
+        last_timestep_end = tail_start + closing + len(b"</timestep>") if closing >= 0 else file_size
+
+        boundaries = [first_timestep]
+        for i in range(1, num_chunks):
+            offset = _find_timestep_tag(
+                file, first_timestep + (last_timestep_end - first_timestep) * i // num_chunks
+            )
+            if offset is not None and boundaries[-1] < offset < last_timestep_end:
+                boundaries.append(offset)
+        boundaries.append(last_timestep_end)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _find_timestep_tag(file, offset):
+    """Returns the byte offset of the first <timestep> opening tag at or after `offset`, or None."""
+    file.seek(offset)
+    overlap = b""
+    while True:
+        block = file.read(FCD_READ_BLOCK_SIZE)
+        if not block:
+            return None
+        data = overlap + block
+        position = 0
+        while True:
+            position = data.find(b"<timestep", position)
+            if position < 0 or position + len(b"<timestep") >= len(data):
+                break
+            # Skip tags that merely share the prefix
+            if data[position + len(b"<timestep")] in b" \t\r\n>":
+                return offset - len(overlap) + position
+            position += 1
+        offset += len(block)
+        overlap = data[-len(b"<timestep") :]
+
+
+def _grow(array, size, fill_value):
+    """Returns `array` enlarged (at least doubled) to hold `size` entries, padding with `fill_value`."""
+    if size <= len(array):
+        return array
+    grown = np.full(max(size, 2 * len(array)), fill_value, dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
+
+
+def intern_vehicle_ids(vehicle_ids, vehicle_codes):
+    """
+    Maps vehicle id strings to dense integer codes, assigning new codes in order of first appearance.
+
+    Args:
+        vehicle_ids (list): Vehicle id strings.
+        vehicle_codes (dict): Vehicle id -> code, extended by the ids seen for the first time.
+
+    Returns:
+        numpy.ndarray: Codes of the given vehicle ids.
+    """
+    return np.fromiter(
+        (vehicle_codes.setdefault(vehicle_id, len(vehicle_codes)) for vehicle_id in vehicle_ids),
+        dtype=np.int64,
+        count=len(vehicle_ids),
+    )
+
+
+def sum_by_key(keys, counts):
+    """
+    Sums up counts that share the same int64 key.
+
+    Returns:
+        numpy.ndarray, numpy.ndarray: Sorted unique keys and their summed counts.
+    """
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    return unique_keys, np.bincount(inverse, weights=counts, minlength=len(unique_keys)).astype(np.int64)
+
+
+def track_vehicle_cells(codes, cells, last_cells):
+    """
+    Advances the last known cell of each vehicle by a batch of records and extracts the cell transitions.
+
+    The records must be ordered by time; a vehicle may occur several times within the batch.
+
+    Args:
+        codes (numpy.ndarray): Vehicle code of each record.
+        cells (numpy.ndarray): Flat cell index of each record.
+        last_cells (numpy.ndarray): Last known cell per vehicle code (-1 if unknown), updated in place.
+
+    Returns:
+        numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray: Codes and cells of the vehicles seen for
+        the first time, and the from/to cells of all transitions between different cells.
+    """
+    order = np.argsort(codes, kind="stable")
+    sorted_codes = codes[order]
+    sorted_cells = cells[order]
+    group_start = np.ones(len(sorted_codes), dtype=bool)
+    group_start[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    group_end = np.ones(len(sorted_codes), dtype=bool)
+    group_end[:-1] = group_start[1:]
+
+    previous_cells = np.empty_like(sorted_cells)
+    previous_cells[1:] = sorted_cells[:-1]
+    previous_cells[group_start] = last_cells[sorted_codes[group_start]]
+    last_cells[sorted_codes[group_end]] = sorted_cells[group_end]
+
+    new = previous_cells < 0
+    moved = ~new & (previous_cells != sorted_cells)
+    return sorted_codes[new], sorted_cells[new], previous_cells[moved], sorted_cells[moved]
+
+
+class FCDChunk:
+    """
+    Partial ingestion products of a run of consecutive timesteps.
+
+    Chunks are produced independently (possibly in worker processes) and merged in timestep order by an
+    `FCDAccumulator`. Vehicles are coded locally in order of first appearance; the first and last cell of
+    each vehicle are kept so that transitions across chunk borders are not lost.
+    """
 
-class SUMOParser:
     def __init__(self):
+        self.num_records = 0
+        self.vehicle_ids = []
+        self.first_cells = np.empty(0, dtype=np.int64)
+        self.last_cells = np.empty(0, dtype=np.int64)
+        self.pair_keys = np.empty(0, dtype=np.int64)
+        # Transitions per pair of cells, keyed by from_cell * num_cells + to_cell
+        self.transition_keys = np.empty(0, dtype=np.int64)
+        self.transition_counts = np.empty(0, dtype=np.int64)
+        # Vehicle records per (time bucket, cell), keyed by bucket * num_cells + cell
+        self.occupancy_keys = np.empty(0, dtype=np.int64)
+        self.occupancy_counts = np.empty(0, dtype=np.int64)
+        # Number of timesteps per time bucket
+        self.buckets = np.empty(0, dtype=np.int64)
+        self.bucket_timesteps = np.empty(0, dtype=np.int64)
+
+
+def parse_fcd_chunk(
+    fcd_path, byte_range, grid, time_bucket_size=None, progress=None, collect_pairs=True, collect_transitions=True
+):
+    """
+    Ingests the timesteps in `byte_range` of an FCD XML file.
+
+    Args:
+        fcd_path (str): Path to the FCD XML file.
+        byte_range (tuple): (start, end) byte offsets, or None for the whole file.
+        grid (tuple): (x_min, y_min, x_step, y_step, grid_size) passed on to `bin_positions`.
+        time_bucket_size (float, optional): Length of the time buckets of the occupancy tensor in seconds.
+            The occupancy is not collected if None.
+        progress (IngestionProgress, optional): Updated after every timestep.
+        collect_pairs (bool): Collect the (vehicle, cell) pairs.
+        collect_transitions (bool): Collect the cell transitions.
+
+    Returns:
+        FCDChunk: Visited cells, first/last cell per vehicle, the cell transitions and the occupancy within
+        the chunk.
+    """
+    return ingest_fcd_timesteps(
+        iter_fcd_timesteps(fcd_path, byte_range),
+        grid,
+        time_bucket_size,
+        progress,
+        collect_pairs,
+        collect_transitions,
+    )
+
+
+def ingest_fcd_timesteps(
+    timesteps, grid, time_bucket_size=None, progress=None, collect_pairs=True, collect_transitions=True
+):
+    """
+    Bins a time-ordered stream of FCD timesteps into an FCDChunk.
+
+    Only the requested products are collected; vehicles are not even coded if neither the (vehicle, cell)
+    pairs nor the transitions are needed.
+
+    Args:
+        timesteps (iterable): (time, vehicle ids, xs, ys) per timestep, as yielded by `iter_fcd_timesteps`
+            or `iter_fcd_parquet_timesteps`.
+        grid (tuple): (x_min, y_min, x_step, y_step, grid_size) passed on to `bin_positions`.
+        time_bucket_size (float, optional): Length of the time buckets of the occupancy tensor in seconds.
+            The occupancy is not collected if None.
+        progress (IngestionProgress, optional): Updated after every timestep.
+        collect_pairs (bool): Collect the (vehicle, cell) pairs.
+        collect_transitions (bool): Collect the cell transitions.
+
+    Returns:
+        FCDChunk: Visited cells, first/last cell per vehicle, the cell transitions and the occupancy of the
+        timesteps.
+    """
+    num_cells = grid[-1] * grid[-1]
+    chunk = FCDChunk()
+    vehicle_codes = {}
+    first_cells = np.full(0, -1, dtype=np.int64)
+    last_cells = np.full(0, -1, dtype=np.int64)
+    pair_keys = []
+    num_buffered_keys = 0
+    num_unique_keys = 0
+    transition_keys = []
+    transition_counts = []
+    num_buffered_transitions = 0
+    num_unique_transitions = 0
+    timestep_buckets = []
+    occupancy_keys = []
+    occupancy_counts = []
+    num_buffered_occupancy = 0
+    num_unique_occupancy = 0
+    for timestep, vehicle_ids, xs, ys in timesteps:
+        cells = bin_positions(xs, ys, *grid)
+        if collect_pairs or collect_transitions:
+            codes = intern_vehicle_ids(vehicle_ids, vehicle_codes)
+
+        if collect_transitions:
+            first_cells = _grow(first_cells, len(vehicle_codes), -1)
+            last_cells = _grow(last_cells, len(vehicle_codes), -1)
+            new_codes, new_cells, transitions_from, transitions_to = track_vehicle_cells(codes, cells, last_cells)
+            first_cells[new_codes] = new_cells
+            # Summed up per pair of cells like the occupancy, so memory is bounded by the distinct transitions
+            transition_keys.append(transitions_from * num_cells + transitions_to)
+            transition_counts.append(np.ones(len(transitions_from), dtype=np.int64))
+            num_buffered_transitions += len(transitions_from)
+            if num_buffered_transitions > max(PAIR_KEY_BUFFER_SIZE, 2 * num_unique_transitions):
+                keys, counts = sum_by_key(np.concatenate(transition_keys), np.concatenate(transition_counts))
+                transition_keys, transition_counts = [keys], [counts]
+                num_unique_transitions = num_buffered_transitions = len(keys)
+
+        if collect_pairs:
+            # (vehicle, cell) pairs, deduplicated whenever the buffer outgrows the unique pairs seen so far
+            pair_keys.append(codes * num_cells + cells)
+            num_buffered_keys += len(codes)
+            if num_buffered_keys > max(PAIR_KEY_BUFFER_SIZE, 2 * num_unique_keys):
+                pair_keys = [np.unique(np.concatenate(pair_keys))]
+                num_unique_keys = num_buffered_keys = len(pair_keys[0])
+
+        if time_bucket_size is not None:
+            bucket = int(timestep // time_bucket_size)
+            timestep_buckets.append(bucket)
+            occupancy_keys.append(bucket * num_cells + cells)
+            occupancy_counts.append(np.ones(len(cells), dtype=np.int64))
+            num_buffered_occupancy += len(cells)
+            if num_buffered_occupancy > max(PAIR_KEY_BUFFER_SIZE, 2 * num_unique_occupancy):
+                keys, counts = sum_by_key(np.concatenate(occupancy_keys), np.concatenate(occupancy_counts))
+                occupancy_keys, occupancy_counts = [keys], [counts]
+                num_unique_occupancy = num_buffered_occupancy = len(keys)
+
+        chunk.num_records += len(vehicle_ids)
+        if progress is not None:
+            progress.update(len(vehicle_ids))
+
+    num_vehicles = len(vehicle_codes)
+    chunk.vehicle_ids = list(vehicle_codes)
+    chunk.first_cells = _grow(first_cells, num_vehicles, -1)[:num_vehicles]
+    chunk.last_cells = _grow(last_cells, num_vehicles, -1)[:num_vehicles]
+    chunk.pair_keys = np.unique(np.concatenate(pair_keys)) if pair_keys else chunk.pair_keys
+    if transition_keys:
+        chunk.transition_keys, chunk.transition_counts = sum_by_key(
+            np.concatenate(transition_keys), np.concatenate(transition_counts)
+        )
+    if occupancy_keys:
+        chunk.occupancy_keys, chunk.occupancy_counts = sum_by_key(
+            np.concatenate(occupancy_keys), np.concatenate(occupancy_counts)
+        )
+    if timestep_buckets:
+        chunk.buckets, chunk.bucket_timesteps = np.unique(timestep_buckets, return_counts=True)
+    return chunk
+
+
+class FCDAccumulator:
+    """
+    Merges FCDChunks, in timestep order, into the vehicle codes, (vehicle, cell) pairs and transitions of a
+    whole trace.
+    """
+
+    def __init__(self, grid_size):
+        self.num_cells = grid_size * grid_size
+        self.num_records = 0
+        self.vehicle_codes = {}
+        self.last_cells = np.full(0, -1, dtype=np.int64)
+        self.pair_keys = []
+        self.buffered_transition_keys = []
+        self.buffered_transition_counts = []
+        self.num_buffered_transitions = 0
+        self.num_unique_transitions = 0
+        self.occupancy_keys = []
+        self.occupancy_counts = []
+        self.buckets = []
+        self.bucket_timesteps = []
+        self.base_transition_counts = None
+
+    @classmethod
+    def restore(
+        cls,
+        grid_size,
+        vehicle_ids,
+        vehicle_cells,
+        vehicle_last_cells,
+        transition_counts,
+        occupancy=None,
+        timesteps_per_bucket=None,
+    ):
+        """
+        Rebuilds the state of an ingested trace from its products, so that the chunks of an appended FCD
+        segment can be merged without re-ingesting the trace.
+
+        Args:
+            grid_size (int): Number of grid cells per axis.
+            vehicle_ids (numpy.ndarray): Vehicle id strings, indexed by vehicle code.
+            vehicle_cells (scipy.sparse.csr_matrix): Vehicle x cell incidence matrix.
+            vehicle_last_cells (numpy.ndarray): Last cell per vehicle code (-1 if unknown).
+            transition_counts (scipy.sparse.csr_matrix): Number of transitions between grid cells.
+            occupancy (scipy.sparse.csr_matrix, optional): Vehicle records per (time bucket, cell).
+            timesteps_per_bucket (numpy.ndarray, optional): Number of timesteps per time bucket.
+
+        Returns:
+            FCDAccumulator: Accumulator holding the state of the trace.
+        """
+        accumulator = cls(grid_size)
+        accumulator.vehicle_codes = {str(vehicle_id): code for code, vehicle_id in enumerate(vehicle_ids)}
+        accumulator.last_cells = np.array(vehicle_last_cells, dtype=np.int64)
+        codes = np.repeat(np.arange(vehicle_cells.shape[0], dtype=np.int64), np.diff(vehicle_cells.indptr))
+        accumulator.pair_keys = [codes * accumulator.num_cells + vehicle_cells.indices]
+        accumulator.base_transition_counts = transition_counts
+        if occupancy is not None:
+            counts = occupancy.tocoo()
+            accumulator.occupancy_keys = [counts.row.astype(np.int64) * accumulator.num_cells + counts.col]
+            accumulator.occupancy_counts = [counts.data.astype(np.int64)]
+            buckets = np.flatnonzero(timesteps_per_bucket)
+            accumulator.buckets = [buckets]
+            accumulator.bucket_timesteps = [np.asarray(timesteps_per_bucket)[buckets]]
+        return accumulator
+
+    def merge(self, chunk):
+        codes = intern_vehicle_ids(chunk.vehicle_ids, self.vehicle_codes)
+        self.last_cells = _grow(self.last_cells, len(self.vehicle_codes), -1)
+
+        # Transitions between the last cell before the chunk and the first cell within it
+        previous_cells = self.last_cells[codes]
+        moved = (previous_cells >= 0) & (previous_cells != chunk.first_cells)
+        self.add_transitions(
+            previous_cells[moved] * self.num_cells + chunk.first_cells[moved], np.ones(np.count_nonzero(moved))
+        )
+        self.add_transitions(chunk.transition_keys, chunk.transition_counts)
+        self.last_cells[codes] = chunk.last_cells
+
+        local_codes, cells = np.divmod(chunk.pair_keys, self.num_cells)
+        self.pair_keys.append(codes[local_codes] * self.num_cells + cells)
+        self.occupancy_keys.append(chunk.occupancy_keys)
+        self.occupancy_counts.append(chunk.occupancy_counts)
+        self.buckets.append(chunk.buckets)
+        self.bucket_timesteps.append(chunk.bucket_timesteps)
+        self.num_records += chunk.num_records
+
+    def add_transitions(self, keys, counts):
+        """Buffers transition counts, summing them up whenever the buffer outgrows the distinct transitions."""
+        self.buffered_transition_keys.append(keys)
+        self.buffered_transition_counts.append(np.asarray(counts, dtype=np.int64))
+        self.num_buffered_transitions += len(keys)
+        if self.num_buffered_transitions > max(PAIR_KEY_BUFFER_SIZE, 2 * self.num_unique_transitions):
+            self.sum_transitions()
+
+    def sum_transitions(self):
+        """
+        Returns:
+            numpy.ndarray, numpy.ndarray: Sorted unique transition keys and their counts.
+        """
+        keys, counts = sum_by_key(
+            np.concatenate([np.empty(0, dtype=np.int64)] + self.buffered_transition_keys),
+            np.concatenate([np.empty(0, dtype=np.int64)] + self.buffered_transition_counts),
+        )
+        self.buffered_transition_keys, self.buffered_transition_counts = [keys], [counts]
+        self.num_unique_transitions = self.num_buffered_transitions = len(keys)
+        return keys, counts
+
+    def vehicle_ids(self):
+        """Vehicle id strings, indexed by vehicle code."""
+        return np.array(list(self.vehicle_codes), dtype=str)
+
+    def vehicle_last_cells(self):
+        """Last cell per vehicle code (-1 if unknown)."""
+        return self.last_cells[: len(self.vehicle_codes)].copy()
+
+    def vehicle_cells(self):
+        """Vehicle x cell incidence matrix (1 where a vehicle visited a cell)."""
+        self.pair_keys = [np.unique(np.concatenate(self.pair_keys))] if self.pair_keys else []
+        return build_incidence_matrix(
+            self.pair_keys[0] if self.pair_keys else np.empty(0, dtype=np.int64),
+            len(self.vehicle_codes),
+            self.num_cells,
+        )
+
+    def occupancy(self):
+        """
+        Time-resolved occupancy over all merged chunks.
+
+        Returns:
+            scipy.sparse.csr_matrix, numpy.ndarray: Vehicle records per (time bucket, cell) and the number of
+            timesteps per time bucket.
+        """
+        buckets, bucket_timesteps = sum_by_key(
+            np.concatenate([np.empty(0, dtype=np.int64)] + self.buckets),
+            np.concatenate([np.empty(0, dtype=np.int64)] + self.bucket_timesteps),
+        )
+        num_buckets = int(buckets[-1]) + 1 if len(buckets) > 0 else 0
+        timesteps_per_bucket = np.zeros(num_buckets, dtype=np.int64)
+        timesteps_per_bucket[buckets] = bucket_timesteps
+
+        keys, counts = sum_by_key(
+            np.concatenate([np.empty(0, dtype=np.int64)] + self.occupancy_keys),
+            np.concatenate([np.empty(0, dtype=np.int64)] + self.occupancy_counts),
+        )
+        self.occupancy_keys, self.occupancy_counts = [keys], [counts]
+        rows, cells = np.divmod(keys, self.num_cells)
+        occupancy = coo_matrix((counts, (rows, cells)), shape=(num_buckets, self.num_cells)).tocsr()
+        return occupancy, timesteps_per_bucket
+
+    def transition_counts(self):
+        """Number of transitions between grid cells over all merged chunks (and the restored trace)."""
+        keys, counts = self.sum_transitions()
+        transitions_from, transitions_to = np.divmod(keys, self.num_cells)
+        transition_counts = build_transition_counts(transitions_from, transitions_to, self.num_cells, counts)
+        if self.base_transition_counts is not None:
+            transition_counts = (transition_counts + self.base_transition_counts).tocsr()
+        return transition_counts
+
+
+def build_incidence_matrix(pair_keys, num_vehicles, num_cells):
+    """
+    Builds the CSR vehicle x cell incidence matrix from sorted, unique (vehicle, cell) pair keys.
+
+    Args:
+        pair_keys (numpy.ndarray): Sorted unique keys vehicle_code * num_cells + cell.
+        num_vehicles (int): Number of vehicle codes.
+        num_cells (int): Number of grid cells (grid_size * grid_size).
+
+    Returns:
+        scipy.sparse.csr_matrix: int32 matrix with a 1 for every cell a vehicle visited.
+    """
+    codes, cells = np.divmod(pair_keys, num_cells)
+    indptr = np.zeros(num_vehicles + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=num_vehicles), out=indptr[1:])
+    return csr_matrix((np.ones(len(cells), dtype=np.int32), cells, indptr), shape=(num_vehicles, num_cells))
+
+
+def build_transition_counts(transitions_from, transitions_to, num_cells, counts=None):
+    """
+    Reduces flat transition index arrays to a sparse matrix of transition counts.
+
+    Duplicate (from, to) pairs are summed by a single COO -> CSR conversion.
+
+    Args:
+        transitions_from (numpy.ndarray): Flat index of the cell each transition starts in.
+        transitions_to (numpy.ndarray): Flat index of the cell each transition ends in.
+        num_cells (int): Number of grid cells (grid_size * grid_size).
+        counts (numpy.ndarray, optional): Number of transitions per entry, 1 each if None.
+
+    Returns:
+        scipy.sparse.csr_matrix: Number of transitions between grid cells.
+    """
+    return coo_matrix(
+        (
+            np.ones(len(transitions_from), dtype=float) if counts is None else np.asarray(counts, dtype=float),
+            (transitions_from, transitions_to),
+        ),
+        shape=(num_cells, num_cells),
+    ).tocsr()
+
+
+def normalize_migration_matrix(transition_counts):
+    """
+    Scales each row of a transition count matrix to sum up to one, by multiplying with a diagonal matrix of
+    inverse row sums.
+
+    Args:
+        transition_counts (scipy.sparse.csr_matrix): Number of transitions between grid cells.
+
+    Returns:
+        scipy.sparse.csr_matrix: Migration ratios between grid cells.
+    """
+    row_sums = np.asarray(transition_counts.sum(axis=1)).ravel()
+    inverse_row_sums = np.divide(1.0, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0)
+    return (diags(inverse_row_sums) @ transition_counts).tocsr()
+
+
+def coarsen_cells(cells, base_grid_size, grid_size):
+    """
+    Maps flat cell indices of a base grid to the flat indices of a coarser grid that divides it.
+
+    Args:
+        cells (numpy.ndarray): Flat cell indices on the base grid.
+        base_grid_size (int): Number of grid cells per axis of the base grid.
+        grid_size (int): Number of grid cells per axis of the coarse grid.
+
+    Returns:
+        numpy.ndarray: Flat cell indices on the coarse grid.
+    """
+    factor = base_grid_size // grid_size
+    x_indices, y_indices = np.divmod(np.asarray(cells, dtype=np.int64), base_grid_size)
+    return (x_indices // factor) * grid_size + y_indices // factor
+
+
+def coarsen_occupancy(occupancy, base_grid_size, grid_size):
+    """
+    Sums up the (time bucket, cell) occupancy of a base grid over the cells of a coarser grid that divides it.
+    """
+    counts = occupancy.tocoo()
+    cells = coarsen_cells(counts.col, base_grid_size, grid_size)
+    return coo_matrix(
+        (counts.data, (counts.row, cells)), shape=(occupancy.shape[0], grid_size * grid_size)
+    ).tocsr()
+
+
+def coarsen_vehicle_cells(vehicle_cells, base_grid_size, grid_size):
+    """
+    Derives the vehicle x cell incidence of a coarser grid by block aggregation of a base grid.
+
+    Args:
+        vehicle_cells (scipy.sparse.csr_matrix): Vehicle x cell incidence matrix of the base grid.
+        base_grid_size (int): Number of grid cells per axis of the base grid.
+        grid_size (int): Number of grid cells per axis of the coarse grid, must divide base_grid_size.
+
+    Returns:
+        scipy.sparse.csr_matrix: Incidence matrix of the coarse grid.
+    """
+    num_cells = grid_size * grid_size
+    num_vehicles = vehicle_cells.shape[0]
+    vehicle_codes = np.repeat(np.arange(num_vehicles, dtype=np.int64), np.diff(vehicle_cells.indptr))
+    pair_keys = np.unique(
+        vehicle_codes * num_cells + coarsen_cells(vehicle_cells.indices, base_grid_size, grid_size)
+    )
+    return build_incidence_matrix(pair_keys, num_vehicles, num_cells)
+
+
+def coarsen_transition_counts(transition_counts, base_grid_size, grid_size):
+    """
+    Derives the transition counts of a coarser grid by block aggregation of a base grid.
+
+    A vehicle changes its coarse cell exactly when it changes its base cell across a coarse cell border, so
+    mapping the base transitions and dropping those that stay within a coarse cell yields the exact coarse
+    transition counts.
+
+    Args:
+        transition_counts (scipy.sparse.csr_matrix): Transition counts of the base grid.
+        base_grid_size (int): Number of grid cells per axis of the base grid.
+        grid_size (int): Number of grid cells per axis of the coarse grid, must divide base_grid_size.
+
+    Returns:
+        scipy.sparse.csr_matrix: Transition counts of the coarse grid.
+    """
+    num_cells = grid_size * grid_size
+    counts = transition_counts.tocoo()
+    from_cells = coarsen_cells(counts.row, base_grid_size, grid_size)
+    to_cells = coarsen_cells(counts.col, base_grid_size, grid_size)
+    crossing = from_cells != to_cells
+    return coo_matrix(
+        (counts.data[crossing], (from_cells[crossing], to_cells[crossing])), shape=(num_cells, num_cells)
+    ).tocsr()
+
+
+def bin_positions(xs, ys, x_min, y_min, x_step, y_step, grid_size):
+    """
+    Maps arrays of positions to flat grid cell indices in one vectorized operation.
+
+    Positions outside the grid bounds are clamped to the border cells, exactly like `SUMOParser.get_grid_cell`.
+
+    Args:
+        xs (numpy.ndarray): x-coordinates of the positions.
+        ys (numpy.ndarray): y-coordinates of the positions.
+        x_min (float): Lower x-bound of the grid.
+        y_min (float): Lower y-bound of the grid.
+        x_step (float): Width of a grid cell.
+        y_step (float): Height of a grid cell.
+        grid_size (int): Number of grid cells per axis.
+
+    Returns:
+        numpy.ndarray: Flat cell indices (x_index * grid_size + y_index) as int64.
+    """
+    x_index = np.floor((np.asarray(xs, dtype=float) - x_min) / x_step)
+    y_index = np.floor((np.asarray(ys, dtype=float) - y_min) / y_step)
+    x_index = np.clip(x_index, 0, grid_size - 1).astype(np.int64)
+    y_index = np.clip(y_index, 0, grid_size - 1).astype(np.int64)
+    return x_index * grid_size + y_index
+
+
+class IngestionProgress:
+    """
+    Reports the ingestion throughput (records/sec) at most every `interval` seconds.
+    """
+
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self.records = 0
+        self.start_time = time.perf_counter()
+        self.last_report = self.start_time
+
+    def update(self, num_records):
+        self.records += num_records
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval:
+            self.last_report = now
+            self.report(now)
+
+    def report(self, now=None):
+        if now is None:
+            now = time.perf_counter()
+        elapsed = now - self.start_time
+        rate = self.records / elapsed if elapsed > 0 else 0.0
+        print(f"  FCD ingestion: {self.records} records in {elapsed:.1f}s ({rate:.0f} records/sec)")
+
+
+# Products of SUMOParser and the attributes each of them provides. Products are built on first access to any
+# of their attributes, or up front for the products passed to the constructor.
+PRODUCT_ATTRIBUTES = {
+    "junctions": ("junction_ids", "junction_xy", "junction_types", "junction_type_names"),
+    "vehicle_cells": ("vehicle_ids", "vehicle_cells"),
+    "transition_counts": ("transition_counts", "vehicle_last_cells"),
+    "occupancy": ("occupancy", "timesteps_per_bucket"),
+}
+
+# Attributes derived from a product (cheaply, and per grid size) on first access
+DERIVED_ATTRIBUTES = {
+    "junction_tree": "junctions",
+    "cell_junctions": "junctions",
+    "M": "vehicle_cells",
+    "cell_vehicles": "vehicle_cells",
+    "P": "transition_counts",
+}
+
+# Attributes that depend on the grid and are re-derived for every grid size
+GRID_ATTRIBUTES = ("cell_junctions", "M", "cell_vehicles", "P")
+
+# Products the FCD ingestion pass builds
+FCD_PRODUCTS = ("vehicle_cells", "transition_counts", "occupancy")
+
+
+class SUMOParser:
+    def __init__(self, grid_size=None, products=None):
+        """
+        Args:
+            grid_size (int, optional): Number of grid cells per axis. General.grid_size if None.
+            products (iterable, optional): Products (keys of PRODUCT_ATTRIBUTES) to build right away, in a
+                single ingestion pass. All products if None; any other product is built on first access.
+        """
         print("SUMOParser Initialization...\n")
         self.config = load_config()
         self.rsu_radius = self.config["General"]["rsu_radius"]
-        self.grid_size = self.config["General"]["grid_size"]
-        self.M = np.zeros((self.grid_size, self.grid_size), dtype=int)
-        self.P = lil_matrix(
-            (self.grid_size * self.grid_size, self.grid_size * self.grid_size), dtype=float
-        )  # Sparse migration matrix
-        self.x_max, self.y_max = parse_max_xy()
-        self.x_offset, self.y_offset = parse_net_offset()
+        self.grid_size = self.config["General"]["grid_size"] if grid_size is None else grid_size
+        self.skip_internal_junctions = bool(self.config["SUMOInterface"]["xml_parser"]["skip_internal_junctions"])
+        location = parse_net_file(path_to_net_xml_gx, location_only=True)
+        self.x_max, self.y_max = location.conv_boundary[2:] if location.conv_boundary else (-1, -1)
+        self.x_offset, self.y_offset = location.net_offset if location.net_offset else (-1, -1)
         self.x_min, self.y_min = 0, 0
-        self.x_step, self.y_step = 0, 0
-        self.vehicle_paths = {}
-        self.location_vehicles = {}
-        self.junctions = []
-        self.parse_junctions()
-        self.generate_matrix_m_and_p()
+        self.x_step = (self.x_max - self.x_min) / self.grid_size
+        self.y_step = (self.y_max - self.y_min) / self.grid_size
+        self.time_bucket_size = None  # Length of the time buckets of the occupancy tensor in seconds
+        if self.config["SUMOInterface"]["time_resolved"]["enabled"]:
+            self.time_bucket_size = float(self.config["SUMOInterface"]["time_resolved"]["bucket_size"])
+        self.num_workers = max(1, int(self.config["SUMOInterface"]["xml_parser"]["workers"]))
+        self.fcd_source = self.config["SUMOInterface"]["fcd_source"]
+        self.fcd_path = path_to_fcd_parquet if self.fcd_source["format"] == "parquet" else path_to_fcd_xml
+        # FCD segments appended to the main FCD, in time order
+        self.fcd_segments = [
+            self.config["General"]["base_path"] + segment
+            for segment in self.config["SUMOInterface"]["fcd_segments"]
+        ]
+        self.cache_enabled = bool(self.config["SUMOInterface"]["cache"]["enabled"])
+        self.cache_file_path = None
+        self.products = set()  # Products that have been built (or loaded from the cache)
+        # Products whose build failed; they keep their empty defaults instead of being rebuilt on every access
+        self.failed_products = set()
+        self.load_products(PRODUCT_ATTRIBUTES if products is None else products)
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set yet, i.e. products that have not been built
+        if name in DERIVED_ATTRIBUTES:
+            self.load_products([DERIVED_ATTRIBUTES[name]])
+            self.derive(name)
+            if name in self.__dict__:
+                return self.__dict__[name]
+        for product, attributes in PRODUCT_ATTRIBUTES.items():
+            if name in attributes:
+                self.load_products([product])
+                if name in self.__dict__:
+                    return self.__dict__[name]
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def derive(self, name):
+        """
+        Computes a derived attribute (see DERIVED_ATTRIBUTES) from the product it depends on.
+        """
+        if name == "junction_tree":
+            self.build_junction_index()
+        elif name == "cell_junctions":
+            self.build_cell_junction_table()
+        elif name == "cell_vehicles":
+            self.cell_vehicles = self.vehicle_cells.T.tocsr()
+        elif name == "M":
+            # Count the number of unique vehicles for each grid cell
+            self.M = self.count_vehicles_per_cell()
+        elif name == "P":
+            # Normalize the transitions to get migration ratios
+            if self.config["SUMOInterface"]["migration_matrix"]["format"] == "stencil":
+                self.P = StencilMigrationMatrix.from_transition_counts(self.transition_counts, self.grid_size)
+            else:
+                self.P = normalize_migration_matrix(self.transition_counts)
+
+    def load_products(self, products):
+        """
+        Builds the given products, unless already built: from the scenario cache if possible, otherwise by
+        parsing the network and/or a single FCD ingestion pass for all missing FCD products. Products whose
+        build failed are not attempted again.
+
+        Args:
+            products (iterable): Keys of PRODUCT_ATTRIBUTES.
+        """
+        missing = [
+            product for product in products if product not in self.products and product not in self.failed_products
+        ]
+        if "occupancy" in missing and self.time_bucket_size is None:
+            # Nothing to build if the time-resolved occupancy is disabled
+            self.occupancy = None
+            self.timesteps_per_bucket = None
+            self.products.add("occupancy")
+            missing.remove("occupancy")
+        if not missing:
+            return
+
+        loaded = self.load_from_cache(missing)
+        missing = [product for product in missing if product not in loaded]
+        if not missing:
+            return
+
+        built = []
+        if "junctions" in missing and self.parse_junctions():
+            built.append("junctions")
+        fcd_products = [product for product in missing if product in FCD_PRODUCTS]
+        if fcd_products and self.generate_matrix_m_and_p(fcd_products):
+            built.extend(fcd_products)
+        self.products.update(built)
+        self.failed_products.update(product for product in missing if product not in built)
+        self.save_to_cache(built)
+
+    def for_grid_size(self, grid_size):
+        """
+        Derives the products for a coarser grid by block aggregation, without re-ingesting the FCD.
+
+        Args:
+            grid_size (int): Number of grid cells per axis; must divide the grid_size of this parser.
+
+        Returns:
+            SUMOParser: A parser sharing the junctions and vehicle ids of this one, with the incidence matrix,
+            transition counts and occupancy of the requested grid. M, P and the cell -> junction table are
+            derived again on first access.
+        """
+        if grid_size <= 0 or self.grid_size % grid_size != 0:
+            raise ValueError(f"grid_size {grid_size} does not divide the base grid_size {self.grid_size}")
+
+        view = copy.copy(self)
+        view.reload_config()
+        view.cache_file_path = None
+        view.products = set(self.products)
+        view.failed_products = set(self.failed_products)
+        view.fcd_segments = list(self.fcd_segments)
+        if grid_size == self.grid_size:
+            return view
+
+        for name in GRID_ATTRIBUTES:
+            view.__dict__.pop(name, None)
+        view.grid_size = grid_size
+        view.x_step = (view.x_max - view.x_min) / grid_size
+        view.y_step = (view.y_max - view.y_min) / grid_size
+        # Failed products keep their empty defaults, which are coarsened like built ones
+        present = self.products | self.failed_products
+        if "vehicle_cells" in present:
+            view.vehicle_cells = coarsen_vehicle_cells(self.vehicle_cells, self.grid_size, grid_size)
+        if "transition_counts" in present:
+            view.transition_counts = coarsen_transition_counts(self.transition_counts, self.grid_size, grid_size)
+            known = self.vehicle_last_cells >= 0
+            view.vehicle_last_cells = np.where(
+                known, coarsen_cells(np.where(known, self.vehicle_last_cells, 0), self.grid_size, grid_size), -1
+            )
+        if "occupancy" in present and self.occupancy is not None:
+            view.occupancy = coarsen_occupancy(self.occupancy, self.grid_size, grid_size)
+        return view
+
+    def reload_config(self):
+        """
+        Picks up the settings of the current sweep combination (see Utils.update_config), keeping all products.
+        """
+        self.config = load_config()
+        self.rsu_radius = self.config["General"]["rsu_radius"]
+
+    def scenario_cache_file_path(self):
+        """
+        Returns:
+            str: Path of the scenario cache entry for the current sources, grid and settings.
+        """
+        cache_key = scenario_cache_key(
+            [self.fcd_path] + self.fcd_segments + [path_to_net_xml_gx],
+            self.grid_size,
+            (self.x_min, self.y_min, self.x_max, self.y_max),
+            {
+                "time_bucket_size": self.time_bucket_size,
+                "fcd_source": self.fcd_source,
+                "skip_internal_junctions": self.skip_internal_junctions,
+            },
+        )
+        return (
+            self.config["General"]["base_path"]
+            + self.config["SUMOInterface"]["cache"]["cache_path"]
+            + self.config["VanetInterface"]["scenario"]
+            + f"/{cache_key}.npz"
+        )
+
+    def load_from_cache(self, products):
+        """
+        Loads products from the preprocessed scenario cache.
+
+        Args:
+            products (list): Keys of PRODUCT_ATTRIBUTES to load.
+
+        Returns:
+            list: The products that were found in the cache entry and loaded.
+        """
+        if not self.cache_enabled:
+            return []
+        try:
+            self.cache_file_path = self.scenario_cache_file_path()
+            cached = load_scenario(
+                self.cache_file_path, [name for product in products for name in PRODUCT_ATTRIBUTES[product]]
+            )
+        except Exception as e:
+            print(f"An error occurred while loading the scenario cache: {e}")
+            self.cache_file_path = None
+            return []
+
+        if cached is None:
+            return []
+        loaded = [product for product in products if all(name in cached for name in PRODUCT_ATTRIBUTES[product])]
+        for product in loaded:
+            for name in PRODUCT_ATTRIBUTES[product]:
+                setattr(self, name, cached[name])
+        self.products.update(loaded)
+        if loaded:
+            print(f"Loaded {', '.join(loaded)} from the preprocessed scenario {self.cache_file_path}")
+        return loaded
+
+    def save_to_cache(self, products):
+        """
+        Adds products to the scenario cache entry, keeping the products already stored in it.
+
+        Args:
+            products (list): Keys of PRODUCT_ATTRIBUTES to store.
+        """
+        if self.cache_file_path is None or not products:
+            return
+        try:
+            cached = load_scenario(self.cache_file_path) or {}
+            for product in products:
+                for name in PRODUCT_ATTRIBUTES[product]:
+                    # The occupancy is None if the time-resolved occupancy is disabled
+                    if getattr(self, name) is not None:
+                        cached[name] = getattr(self, name)
+            save_scenario(self.cache_file_path, cached)
+        except Exception as e:
+            print(f"An error occurred while writing the scenario cache: {e}")
 
     def check_grid_size_radius_relation(self):
         radius1 = math.sqrt(2 * self.x_step * self.x_step)
@@ -125,8 +1154,6 @@ class SUMOParser:
         Returns:
             int, int: Indices of the grid cell for the given x, y coordinates.
         """
-        self.x_step = (self.x_max - self.x_min) / self.grid_size
-        self.y_step = (self.y_max - self.y_min) / self.grid_size
         x_index = min(int((x - self.x_min) / self.x_step), self.grid_size - 1)
         y_index = min(int((y - self.y_min) / self.y_step), self.grid_size - 1)
         x_index = max(0, min(x_index, self.grid_size - 1))
@@ -134,89 +1161,358 @@ class SUMOParser:
 
         return x_index, y_index
 
+    def get_grid_cells(self, xs, ys):
+        """
+        Determines the flat grid cell indices of many positions at once.
+
+        Args:
+            xs (numpy.ndarray): x-coordinates of the vehicles.
+            ys (numpy.ndarray): y-coordinates of the vehicles.
+
+        Returns:
+            numpy.ndarray: Flat cell indices (x_index * grid_size + y_index) for the given coordinates.
+        """
+        return bin_positions(xs, ys, self.x_min, self.y_min, self.x_step, self.y_step, self.grid_size)
+
     def parse_junctions(self):
+        """
+        Parses the junctions of the network, sorted by (x, y).
+
+        Returns:
+            bool: True if at least one junction was parsed.
+        """
+        self.junction_ids = np.empty(0, dtype=str)
+        self.junction_xy = np.empty((0, 2), dtype=float)
+        self.junction_types = np.empty(0, dtype=np.int16)  # Codes into junction_type_names
+        self.junction_type_names = np.empty(0, dtype=str)
         try:
-            tree = ET.parse(path_to_net_xml_gx)
-            root = tree.getroot()
-            for junction in root.findall("junction"):
-                self.junctions.append(
-                    {
-                        "id": junction.get("id"),
-                        "x": float(junction.get("x")),
-                        "y": float(junction.get("y")),
-                        "type": junction.get("type"),
-                    }
-                )
-            self.junctions.sort(key=lambda j: (j["x"], j["y"]))
+            net = parse_net_file(path_to_net_xml_gx, self.skip_internal_junctions)
+            order = np.lexsort((net.junction_xy[:, 1], net.junction_xy[:, 0]))
+            self.junction_ids = net.junction_ids[order]
+            self.junction_xy = net.junction_xy[order]
+            self.junction_types = net.junction_types[order]
+            self.junction_type_names = net.junction_type_names
         except Exception as e:
             print(f"An error occurred while parsing junctions: {e}")
+        return len(self.junction_ids) > 0
+
+    def build_junction_index(self):
+        """
+        Builds a KD-tree over the junction coordinates for nearest-junction queries.
+        """
+        self.junction_tree = cKDTree(self.junction_xy)
+
+    def build_cell_junction_table(self):
+        """
+        Builds the table of offset-adjusted junctions closest to the center of each grid cell.
+        """
+        if len(self.junction_xy) == 0:
+            self.cell_junctions = np.empty((0, 2), dtype=float)
+            return
+
+        x_indices, y_indices = np.divmod(np.arange(self.grid_size * self.grid_size), self.grid_size)
+        centers_x = (x_indices + 0.5) * (self.x_max / self.grid_size)
+        centers_y = (y_indices + 0.5) * (self.y_max / self.grid_size)
+        self.cell_junctions = self.nearest_junctions(centers_x, centers_y) - (self.x_offset, self.y_offset)
 
-    def generate_matrix_m_and_p(self):
+    def cell_to_junction(self, cells):
         """
-        Generates a 2D matrix of vehicle counts within a grid (matrix M)
-        and a matrix of migration ratios between adjacent grid cells (matrix P).
+        Looks up the offset-adjusted junction closest to the center of grid cells.
+
+        Args:
+            cells (numpy.ndarray): Flat cell indices (x_index * grid_size + y_index).
 
         Returns:
-            numpy.ndarray: 2D matrix M, representing vehicle counts in each grid cell.
-            numpy.ndarray: 2D matrix P, representing migration ratios between adjacent grid cells.
+            numpy.ndarray: (..., 2) array of junction coordinates, shaped like `cells`.
+        """
+        return self.cell_junctions[np.asarray(cells, dtype=np.int64)]
+
+    def decode_population(self, population):
         """
-        vehicle_locations = {}
-        vehicle_ids = [[set() for _ in range(self.grid_size)] for _ in range(self.grid_size)]
+        Decodes GARSUD chromosomes into RSU coordinates with a single lookup.
+
+        A gene g encodes the grid cell with x_index = g % grid_size and y_index = g // grid_size.
+
+        Args:
+            population (numpy.ndarray): (num_solutions, num_genes) array of genes.
+
+        Returns:
+            numpy.ndarray: (num_solutions, num_genes, 2) array of offset-adjusted junction coordinates.
+        """
+        genes = np.asarray(population, dtype=np.int64)
+        return self.cell_to_junction((genes % self.grid_size) * self.grid_size + genes // self.grid_size)
+
+    def nearest_junctions(self, xs, ys):
+        """
+        Snaps many points to their closest junction in one query.
+
+        Args:
+            xs (numpy.ndarray): x-coordinates of the points.
+            ys (numpy.ndarray): y-coordinates of the points.
+
+        Returns:
+            numpy.ndarray: (N, 2) array with the x, y coordinates of the closest junction of each point.
+        """
+        points = np.column_stack((np.ravel(xs), np.ravel(ys)))
+        _, junction_indices = self.junction_tree.query(points)
+        return self.junction_xy[junction_indices]
+
+    def generate_matrix_m_and_p(self, products=FCD_PRODUCTS):
+        """
+        Builds the FCD products in a single ingestion pass: the vehicle x cell incidence behind the vehicle
+        counts per grid cell (matrix M), the transition counts behind the migration ratios between grid cells
+        (matrix P) and the time-resolved occupancy.
+
+        Args:
+            products (iterable): The FCD products to build (see FCD_PRODUCTS).
+
+        Returns:
+            bool: True if the ingestion succeeded and found any vehicle records.
+        """
+        collect_pairs = "vehicle_cells" in products
+        collect_transitions = "transition_counts" in products
+        time_bucket_size = self.time_bucket_size if "occupancy" in products else None
+        num_cells = self.grid_size * self.grid_size
+        if collect_pairs:
+            self.vehicle_ids = np.empty(0, dtype=str)  # Vehicle id strings, indexed by vehicle code
+            self.vehicle_cells = csr_matrix((0, num_cells), dtype=np.int32)
+        if collect_transitions:
+            self.transition_counts = csr_matrix((num_cells, num_cells), dtype=float)
+            self.vehicle_last_cells = np.empty(0, dtype=np.int64)  # Last cell per vehicle code, -1 if unknown
+        if time_bucket_size is not None:
+            self.occupancy = csr_matrix((0, num_cells), dtype=np.int64)
+            self.timesteps_per_bucket = np.empty(0, dtype=np.int64)
+
+        progress = IngestionProgress()
+        grid = (self.x_min, self.y_min, self.x_step, self.y_step, self.grid_size)
+        accumulator = FCDAccumulator(self.grid_size)
         try:
-            # Parse the XML file
-            tree = ET.parse(path_to_fcd_xml)
-            root = tree.getroot()
-            # Iterate over each timestep
-            for timestep in root.findall("timestep"):
-                # Iterate over each vehicle within the timestep
-                for vehicle in timestep.findall("vehicle"):
-                    vehicle_id = vehicle.get("id")
-                    x = float(vehicle.get("x"))
-                    y = float(vehicle.get("y"))
-                    current_cell = self.get_grid_cell(x, y)
-                    vehicle_ids[current_cell[0]][current_cell[1]].add(vehicle_id)
-
-                    # Update vehicle_paths dictionary
-                    if vehicle_id not in self.vehicle_paths:
-                        self.vehicle_paths[vehicle_id] = set()
-                    self.vehicle_paths[vehicle_id].add(current_cell)
-
-                    # Update location_vehicles dictionary
-                    cell_key = (current_cell[0], current_cell[1])
-                    if cell_key not in self.location_vehicles:
-                        self.location_vehicles[cell_key] = set()
-                    self.location_vehicles[cell_key].add(vehicle_id)
-
-                    # Update the vehicle's current location
-                    if vehicle_id not in vehicle_locations:
-                        vehicle_locations[vehicle_id] = {"previous": None, "current": current_cell}
-                    else:
-                        vehicle_locations[vehicle_id]["previous"] = vehicle_locations[vehicle_id]["current"]
-                        vehicle_locations[vehicle_id]["current"] = current_cell
-
-                    previous_cell = vehicle_locations[vehicle_id]["previous"]
-
-                    if previous_cell is not None and previous_cell != current_cell:
-                        from_index = previous_cell[0] * self.grid_size + previous_cell[1]
-                        to_index = current_cell[0] * self.grid_size + current_cell[1]
-                        self.P[from_index, to_index] += 1
-            # Count the number of unique vehicles for each grid cell
-            for i in range(self.grid_size):
-                for j in range(self.grid_size):
-                    self.M[i, j] = len(vehicle_ids[i][j])
-            # Normalize matrix P to get migration ratios
-            for i in range(self.P.shape[0]):
-                row_sum = np.sum(self.P[i])
-                if row_sum > 0:
-                    self.P[i] /= row_sum
+            if self.fcd_source["format"] == "parquet":
+                accumulator.merge(
+                    ingest_fcd_timesteps(
+                        self.iter_timesteps(), grid, time_bucket_size, progress, collect_pairs, collect_transitions
+                    )
+                )
+            elif self.num_workers > 1:
+                # Parse timestep ranges of the FCD file in parallel and merge them in timestep order
+                byte_ranges = find_fcd_chunk_boundaries(path_to_fcd_xml, self.num_workers * FCD_CHUNKS_PER_WORKER)
+                with ProcessPoolExecutor(max_workers=self.num_workers) as executor:
+                    chunks = executor.map(
+                        parse_fcd_chunk,
+                        [path_to_fcd_xml] * len(byte_ranges),
+                        byte_ranges,
+                        [grid] * len(byte_ranges),
+                        [time_bucket_size] * len(byte_ranges),
+                        [None] * len(byte_ranges),
+                        [collect_pairs] * len(byte_ranges),
+                        [collect_transitions] * len(byte_ranges),
+                    )
+                    for chunk in chunks:
+                        accumulator.merge(chunk)
+                        progress.update(chunk.num_records)
+            else:
+                # Stream the FCD file one timestep at a time
+                accumulator.merge(
+                    parse_fcd_chunk(
+                        path_to_fcd_xml, None, grid, time_bucket_size, progress, collect_pairs, collect_transitions
+                    )
+                )
+            # FCD segments that were appended to the trace
+            for segment_path in self.fcd_segments:
+                accumulator.merge(
+                    ingest_fcd_timesteps(
+                        self.iter_timesteps(segment_path),
+                        grid,
+                        time_bucket_size,
+                        progress,
+                        collect_pairs,
+                        collect_transitions,
+                    )
+                )
+            progress.report()
+            self.take_fcd_products(accumulator, products)
 
         except Exception as e:
-            print(f"An error occurred while processing the XML file: {e}")
-        self.P = self.P.tocsr()
-
-    def generate_matrix_m_with_vehicle_paths(self):
-        self.M = np.zeros((self.grid_size, self.grid_size), dtype=int)  # Reset the matrix
-        for vehicle_id, path in self.vehicle_paths.items():
-            for cell in path:
-                self.M[cell[0], cell[1]] += 1
-        return self.M
+            print(f"An error occurred while processing the FCD file: {e}")
+            return False
+        return accumulator.num_records > 0
+
+    def take_fcd_products(self, accumulator, products):
+        """
+        Sets the attributes of the given FCD products from an accumulator.
+        """
+        if "vehicle_cells" in products:
+            self.vehicle_ids = accumulator.vehicle_ids()
+            self.vehicle_cells = accumulator.vehicle_cells()
+        if "transition_counts" in products:
+            self.transition_counts = accumulator.transition_counts()
+            self.vehicle_last_cells = accumulator.vehicle_last_cells()
+        if "occupancy" in products and self.time_bucket_size is not None:
+            self.occupancy, self.timesteps_per_bucket = accumulator.occupancy()
+
+    def append_fcd(self, fcd_path):
+        """
+        Appends an FCD segment to the trace, processing only its records.
+
+        The accumulated state of the trace (vehicle codes, (vehicle, cell) pairs, transition counts and the
+        last cell of every vehicle) is restored from the products, so transitions from the end of the trace
+        into the segment are counted as well. The segment must continue the trace in time and be in the
+        configured FCD format. The updated products are stored in the scenario cache under a key that covers
+        the appended segments (see SUMOInterface.fcd_segments).
+
+        Args:
+            fcd_path (str): Path to the FCD segment.
+        """
+        self.load_products(FCD_PRODUCTS)
+        accumulator = FCDAccumulator.restore(
+            self.grid_size,
+            self.vehicle_ids,
+            self.vehicle_cells,
+            self.vehicle_last_cells,
+            self.transition_counts,
+            self.occupancy,
+            self.timesteps_per_bucket,
+        )
+        progress = IngestionProgress()
+        grid = (self.x_min, self.y_min, self.x_step, self.y_step, self.grid_size)
+        accumulator.merge(
+            ingest_fcd_timesteps(self.iter_timesteps(fcd_path), grid, self.time_bucket_size, progress)
+        )
+        progress.report()
+        self.take_fcd_products(accumulator, FCD_PRODUCTS)
+        # M, P and the vehicle -> cell lookup are derived again from the updated products
+        for name in ("M", "cell_vehicles", "P"):
+            self.__dict__.pop(name, None)
+
+        self.fcd_segments.append(fcd_path)
+        if self.cache_enabled:
+            self.cache_file_path = self.scenario_cache_file_path()
+            self.save_to_cache(sorted(self.products))
+
+    def iter_timesteps(self, fcd_path=None):
+        """
+        Streams an FCD file in the configured format one timestep at a time.
+
+        Args:
+            fcd_path (str, optional): Path to the FCD file. The main FCD source if None.
+
+        Yields:
+            float, list, numpy.ndarray, numpy.ndarray: Simulation time, vehicle ids, x- and y-coordinates
+            (net coordinates) of the timestep.
+        """
+        if fcd_path is None:
+            fcd_path = self.fcd_path
+        if self.fcd_source["format"] == "parquet":
+            # Scan the time/id/x/y columns of the columnar FCD in record batches
+            parquet = self.fcd_source["parquet"]
+            offset = (self.x_offset, self.y_offset) if parquet["offset_adjusted"] else (0.0, 0.0)
+            return iter_fcd_parquet_timesteps(fcd_path, parquet["columns"], parquet["time_scale"], offset)
+        return iter_fcd_timesteps(fcd_path)
+
+    def build_record_store(self, store_path=None):
+        """
+        Writes all FCD records (time, vehicle code, x, y) to a memory-mapped store sorted by grid cell.
+
+        Vehicle codes are assigned in order of first appearance, like the codes of vehicle_ids.
+
+        Args:
+            store_path (str, optional): Directory of the store. Defaults to the configured record store path
+                of the scenario and grid size.
+
+        Returns:
+            CellRecordStore: Reader of the written store.
+        """
+        if store_path is None:
+            store_path = (
+                self.config["General"]["base_path"]
+                + self.config["SUMOInterface"]["record_store"]["store_path"]
+                + self.config["VanetInterface"]["scenario"]
+                + f"/grid_{self.grid_size}"
+            )
+        vehicle_codes = {}
+        progress = IngestionProgress()
+
+        def batches():
+            sources = [self.iter_timesteps()] + [self.iter_timesteps(path) for path in self.fcd_segments]
+            for timestep, vehicle_ids, xs, ys in itertools.chain(*sources):
+                codes = intern_vehicle_ids(vehicle_ids, vehicle_codes)
+                progress.update(len(vehicle_ids))
+                yield timestep, codes, xs, ys, self.get_grid_cells(xs, ys)
+
+        store = write_record_store(store_path, batches(), self.grid_size * self.grid_size, vehicle_codes)
+        progress.report()
+        print(f"Wrote {store.num_records} records to the record store {store_path}")
+        return store
+
+    @property
+    def num_vehicles(self):
+        return len(self.vehicle_ids)
+
+    def vehicles_in_cell(self, cell):
+        """
+        Returns the codes of all vehicles that visited a grid cell.
+
+        Args:
+            cell (tuple): (x_index, y_index) of the grid cell.
+
+        Returns:
+            numpy.ndarray: Vehicle codes (indices into vehicle_ids).
+        """
+        flat_index = cell[0] * self.grid_size + cell[1]
+        return self.cell_vehicles.indices[
+            self.cell_vehicles.indptr[flat_index] : self.cell_vehicles.indptr[flat_index + 1]
+        ]
+
+    def count_vehicles_per_cell(self, vehicle_codes=None):
+        """
+        Counts the unique vehicles per grid cell, optionally restricted to a subset of vehicles.
+
+        Args:
+            vehicle_codes (numpy.ndarray, optional): Codes of the vehicles to count. All vehicles if None.
+
+        Returns:
+            numpy.ndarray: 2D matrix of unique vehicle counts per grid cell.
+        """
+        if vehicle_codes is None:
+            counts = np.diff(self.cell_vehicles.indptr)
+        else:
+            counts = np.bincount(
+                self.vehicle_cells[vehicle_codes].indices, minlength=self.grid_size * self.grid_size
+            )
+        return counts.reshape(self.grid_size, self.grid_size).astype(int)
+
+    def occupancy_in_window(self, start_time, end_time):
+        """
+        Sums up the vehicle records per grid cell over the time buckets overlapping [start_time, end_time).
+
+        Windows are widened to whole time buckets.
+
+        Args:
+            start_time (float): Start of the window in simulation seconds.
+            end_time (float): End of the window in simulation seconds.
+
+        Returns:
+            numpy.ndarray, int: 2D matrix of vehicle records per grid cell and the number of timesteps in the
+            window.
+        """
+        if self.occupancy is None:
+            raise ValueError("The time-resolved occupancy is not enabled (SUMOInterface.time_resolved)")
+        first_bucket = max(0, int(start_time // self.time_bucket_size))
+        last_bucket = min(self.occupancy.shape[0], int(math.ceil(end_time / self.time_bucket_size)))
+        records = np.asarray(self.occupancy[first_bucket:last_bucket].sum(axis=0)).ravel()
+        num_timesteps = int(self.timesteps_per_bucket[first_bucket:last_bucket].sum())
+        return records.reshape(self.grid_size, self.grid_size), num_timesteps
+
+    def density_in_window(self, start_time, end_time):
+        """
+        Computes the mean number of vehicles per grid cell and timestep within a time window.
+
+        Args:
+            start_time (float): Start of the window in simulation seconds.
+            end_time (float): End of the window in simulation seconds.
+
+        Returns:
+            numpy.ndarray: 2D matrix of mean vehicle counts per grid cell.
+        """
+        records, num_timesteps = self.occupancy_in_window(start_time, end_time)
+        return records / num_timesteps if num_timesteps > 0 else np.zeros(records.shape, dtype=float)
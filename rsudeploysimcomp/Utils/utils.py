@@ -1,8 +1,10 @@
+import contextlib
 import csv
 import glob
 import json
 import os
 import re
+import tempfile
 from math import sqrt
 
 import numpy as np
@@ -17,6 +19,74 @@ def load_config():
     return config
 
 
+@contextlib.contextmanager
+def atomic_output_path(path, suffix=".tmp"):
+    """
+    Provides a unique temporary path next to `path`, which is moved onto `path` once the block completes.
+
+    Concurrent readers never observe a partially written file, and concurrent writers of the same path, be
+    they processes or threads, never share a temporary file. The temporary file is removed if the block
+    raises.
+
+    Args:
+        path (str): Target path.
+        suffix (str): Suffix of the temporary file, for writers that require a certain file extension.
+
+    Yields:
+        str: The temporary path to write to.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    file_descriptor, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=suffix, dir=directory)
+    os.close(file_descriptor)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def link_file(source_path, target_path):
+    """
+    Makes a read-only file available at another path without copying it: as a hard link, or as a symbolic
+    link if the paths are on different file systems. An existing target is replaced atomically.
+
+    Writers must replace the linked file instead of writing to it, or use `unlink_shared_file` first.
+
+    Args:
+        source_path (str): Path of the file.
+        target_path (str): Path of the link.
+    """
+    if os.path.exists(target_path) and os.path.samefile(source_path, target_path):
+        return
+    tmp_path = None
+    try:
+        with atomic_output_path(target_path) as tmp_path:
+            os.remove(tmp_path)
+            try:
+                os.link(source_path, tmp_path)
+            except OSError:
+                os.symlink(os.path.abspath(source_path), tmp_path)
+    finally:
+        # os.replace does nothing if both paths are links to the same file, which would leave the link behind
+        if tmp_path is not None and os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+
+
+def unlink_shared_file(path):
+    """
+    Removes a file created by `link_file`, so a writer creates a new file instead of writing into the shared
+    one. Files that are not shared are kept.
+
+    Args:
+        path (str): Path of the file.
+    """
+    if os.path.islink(path) or (os.path.exists(path) and os.stat(path).st_nlink > 1):
+        os.remove(path)
+
+
 def get_hyperparameter(config, name):
     """Get the param from the configuration."""
     # Extract the grid_size from the config
@@ -55,14 +125,10 @@ def update_config(num_rsus, rsu_radius, grid_size):
 
 
 def find_closest_junction(sumoparser, center_x, center_y):
-    closest_junction = None
-    min_distance = float("inf")
-    for junction in sumoparser.junctions:
-        distance = np.sqrt((center_x - junction["x"]) ** 2 + (center_y - junction["y"]) ** 2)
-        if distance < min_distance:
-            min_distance = distance
-            closest_junction = (junction["x"], junction["y"])
-    return closest_junction
+    if len(sumoparser.junction_xy) == 0:
+        return None
+    closest_junction = sumoparser.nearest_junctions([center_x], [center_y])[0]
+    return float(closest_junction[0]), float(closest_junction[1])
 
 
 def adjust_coordinates_by_offsets(sumoparser, location):
@@ -73,6 +139,17 @@ def adjust_coordinates_by_offsets(sumoparser, location):
     return adjusted_center_x, adjusted_center_y
 
 
+def grid_cells_to_junction_coordinates(sumoparser, x_indices, y_indices):
+    """
+    Looks up the offset-adjusted junctions closest to the centers of many grid cells.
+
+    Returns:
+        list: (x, y) tuples of the offset-adjusted junction coordinates, one per grid cell.
+    """
+    cells = np.asarray(x_indices, dtype=np.int64) * sumoparser.grid_size + np.asarray(y_indices, dtype=np.int64)
+    return [(float(x), float(y)) for x, y in sumoparser.cell_to_junction(cells).reshape(-1, 2)]
+
+
 def new_location_is_within_reach(new_location, picked_junctions, rsu_radius):
     """
     Check if the new location is within the reach of any already selected RSU.
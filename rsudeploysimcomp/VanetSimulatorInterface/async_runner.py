@@ -0,0 +1,78 @@
+import asyncio
+import os
+import time
+
+
+class AsyncStageRunner:
+    """
+    Runs the disolv pipeline stages as asyncio subprocesses.
+
+    The output of every stage is streamed straight into a log file instead of being buffered in memory. A
+    stage that exceeds its timeout is killed, and failed or timed out stages are retried. A semaphore bounds
+    the number of stage processes running at the same time across all in-flight evaluations.
+
+    The runner has to be created inside the event loop that runs the stages.
+    """
+
+    def __init__(self, log_path, max_concurrent_stages=1, retries=0, retry_delay=0):
+        """
+        Args:
+            log_path (str): Directory of the stage logs.
+            max_concurrent_stages (int): Maximum number of stage processes running at the same time.
+            retries (int): Number of times a failed or timed out stage is restarted.
+            retry_delay (float): Seconds to wait before restarting a stage.
+        """
+        self.log_path = log_path
+        self.semaphore = asyncio.Semaphore(max_concurrent_stages)
+        self.retries = retries
+        self.retry_delay = retry_delay
+
+    async def run(self, command, log_name, timeout=None):
+        """
+        Runs a stage until it succeeds or all retries are used up.
+
+        Args:
+            command (list): Command line of the stage.
+            log_name (str): File name of the stage log in log_path. All attempts are appended to it.
+            timeout (float, optional): Seconds after which an attempt is killed. No timeout if None.
+
+        Returns:
+            bool: Whether the stage succeeded.
+        """
+        os.makedirs(self.log_path, exist_ok=True)
+        log_file_path = os.path.join(self.log_path, log_name)
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.retry_delay)
+            with open(log_file_path, "ab") as log_file:
+                log_file.write(f"--- attempt {attempt + 1}: {' '.join(command)}\n".encode())
+                log_file.flush()
+                async with self.semaphore:
+                    return_code = await self.run_attempt(command, log_file, timeout)
+                log_file.write(f"--- return code: {return_code}\n".encode())
+            if return_code == 0:
+                return True
+            print(f"Stage failed (attempt {attempt + 1}/{self.retries + 1}), see {log_file_path}")
+        return False
+
+    async def run_attempt(self, command, log_file, timeout):
+        """
+        Returns:
+            int: Return code of the process, or None if it timed out and was killed.
+        """
+        start_time = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(*command, stdout=log_file, stderr=asyncio.subprocess.STDOUT)
+        try:
+            return await asyncio.wait_for(process.wait(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            log_file.write(
+                f"--- killed after {time.perf_counter() - start_time:.1f}s (timeout {timeout}s)\n".encode()
+            )
+            return None
+        except asyncio.CancelledError:
+            # The evaluation has been abandoned, do not leave the stage running
+            process.kill()
+            await process.wait()
+            raise
@@ -0,0 +1,220 @@
+"""
+Local stand-in for the disolv-links and disolv-v2x binaries, for benchmarking the pipeline without a disolv
+build.
+
+The commands are installed as the fake-disolv-links and fake-disolv-v2x console scripts and can also be run
+as `python -m rsudeploysimcomp.VanetSimulatorInterface.fake_disolv links|v2x`. Both take `--config <file.toml>`
+like disolv and read their settings from the `[fake_disolv]` table of that file:
+
+    [fake_disolv]
+    deployment = ".../positions/rsu_deployment.parquet"   # RSU deployment written by the pipeline
+    fcd = ".../positions/koln_fcd.parquet"                # vehicle positions (time_step, agent_id, x, y)
+    links = ".../links/rsu_links.parquet"                 # disolv-links: link file to write
+    output_path = ".../output/koln"                       # disolv-v2x: directory of tx_data.parquet
+    link_radius = 1000.0                                  # disolv-links: range of a vehicle-RSU link
+    v2v_radius = 100.0                                    # disolv-v2x: range within which vehicles relay
+    latency = 0.0                                         # seconds of artificial latency per run
+
+Like disolv, disolv-v2x emits one transmission from every vehicle record to its closest RSU. Relaying is
+simplified to one additional transmission to the closest other vehicle within v2v_radius. The files and
+their schemas match disolv's; the metrics only approximate them.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import toml
+from scipy.spatial import cKDTree
+
+from rsudeploysimcomp.VanetSimulatorInterface.link_cache import RSU_AGENT_ID_OFFSET
+
+TX_DATA_SCHEMA = pa.schema(
+    [
+        pa.field("time_step", pa.uint64(), nullable=False),
+        pa.field("agent_id", pa.uint64(), nullable=False),
+        pa.field("selected_agent", pa.uint64(), nullable=False),
+        pa.field("distance", pa.float32(), nullable=False),
+        pa.field("data_count", pa.uint32(), nullable=False),
+        pa.field("link_found", pa.uint64(), nullable=False),
+        pa.field("tx_order", pa.uint32(), nullable=False),
+        pa.field("tx_status", pa.uint32(), nullable=False),
+        pa.field("payload_size", pa.uint64(), nullable=False),
+        pa.field("tx_fail_reason", pa.uint32(), nullable=False),
+        pa.field("latency", pa.uint64(), nullable=False),
+    ]
+)
+
+LINKS_SCHEMA = pa.schema(
+    [
+        pa.field("time_step", pa.uint64(), nullable=False),
+        pa.field("agent_id", pa.uint64(), nullable=False),
+        pa.field("target_id", pa.uint64(), nullable=False),
+        pa.field("distance", pa.float32(), nullable=False),
+    ]
+)
+
+
+def load_settings(config_path):
+    """
+    Reads the [fake_disolv] table of a stage config and applies the artificial latency.
+
+    Args:
+        config_path (str): Path to the stage config.
+
+    Returns:
+        dict: The settings.
+    """
+    settings = toml.load(config_path)["fake_disolv"]
+    time.sleep(float(settings.get("latency", 0.0)))
+    return settings
+
+
+def read_rsus(deployment_path):
+    """
+    Returns:
+        numpy.ndarray, numpy.ndarray: Agent ids and (N, 2) positions of the RSUs.
+    """
+    deployment = pq.read_table(deployment_path, columns=["agent_id", "x", "y"])
+    positions = np.column_stack((deployment["x"].to_numpy(), deployment["y"].to_numpy())).astype(np.float64)
+    return deployment["agent_id"].to_numpy().astype(np.uint64), positions.reshape(-1, 2)
+
+
+def read_vehicles(fcd_path):
+    """
+    Returns:
+        numpy.ndarray, numpy.ndarray, numpy.ndarray: Time steps, agent ids and (N, 2) positions of the
+        vehicle records, sorted by time step.
+    """
+    fcd = pq.read_table(fcd_path, columns=["time_step", "agent_id", "x", "y"])
+    agent_ids = fcd["agent_id"].to_numpy()
+    vehicles = agent_ids < RSU_AGENT_ID_OFFSET
+    time_steps = fcd["time_step"].to_numpy()[vehicles]
+    order = np.argsort(time_steps, kind="stable")
+    positions = np.column_stack((fcd["x"].to_numpy()[vehicles], fcd["y"].to_numpy()[vehicles]))
+    return (
+        time_steps[order].astype(np.uint64),
+        agent_ids[vehicles][order].astype(np.uint64),
+        positions[order].astype(np.float64),
+    )
+
+
+def compute_links(settings):
+    """
+    Writes the links between every vehicle record and the RSUs within link_radius.
+    """
+    rsu_ids, rsu_positions = read_rsus(settings["deployment"])
+    time_steps, vehicle_ids, vehicle_positions = read_vehicles(settings["fcd"])
+    if len(rsu_ids) and len(vehicle_ids):
+        links = cKDTree(vehicle_positions).sparse_distance_matrix(
+            cKDTree(rsu_positions), float(settings.get("link_radius", 1000.0)), output_type="ndarray"
+        )
+        links.sort(order=["i", "j"])
+    else:
+        links = np.zeros(0, dtype=[("i", np.intp), ("j", np.intp), ("v", np.float64)])
+
+    table = pa.Table.from_arrays(
+        [
+            pa.array(time_steps[links["i"]]),
+            pa.array(vehicle_ids[links["i"]]),
+            pa.array(rsu_ids[links["j"]]),
+            pa.array(links["v"].astype(np.float32)),
+        ],
+        schema=LINKS_SCHEMA,
+    )
+    os.makedirs(os.path.dirname(settings["links"]), exist_ok=True)
+    pq.write_table(table, settings["links"])
+
+
+def simulate(settings):
+    """
+    Writes tx_data.parquet with the transmissions of all vehicle records.
+    """
+    rsu_ids, rsu_positions = read_rsus(settings["deployment"])
+    time_steps, vehicle_ids, vehicle_positions = read_vehicles(settings["fcd"])
+    v2v_radius = float(settings.get("v2v_radius", 100.0))
+
+    # Every record transmits to its closest RSU
+    records = np.arange(len(vehicle_ids)) if len(rsu_ids) else np.zeros(0, dtype=np.intp)
+    selected_agents = np.zeros(0, dtype=np.uint64)
+    distances = np.zeros(0)
+    if len(records):
+        distances, closest_rsus = cKDTree(rsu_positions).query(vehicle_positions)
+        selected_agents = rsu_ids[closest_rsus]
+    transmissions = [(records, selected_agents, distances, 1)]
+
+    # and relays through the closest other vehicle of the same time step within v2v_radius
+    boundaries = np.flatnonzero(np.diff(time_steps)) + 1
+    for start, end in zip(np.r_[0, boundaries], np.r_[boundaries, len(vehicle_ids)]):
+        if end - start < 2:
+            continue
+        neighbor_distances, neighbors = cKDTree(vehicle_positions[start:end]).query(
+            vehicle_positions[start:end], k=2, distance_upper_bound=v2v_radius
+        )
+        relayed = np.flatnonzero(np.isfinite(neighbor_distances[:, 1]))
+        transmissions.append(
+            (
+                start + relayed,
+                vehicle_ids[start + neighbors[relayed, 1]],
+                neighbor_distances[relayed, 1],
+                2,
+            )
+        )
+
+    records = np.concatenate([transmission[0] for transmission in transmissions])
+    order = np.argsort(records, kind="stable")
+    records = records[order]
+    num_rows = len(records)
+    zeros = np.zeros(num_rows, dtype=np.uint32)
+    table = pa.Table.from_arrays(
+        [
+            pa.array(time_steps[records]),
+            pa.array(vehicle_ids[records]),
+            pa.array(np.concatenate([transmission[1] for transmission in transmissions])[order].astype(np.uint64)),
+            pa.array(
+                np.concatenate([transmission[2] for transmission in transmissions])[order].astype(np.float32)
+            ),
+            pa.array(np.ones(num_rows, dtype=np.uint32)),
+            pa.array(time_steps[records]),
+            pa.array(
+                np.concatenate(
+                    [
+                        np.full(len(transmission[0]), transmission[3], dtype=np.uint32)
+                        for transmission in transmissions
+                    ]
+                )[order]
+            ),
+            pa.array(zeros),
+            pa.array(np.zeros(num_rows, dtype=np.uint64)),
+            pa.array(zeros),
+            pa.array(np.zeros(num_rows, dtype=np.uint64)),
+        ],
+        schema=TX_DATA_SCHEMA,
+    )
+    os.makedirs(settings["output_path"], exist_ok=True)
+    pq.write_table(table, os.path.join(settings["output_path"], "tx_data.parquet"))
+
+
+def parse_config_path(prog):
+    parser = argparse.ArgumentParser(prog=prog)
+    parser.add_argument("--config", required=True, help="Path to the stage config (.toml)")
+    return parser.parse_args().config
+
+
+def links_main():
+    compute_links(load_settings(parse_config_path("fake-disolv-links")))
+
+
+def v2x_main():
+    simulate(load_settings(parse_config_path("fake-disolv-v2x")))
+
+
+# Stage -> entry point, for running the stand-in without installing the console scripts
+STAGES = {"links": links_main, "v2x": v2x_main}
+
+if __name__ == "__main__":
+    STAGES[sys.argv.pop(1)]()
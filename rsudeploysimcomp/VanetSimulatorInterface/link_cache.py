@@ -0,0 +1,169 @@
+import hashlib
+import os
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from rsudeploysimcomp.SUMOInterface.scenario_cache import directory_fingerprint
+from rsudeploysimcomp.Utils.utils import atomic_output_path
+
+# Agent ids from this value on are RSUs, below are vehicles
+RSU_AGENT_ID_OFFSET = 200000
+
+# Slice of the links that do not involve any RSU
+VEHICLE_LINKS_FILE = "vehicles.parquet"
+
+
+class LinkCache:
+    """
+    Cache of the links computed by disolv-links, sliced per candidate RSU position.
+
+    A slice holds all links between one RSU position and the vehicles over time, with the RSU stored under
+    RSU_AGENT_ID_OFFSET. The link file of a deployment is assembled by renumbering the slices of its
+    positions to the agent ids of the deployment (RSU_AGENT_ID_OFFSET + index) and concatenating them, so
+    disolv-links only runs for positions that have never been seen before. Links between two RSUs depend on
+    the pair of positions and are not cached; links.toml is expected to only compute vehicle links.
+
+    Entries are keyed by the fingerprints of all files of the raw scenario directory and by the content of
+    the shared links.toml, like the prep-disolv cache. The vehicle positions file itself is rewritten by every
+    full prep-disolv run, so its fingerprint would change even though the trace did not.
+    """
+
+    def __init__(self, config):
+        """
+        Args:
+            config (dict): Application config.
+        """
+        base_path = config["General"]["base_path"]
+        vanet_config = config["VanetInterface"]
+        scenario = vanet_config["scenario"]
+        link_cache_config = vanet_config["link_cache"]
+
+        self.raw_path = base_path + vanet_config["raw_path"] + scenario
+        self.links_config_path = base_path + vanet_config["configs_path"] + scenario + "/links.toml"
+        self.cache_path = base_path + link_cache_config["cache_path"] + scenario
+        self.link_file = link_cache_config["link_file"]
+        self.agent_columns = link_cache_config["agent_columns"]
+        self.time_column = link_cache_config["time_column"]
+        self.entry_path = None
+
+    def get_entry_path(self):
+        """
+        Returns:
+            str: Directory of the cache entry of the current raw trace.
+        """
+        if self.entry_path is None:
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(directory_fingerprint(self.raw_path).encode())
+            with open(self.links_config_path, "rb") as file:
+                digest.update(file.read())
+            self.entry_path = os.path.join(self.cache_path, digest.hexdigest())
+        return self.entry_path
+
+    def has_vehicle_links(self):
+        return os.path.exists(os.path.join(self.get_entry_path(), VEHICLE_LINKS_FILE))
+
+    def slice_path(self, position):
+        return os.path.join(
+            self.get_entry_path(), f"rsu_{float(position[0]):.3f}_{float(position[1]):.3f}.parquet"
+        )
+
+    def missing_positions(self, positions):
+        """
+        Args:
+            positions (iterable): (x, y) coordinates of the RSUs.
+
+        Returns:
+            list: Positions without a cached slice, without duplicates.
+        """
+        missing = {}
+        for position in positions:
+            slice_path = self.slice_path(position)
+            if slice_path not in missing and not os.path.exists(slice_path):
+                missing[slice_path] = position
+        return list(missing.values())
+
+    def store(self, links, positions):
+        """
+        Splits the links computed for a deployment into per-position slices and caches them.
+
+        Args:
+            links (pyarrow.Table): Output of disolv-links.
+            positions (list): (x, y) coordinates of the RSUs, in the order of the deployment.
+        """
+        os.makedirs(self.get_entry_path(), exist_ok=True)
+        rsu_flags = [pc.greater_equal(links[column], RSU_AGENT_ID_OFFSET) for column in self.agent_columns]
+        num_rsu_agents = np.sum([flag.to_numpy(zero_copy_only=False) for flag in rsu_flags], axis=0)
+
+        if not self.has_vehicle_links():
+            write_table_atomically(
+                links.filter(pa.array(num_rsu_agents == 0)),
+                os.path.join(self.get_entry_path(), VEHICLE_LINKS_FILE),
+            )
+
+        rsu_links = links.filter(pa.array(num_rsu_agents == 1))
+        for index, position in enumerate(positions):
+            agent_id = RSU_AGENT_ID_OFFSET + index
+            matches = [pc.equal(rsu_links[column], agent_id) for column in self.agent_columns]
+            write_table_atomically(
+                renumber_rsu(rsu_links.filter(_any(matches)), self.agent_columns, agent_id, RSU_AGENT_ID_OFFSET),
+                self.slice_path(position),
+            )
+
+    def assemble(self, positions, link_file_path):
+        """
+        Writes the link file of a deployment from the cached slices.
+
+        Args:
+            positions (list): (x, y) coordinates of the RSUs, in the order of the deployment.
+            link_file_path (str): Path of the link file read by disolv-v2x.
+        """
+        tables = [pq.read_table(os.path.join(self.get_entry_path(), VEHICLE_LINKS_FILE))]
+        for index, position in enumerate(positions):
+            position_links = pq.read_table(self.slice_path(position))
+            tables.append(
+                renumber_rsu(position_links, self.agent_columns, RSU_AGENT_ID_OFFSET, RSU_AGENT_ID_OFFSET + index)
+            )
+        links = pa.concat_tables(tables)
+        if self.time_column is not None:
+            links = links.sort_by(self.time_column)
+        os.makedirs(os.path.dirname(link_file_path), exist_ok=True)
+        pq.write_table(links, link_file_path)
+
+
+def _any(conditions):
+    result = conditions[0]
+    for condition in conditions[1:]:
+        result = pc.or_(result, condition)
+    return result
+
+
+def renumber_rsu(links, agent_columns, old_agent_id, new_agent_id):
+    """
+    Replaces the agent id of an RSU in the agent columns of a link table.
+
+    Args:
+        links (pyarrow.Table): Links.
+        agent_columns (list): Names of the columns holding agent ids.
+        old_agent_id (int): Current agent id of the RSU.
+        new_agent_id (int): New agent id of the RSU.
+
+    Returns:
+        pyarrow.Table: The renumbered links.
+    """
+    if old_agent_id == new_agent_id:
+        return links
+    for column in agent_columns:
+        values = links[column]
+        renumbered = pc.if_else(pc.equal(values, old_agent_id), pa.scalar(new_agent_id, values.type), values)
+        # Keep the original field, if_else drops its non-null flag
+        field_index = links.schema.get_field_index(column)
+        links = links.set_column(field_index, links.schema.field(field_index), renumbered)
+    return links
+
+
+def write_table_atomically(table, path):
+    with atomic_output_path(path) as tmp_path:
+        pq.write_table(table, tmp_path)
@@ -0,0 +1,105 @@
+import hashlib
+import os
+import shutil
+
+from rsudeploysimcomp.SUMOInterface.scenario_cache import directory_fingerprint
+from rsudeploysimcomp.Utils.utils import atomic_output_path, link_file
+
+
+class PrepDisolvCache:
+    """
+    Cache of the vehicle-side outputs of prep-disolv.
+
+    The vehicle positions only depend on the raw traffic trace, not on the RSU deployment, so they are
+    computed once per trace and copied back into the input directory afterwards. Once the cache is warm,
+    prep-disolv only runs with the RSU-only config (`rsu_config`), which skips the vehicle work. The RSU-only
+    config is not part of the repo; without it in the stage configs directory the cache is not used.
+
+    Entries are keyed by the fingerprints of all files of the raw scenario directory and by the content of
+    the shared positions.toml.
+    """
+
+    def __init__(self, config):
+        """
+        Args:
+            config (dict): Application config.
+        """
+        base_path = config["General"]["base_path"]
+        vanet_config = config["VanetInterface"]
+        scenario = vanet_config["scenario"]
+        prep_cache_config = vanet_config["prep_cache"]
+
+        self.raw_path = base_path + vanet_config["raw_path"] + scenario
+        self.positions_config_path = base_path + vanet_config["configs_path"] + scenario + "/positions.toml"
+        self.cache_path = base_path + prep_cache_config["cache_path"] + scenario
+        self.rsu_config_file = prep_cache_config["rsu_config"]
+        self.vehicle_outputs = prep_cache_config["vehicle_outputs"]
+        self.entry_path = None
+        # Input directories the vehicle outputs have already been restored into
+        self.restored_input_paths = set()
+
+    def get_entry_path(self):
+        """
+        Returns:
+            str: Directory of the cache entry of the current raw trace.
+        """
+        if self.entry_path is None:
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(directory_fingerprint(self.raw_path).encode())
+            with open(self.positions_config_path, "rb") as file:
+                digest.update(file.read())
+            self.entry_path = os.path.join(self.cache_path, digest.hexdigest())
+        return self.entry_path
+
+    def is_warm(self):
+        return all(os.path.exists(self.get_entry_path() + output) for output in self.vehicle_outputs)
+
+    def has_rsu_config(self, configs_path):
+        """
+        Args:
+            configs_path (str): Directory of the stage configs.
+
+        Returns:
+            bool: Whether the RSU-only config exists, which is required to make use of the cache.
+        """
+        return os.path.exists(os.path.join(configs_path, self.rsu_config_file))
+
+    def store(self, input_path):
+        """
+        Copies the vehicle outputs of a full prep-disolv run into the cache.
+
+        Args:
+            input_path (str): Input directory prep-disolv has written to.
+        """
+        if not all(os.path.exists(input_path + output) for output in self.vehicle_outputs):
+            print("prep-disolv did not write all vehicle outputs, not caching them")
+            return
+        for output in self.vehicle_outputs:
+            copy_file_atomically(input_path + output, self.get_entry_path() + output)
+        self.restored_input_paths.add(input_path)
+
+    def restore(self, input_path):
+        """
+        Links the cached vehicle outputs into an input directory. The links have to be removed before a full
+        prep-disolv run writes the outputs again (see Utils.unlink_shared_file).
+
+        Args:
+            input_path (str): Input directory prep-disolv reads from and writes to.
+        """
+        if input_path in self.restored_input_paths:
+            return
+        for output in self.vehicle_outputs:
+            link_file(self.get_entry_path() + output, input_path + output)
+        self.restored_input_paths.add(input_path)
+
+
+def copy_file_atomically(source_path, target_path):
+    """
+    Copies a file via a temporary file, so concurrent readers never observe a partially written target.
+
+    Args:
+        source_path (str): Path of the file to copy.
+        target_path (str): Path of the copy.
+    """
+    with atomic_output_path(target_path) as tmp_target_path:
+        shutil.copy2(source_path, tmp_target_path)
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import time
+
+# Seconds a connection waits for the lock held by another process
+SQLITE_TIMEOUT = 60
+
+
+def deployment_cache_key(scenario, rsu_positions, rsu_radius, simulator_version, trace_fingerprint, precision=3):
+    """
+    Builds the canonical key of an evaluated deployment.
+
+    The RSU coordinates are rounded and sorted, so the same set of positions maps to the same key regardless
+    of the order the algorithm picked them in.
+
+    Args:
+        scenario (str): Name of the scenario.
+        rsu_positions (iterable): (x, y) coordinates of the RSUs.
+        rsu_radius (float): Range of an RSU.
+        simulator_version (str): Identifies the simulator (binaries and evaluator) that produced the metrics.
+        trace_fingerprint (str): Identifies the content of the vehicle trace the deployment was evaluated on.
+        precision (int): Number of decimals the coordinates are rounded to.
+
+    Returns:
+        str: Hex digest of the deployment.
+    """
+    positions = sorted([round(float(x), precision), round(float(y), precision)] for x, y in rsu_positions)
+    canonical = json.dumps(
+        {
+            "scenario": scenario,
+            "rsu_positions": positions,
+            "rsu_radius": float(rsu_radius),
+            "simulator_version": simulator_version,
+            "trace_fingerprint": trace_fingerprint,
+        },
+        sort_keys=True,
+    )
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+
+class DeploymentResultCache:
+    """
+    Persistent cache of the metrics of evaluated deployments, shared by all runs and processes.
+
+    The results are kept in a SQLite database in WAL mode, so concurrent processes can read while one of them
+    writes. Every operation opens its own connection, which also makes the cache safe to use from the
+    threads of `VanetSimulatorInterface.evaluate_many`. Once the cache holds more than `max_entries`
+    results, the least recently used ones are evicted.
+
+    Besides coverage and average distance, a result can hold the per time step aggregates of the deployment
+    (see `TxDataSummary.to_json`), as a cache hit does not write a tx_data.parquet to read them from.
+    """
+
+    def __init__(self, db_path, max_entries):
+        """
+        Args:
+            db_path (str): Path of the SQLite database.
+            max_entries (int): Maximum number of cached results.
+        """
+        self.db_path = db_path
+        self.max_entries = max_entries
+        # Hits and misses of this instance; the totals of all processes are kept in the database
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self.connect() as connection:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results "
+                "(key TEXT PRIMARY KEY, coverage REAL, avg_distance REAL, last_used REAL, per_time_step TEXT)"
+            )
+            # Databases created before the per time step aggregates were cached lack their column
+            columns = [row[1] for row in connection.execute("PRAGMA table_info(results)")]
+            if "per_time_step" not in columns:
+                connection.execute("ALTER TABLE results ADD COLUMN per_time_step TEXT")
+            connection.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+            connection.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)")
+            connection.execute("INSERT OR IGNORE INTO counters VALUES ('hits', 0), ('misses', 0)")
+        connection.close()
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=SQLITE_TIMEOUT)
+
+    def get(self, key):
+        """
+        Looks up the metrics of a deployment and marks them as recently used.
+
+        Args:
+            key (str): Key from `deployment_cache_key`.
+
+        Returns:
+            tuple: (coverage, avg_distance), or None if the deployment has not been evaluated yet.
+        """
+        with self.connect() as connection:
+            row = connection.execute("SELECT coverage, avg_distance FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                connection.execute("UPDATE counters SET value = value + 1 WHERE name = 'misses'")
+            else:
+                self.hits += 1
+                connection.execute("UPDATE counters SET value = value + 1 WHERE name = 'hits'")
+                connection.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        connection.close()
+        if row is None:
+            return None
+        coverage, avg_distance = row
+        # SQLite stores NaN as NULL
+        return coverage, float("nan") if avg_distance is None else avg_distance
+
+    def get_per_time_step(self, key):
+        """
+        Looks up the per time step aggregates of a deployment, without counting a hit or miss.
+
+        Args:
+            key (str): Key from `deployment_cache_key`.
+
+        Returns:
+            str: The aggregates as stored by `put`, or None if there are none.
+        """
+        with self.connect() as connection:
+            row = connection.execute("SELECT per_time_step FROM results WHERE key = ?", (key,)).fetchone()
+        connection.close()
+        return None if row is None else row[0]
+
+    def put(self, key, coverage, avg_distance, per_time_step=None):
+        """
+        Stores the metrics of a deployment and evicts the least recently used results beyond max_entries.
+
+        Args:
+            key (str): Key from `deployment_cache_key`.
+            coverage (float): Coverage percentage.
+            avg_distance (float): Average distance.
+            per_time_step (str, optional): Per time step aggregates from `TxDataSummary.to_json`.
+        """
+        avg_distance = None if math.isnan(avg_distance) else float(avg_distance)
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO results (key, coverage, avg_distance, last_used, per_time_step) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, float(coverage), avg_distance, time.time(), per_time_step),
+            )
+            (num_entries,) = connection.execute("SELECT COUNT(*) FROM results").fetchone()
+            if num_entries > self.max_entries:
+                connection.execute(
+                    "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY last_used LIMIT ?)",
+                    (num_entries - self.max_entries,),
+                )
+        connection.close()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Hits and misses of this instance, of all processes, and the number of cached results.
+        """
+        with self.connect() as connection:
+            totals = dict(connection.execute("SELECT name, value FROM counters").fetchall())
+            (num_entries,) = connection.execute("SELECT COUNT(*) FROM results").fetchone()
+        connection.close()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "total_hits": totals["hits"],
+            "total_misses": totals["misses"],
+            "entries": num_entries,
+        }
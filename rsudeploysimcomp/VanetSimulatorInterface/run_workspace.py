@@ -0,0 +1,65 @@
+import glob
+import os
+
+from rsudeploysimcomp.Utils.utils import link_file
+
+
+class EvaluationWorkspace:
+    """
+    Private copy of the scenario's input, output and config directories, so that several deployments can be
+    evaluated by disolv at the same time.
+
+    The stage configs (all .toml files of the shared configs directory) are copied with every occurrence of
+    the shared input, output and configs directories replaced by the private ones. The raw inputs stay
+    shared, as they are only read.
+
+    Of the shared input directory, only the multi-GB vehicle inputs (the FCD Parquet file and the prep-disolv
+    vehicle outputs) are provided, and only if they are just read, i.e. with the fake simulator, which skips
+    prep-disolv. They are linked instead of copied. Otherwise prep-disolv or the prep cache provides them. All
+    other inputs (deployment and link files) are written by the pipeline for every deployment.
+    """
+
+    def __init__(self, root_path, config):
+        """
+        Args:
+            root_path (str): Directory of the workspace.
+            config (dict): Application config.
+        """
+        base_path = config["General"]["base_path"]
+        vanet_config = config["VanetInterface"]
+        scenario = vanet_config["scenario"]
+
+        self.root_path = root_path
+        self.shared_paths = {
+            "input": base_path + vanet_config["input_path"] + scenario,
+            "output": base_path + vanet_config["output_path"] + scenario,
+            "configs": base_path + vanet_config["configs_path"] + scenario,
+        }
+        self.paths = {name: os.path.join(root_path, name) for name in self.shared_paths}
+        self.configs_path = self.paths["configs"]
+        self.deployment_csv_path = self.paths["input"] + vanet_config["deployment_csv_path"]
+        self.deployment_parquet_path = self.paths["input"] + vanet_config["deployment_parquet_path"]
+        self.tx_data_parquet_path = self.paths["output"] + "/tx_data.parquet"
+        # Input files relative to the input directory
+        self.vehicle_inputs = {vanet_config["fcd_parquet"], *vanet_config["prep_cache"]["vehicle_outputs"]}
+        self.link_vehicle_inputs = vanet_config["simulator"] == "fake"
+
+    def materialize(self):
+        """
+        Creates the workspace directories, provides the shared inputs and writes the templated stage configs.
+        """
+        if self.link_vehicle_inputs:
+            for relative_path in sorted(self.vehicle_inputs):
+                if os.path.exists(self.shared_paths["input"] + relative_path):
+                    link_file(self.shared_paths["input"] + relative_path, self.paths["input"] + relative_path)
+        os.makedirs(os.path.dirname(self.deployment_parquet_path), exist_ok=True)
+        os.makedirs(self.paths["output"], exist_ok=True)
+        os.makedirs(self.configs_path, exist_ok=True)
+
+        for stage_config_path in sorted(glob.glob(os.path.join(self.shared_paths["configs"], "*.toml"))):
+            with open(stage_config_path, "r") as file:
+                stage_config = file.read()
+            for name, shared_path in self.shared_paths.items():
+                stage_config = stage_config.replace(shared_path, self.paths[name])
+            with open(os.path.join(self.configs_path, os.path.basename(stage_config_path)), "w") as file:
+                file.write(stage_config)
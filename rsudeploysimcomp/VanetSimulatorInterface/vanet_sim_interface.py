@@ -1,15 +1,56 @@
+import asyncio
 import csv
+import functools
+import itertools
+import json
+import os
+import queue
 import subprocess
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from scipy.spatial import cKDTree
 
-from rsudeploysimcomp.Utils.utils import load_config
+from rsudeploysimcomp.SUMOInterface.scenario_cache import directory_fingerprint, file_fingerprint
+from rsudeploysimcomp.Utils.utils import load_config, unlink_shared_file
+from rsudeploysimcomp.VanetSimulatorInterface.async_runner import AsyncStageRunner
+from rsudeploysimcomp.VanetSimulatorInterface.link_cache import RSU_AGENT_ID_OFFSET, LinkCache
+from rsudeploysimcomp.VanetSimulatorInterface.prep_cache import PrepDisolvCache
+from rsudeploysimcomp.VanetSimulatorInterface.result_cache import DeploymentResultCache, deployment_cache_key
+from rsudeploysimcomp.VanetSimulatorInterface.run_workspace import EvaluationWorkspace
+
+# Schema of the deployment file read by disolv
+DEPLOYMENT_SCHEMA = pa.schema(
+    [("time_step", pa.int64()), ("agent_id", pa.int64()), ("x", pa.float64()), ("y", pa.float64())]
+)
+
+# Columns of tx_data.parquet needed for the metrics
+TX_DATA_COLUMNS = ["time_step", "agent_id", "selected_agent", "distance"]
+
+# Number of tx_data rows aggregated at a time
+TX_DATA_BATCH_SIZE = 1 << 18
+
+# Local stand-in for disolv-links and disolv-v2x, used with VanetInterface.simulator: fake
+FAKE_DISOLV_MODULE = "rsudeploysimcomp.VanetSimulatorInterface.fake_disolv"
+FAKE_DISOLV_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_disolv.py")
+
+# Execution times of the pipeline stages, if VanetInterface.track_execution_time is enabled
+PIPELINE_EXEC_TIME_CSV = "ExecTime/Pipeline/pipeline_exec_time.csv"
+
+# Serializes appends to the execution time CSV of concurrent evaluations
+exec_time_lock = threading.Lock()
 
 
 def export_picked_locations_to_csv(file_path, junctions):
     data = list(junctions)
-    agent_ids = [200000 + i for i in range(len(junctions))]
+    agent_ids = [RSU_AGENT_ID_OFFSET + i for i in range(len(junctions))]
     time_steps = [0] * len(junctions)
     df = pd.DataFrame(
         {
@@ -22,17 +63,42 @@ def export_picked_locations_to_csv(file_path, junctions):
     df.to_csv(file_path, index=False)
 
 
-def convert_csv_to_parquet(csv_file_path, parquet_file_path):
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(csv_file_path)
+def build_deployment_table(junctions):
+    """
+    Builds the deployment of the picked RSU locations as an Arrow table, one RSU agent per location.
 
-    # Convert the DataFrame to Parquet format
-    df.to_parquet(parquet_file_path, index=False)
+    Args:
+        junctions (iterable): (x, y) coordinates of the RSUs.
 
+    Returns:
+        pyarrow.Table: Deployment with DEPLOYMENT_SCHEMA.
+    """
+    coordinates = np.asarray(list(junctions), dtype=np.float64).reshape(-1, 2)
+    num_rsus = len(coordinates)
+    return pa.Table.from_arrays(
+        [
+            pa.array(np.zeros(num_rsus, dtype=np.int64)),
+            pa.array(np.arange(RSU_AGENT_ID_OFFSET, RSU_AGENT_ID_OFFSET + num_rsus, dtype=np.int64)),
+            pa.array(coordinates[:, 0]),
+            pa.array(coordinates[:, 1]),
+        ],
+        schema=DEPLOYMENT_SCHEMA,
+    )
+
+
+def generate_deployment_file(junctions, csv_path, parquet_path, write_csv=False):
+    """
+    Writes the deployment Parquet file read by disolv.
 
-def generate_deployment_file(junctions, csv_path, parquet_path):
-    export_picked_locations_to_csv(csv_path, junctions)
-    convert_csv_to_parquet(csv_path, parquet_path)
+    Args:
+        junctions (iterable): (x, y) coordinates of the RSUs.
+        csv_path (str): Path of the CSV copy of the deployment.
+        parquet_path (str): Path of the deployment Parquet file.
+        write_csv (bool): Whether to additionally write the CSV copy, e.g. for debugging.
+    """
+    pq.write_table(build_deployment_table(junctions), parquet_path)
+    if write_csv:
+        export_picked_locations_to_csv(csv_path, junctions)
 
 
 def run_command(command):
@@ -43,37 +109,354 @@ def run_command(command):
         print("stderr:", result.stderr)
         print("stdout:", result.stdout)  # Optional, if stdout is also relevant
         print("Return code:", result.returncode)
+    return result.returncode == 0
 
 
-def prep_position_files(prep_disolv_path, configs_path):
-    command = [
+def prep_position_files_command(prep_disolv_path, configs_path, config_file="positions.toml"):
+    return [
         prep_disolv_path + "/.venv/bin/python",
         prep_disolv_path + "/src/__main__.py",
         "--config",
-        configs_path + "/positions.toml",
+        configs_path + "/" + config_file,
     ]
-    run_command(command)
+
+
+def fake_disolv_command(stage, config_path):
+    return [sys.executable, "-m", FAKE_DISOLV_MODULE, stage, "--config", config_path]
+
+
+def prep_link_file_command(disolv_path, configs_path, simulator="disolv"):
+    if simulator == "fake":
+        return fake_disolv_command("links", configs_path + "/links.toml")
+    return [disolv_path + "/target/release/disolv-links", "--config", configs_path + "/links.toml"]
+
+
+def run_rsu_simulator_command(disolv_path, configs_path, simulator="disolv"):
+    if simulator == "fake":
+        return fake_disolv_command("v2x", configs_path + "/disolv.toml")
+    return [disolv_path + "/target/release/disolv-v2x", "--config", configs_path + "/disolv.toml"]
+
+
+def prep_position_files(prep_disolv_path, configs_path, config_file="positions.toml"):
+    return run_command(prep_position_files_command(prep_disolv_path, configs_path, config_file))
     # print("Prep position files done")
 
 
-def prep_link_file(disolv_path, configs_path):
-    command = [disolv_path + "/target/release/disolv-links", "--config", configs_path + "/links.toml"]
-    run_command(command)
+def prep_link_file(disolv_path, configs_path, simulator="disolv"):
+    return run_command(prep_link_file_command(disolv_path, configs_path, simulator))
     # print("Prep link files done")
 
 
-def run_rsu_simulator(disolv_path, configs_path):
-    command = [disolv_path + "/target/release/disolv-v2x", "--config", configs_path + "/disolv.toml"]
-    run_command(command)
+def run_rsu_simulator(disolv_path, configs_path, simulator="disolv"):
+    return run_command(run_rsu_simulator_command(disolv_path, configs_path, simulator))
     # print("Run Simulator")
 
 
+def load_vehicle_records(fcd_parquet_path):
+    """
+    Loads the time_step, x, y columns of all vehicle records of the (offset-adjusted) FCD written by
+    prep-disolv.
+
+    The records are loaded once per version of the file and shared by all evaluations. A file rewritten by
+    prep-disolv is loaded again.
+
+    Args:
+        fcd_parquet_path (str): Path to the FCD Parquet file.
+
+    Returns:
+        numpy.ndarray, numpy.ndarray: Time steps and (N, 2) array of positions of the vehicle records.
+    """
+    return read_vehicle_records(fcd_parquet_path, file_fingerprint(fcd_parquet_path))
+
+
+@functools.lru_cache(maxsize=1)
+def read_vehicle_records(fcd_parquet_path, fingerprint):
+    """
+    Reads the vehicle records for `load_vehicle_records`. Only the last file is kept in memory.
+
+    Args:
+        fcd_parquet_path (str): Path to the FCD Parquet file.
+        fingerprint (str): Fingerprint of the file, which only keys the cache.
+
+    Returns:
+        numpy.ndarray, numpy.ndarray: Time steps and (N, 2) array of positions of the vehicle records.
+    """
+    table = pq.read_table(fcd_parquet_path, columns=["time_step", "agent_id", "x", "y"])
+    vehicles = table["agent_id"].to_numpy() < RSU_AGENT_ID_OFFSET
+    positions = np.column_stack((table["x"].to_numpy()[vehicles], table["y"].to_numpy()[vehicles]))
+    return table["time_step"].to_numpy()[vehicles], positions
+
+
+def compute_geometric_metrics(rsu_positions, vehicle_positions, rsu_radius):
+    """
+    Computes coverage and average distance of an RSU deployment geometrically, without running disolv.
+
+    Every vehicle record is assigned to its closest RSU, found with a KD-tree over the RSU positions.
+
+    Args:
+        rsu_positions (iterable): (x, y) coordinates of the RSUs.
+        vehicle_positions (numpy.ndarray): (N, 2) array of vehicle positions.
+        rsu_radius (float): Range of an RSU.
+
+    Returns:
+        float, float: Percentage of vehicle records within rsu_radius of an RSU and the average distance
+        of the vehicle records to their closest RSU.
+    """
+    rsu_positions = np.asarray(list(rsu_positions), dtype=float).reshape(-1, 2)
+    if len(rsu_positions) == 0 or len(vehicle_positions) == 0:
+        return 0, float("nan")
+    distances, _ = cKDTree(rsu_positions).query(vehicle_positions, workers=-1)
+    coverage_percentage = float(np.count_nonzero(distances <= rsu_radius) / len(distances) * 100)
+    return coverage_percentage, float(distances.mean())
+
+
+def compute_geometric_summary(rsu_positions, time_steps, vehicle_positions, rsu_radius):
+    """
+    Aggregates the geometric closest-RSU distances of `compute_geometric_metrics` in total and per time step.
+
+    Args:
+        rsu_positions (iterable): (x, y) coordinates of the RSUs.
+        time_steps (numpy.ndarray): Time steps of the vehicle records.
+        vehicle_positions (numpy.ndarray): (N, 2) array of vehicle positions.
+        rsu_radius (float): Range of an RSU.
+
+    Returns:
+        TxDataSummary: The aggregates, as if disolv had written one transmission per vehicle record.
+    """
+    summary = TxDataSummary(rsu_radius)
+    rsu_positions = np.asarray(list(rsu_positions), dtype=float).reshape(-1, 2)
+    if len(rsu_positions) and len(vehicle_positions):
+        distances, _ = cKDTree(rsu_positions).query(vehicle_positions, workers=-1)
+        summary.add(time_steps, distances)
+    return summary
+
+
+def scan_relevant_tx_data(tx_data_parquet_path, batch_size=TX_DATA_BATCH_SIZE):
+    """
+    Scans the relevant rows of tx_data.parquet: links from a vehicle to an RSU.
+
+    Only TX_DATA_COLUMNS are read and the vehicle/RSU filter is pushed down into the Arrow dataset scan.
+
+    Args:
+        tx_data_parquet_path (str): Path to tx_data.parquet.
+        batch_size (int): Maximum number of rows per batch.
+
+    Returns:
+        pyarrow.dataset.Scanner: Scanner of TX_DATA_COLUMNS, streamed with to_batches().
+    """
+    relevant = (ds.field("agent_id") < RSU_AGENT_ID_OFFSET) & (ds.field("selected_agent") >= RSU_AGENT_ID_OFFSET)
+    dataset = ds.dataset(tx_data_parquet_path, format="parquet")
+    return dataset.scanner(columns=TX_DATA_COLUMNS, filter=relevant, batch_size=batch_size)
+
+
+class TxDataSummary:
+    """
+    Running coverage and distance aggregates of the relevant tx_data rows, in total and per time step.
+    """
+
+    def __init__(self, rsu_radius):
+        self.rsu_radius = rsu_radius
+        self.total_records = 0
+        self.covered_records = 0
+        self.distance_sum = 0.0
+        # Time step -> [records, covered records, distance sum]
+        self.per_time_step = {}
+
+    @classmethod
+    def from_parquet(cls, tx_data_parquet_path, rsu_radius):
+        """
+        Aggregates tx_data.parquet batch by batch, so memory stays flat regardless of the file size.
+
+        Args:
+            tx_data_parquet_path (str): Path to tx_data.parquet.
+            rsu_radius (float): Range of an RSU.
+
+        Returns:
+            TxDataSummary: The aggregates.
+        """
+        summary = cls(rsu_radius)
+        for batch in scan_relevant_tx_data(tx_data_parquet_path).to_batches():
+            summary.add(batch["time_step"].to_numpy(), batch["distance"].to_numpy().astype(np.float64))
+        return summary
+
+    @classmethod
+    def from_json(cls, per_time_step, rsu_radius):
+        """
+        Restores the aggregates serialized by `to_json`.
+
+        Args:
+            per_time_step (str): Serialized per time step aggregates.
+            rsu_radius (float): Range of an RSU.
+
+        Returns:
+            TxDataSummary: The aggregates.
+        """
+        summary = cls(rsu_radius)
+        for time_step, records, covered_records, distance_sum in json.loads(per_time_step):
+            summary.per_time_step[time_step] = [records, covered_records, distance_sum]
+            summary.total_records += records
+            summary.covered_records += covered_records
+            summary.distance_sum += distance_sum
+        return summary
+
+    def to_json(self):
+        """
+        Returns:
+            str: The per time step aggregates, from which all totals can be restored.
+        """
+        return json.dumps(
+            [
+                [time_step, int(records), int(covered_records), float(distance_sum)]
+                for time_step, (records, covered_records, distance_sum) in sorted(self.per_time_step.items())
+            ]
+        )
+
+    def add(self, time_steps, distances):
+        covered = distances <= self.rsu_radius
+        self.total_records += len(distances)
+        self.covered_records += int(np.count_nonzero(covered))
+        self.distance_sum += float(distances.sum())
+
+        unique_time_steps, inverse = np.unique(time_steps, return_inverse=True)
+        records = np.bincount(inverse, minlength=len(unique_time_steps))
+        covered_records = np.bincount(inverse, weights=covered, minlength=len(unique_time_steps))
+        distance_sums = np.bincount(inverse, weights=distances, minlength=len(unique_time_steps))
+        for time_step, *aggregates in zip(unique_time_steps.tolist(), records, covered_records, distance_sums):
+            totals = self.per_time_step.setdefault(time_step, [0, 0, 0.0])
+            for index, aggregate in enumerate(aggregates):
+                totals[index] += aggregate
+
+    def coverage_and_avg_distance(self):
+        """
+        Returns:
+            float, float: Coverage percentage and average distance over all relevant rows.
+        """
+        if self.total_records == 0:
+            return 0, float("nan")
+        return self.covered_records / self.total_records * 100, self.distance_sum / self.total_records
+
+    def coverage_per_time_step(self):
+        """
+        Returns:
+            list: Coverage percentage per time step, in time order.
+        """
+        return [
+            self.per_time_step[time_step][1] / self.per_time_step[time_step][0] * 100
+            for time_step in sorted(self.per_time_step)
+        ]
+
+    def avg_distance_per_time_step(self):
+        """
+        Returns:
+            list: Average distance per time step, in time order.
+        """
+        return [
+            self.per_time_step[time_step][2] / self.per_time_step[time_step][0]
+            for time_step in sorted(self.per_time_step)
+        ]
+
+
 def run_pipeline(
-    picked_junctions, deployment_csv_path, deployment_parquet_path, rsu_sim_interface, algorithm_name
+    picked_junctions,
+    deployment_csv_path,
+    deployment_parquet_path,
+    rsu_sim_interface,
+    algorithm_name,
+    workspace=None,
+):
+    """
+    Evaluates an RSU deployment with disolv, or natively if configured, going through the result cache.
+
+    Returns:
+        float, float: Coverage percentage and average distance.
+
+    Raises:
+        RuntimeError: If a stage of the disolv pipeline fails. Failed runs are not cached.
+    """
+    evaluator = rsu_sim_interface.config["VanetInterface"]["evaluator"]
+    if evaluator["type"] == "native" and not evaluator["validate"]:
+        return rsu_sim_interface.evaluate_natively_cached(picked_junctions)
+    result_key, cached_result = rsu_sim_interface.lookup_result(picked_junctions)
+    if cached_result is not None:
+        return cached_result
+
+    generate_deployment_file(
+        picked_junctions,
+        deployment_csv_path,
+        deployment_parquet_path,
+        write_csv=rsu_sim_interface.config["VanetInterface"]["write_deployment_csv"],
+    )
+    if not rsu_sim_interface.trigger_rsu_simulator(algorithm_name, workspace=workspace):
+        raise RuntimeError(f"disolv pipeline of {algorithm_name} failed, not evaluating the deployment")
+    tx_data_parquet_path = None if workspace is None else workspace.tx_data_parquet_path
+    summary = rsu_sim_interface.summarize_tx_data(tx_data_parquet_path)
+    coverage, avg_distance = summary.coverage_and_avg_distance()
+    if evaluator["validate"]:
+        report_native_discrepancy(picked_junctions, rsu_sim_interface, algorithm_name, coverage, avg_distance)
+    return rsu_sim_interface.store_result(result_key, (coverage, avg_distance), summary)
+
+
+async def run_pipeline_async(
+    picked_junctions,
+    deployment_csv_path,
+    deployment_parquet_path,
+    rsu_sim_interface,
+    algorithm_name,
+    runner=None,
+    workspace=None,
 ):
-    generate_deployment_file(picked_junctions, deployment_csv_path, deployment_parquet_path)
-    rsu_sim_interface.trigger_rsu_simulator(algorithm_name)
-    return rsu_sim_interface.get_metrics_from_simulator()
+    """
+    Async variant of `run_pipeline`, running the disolv stages with an AsyncStageRunner.
+
+    Args:
+        runner (AsyncStageRunner, optional): Runner shared by all in-flight evaluations, which bounds their
+            concurrency. A new runner from the config is used if None.
+        workspace (EvaluationWorkspace, optional): Private workspace of the evaluation.
+
+    Returns:
+        float, float: Coverage percentage and average distance.
+
+    Raises:
+        RuntimeError: If a stage still fails after all retries.
+    """
+    evaluator = rsu_sim_interface.config["VanetInterface"]["evaluator"]
+    if evaluator["type"] == "native" and not evaluator["validate"]:
+        return rsu_sim_interface.evaluate_natively_cached(picked_junctions)
+    result_key, cached_result = rsu_sim_interface.lookup_result(picked_junctions)
+    if cached_result is not None:
+        return cached_result
+    if runner is None:
+        runner = rsu_sim_interface.make_stage_runner()
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(
+        None,
+        functools.partial(
+            generate_deployment_file,
+            picked_junctions,
+            deployment_csv_path,
+            deployment_parquet_path,
+            write_csv=rsu_sim_interface.config["VanetInterface"]["write_deployment_csv"],
+        ),
+    )
+    await rsu_sim_interface.trigger_rsu_simulator_async(runner, algorithm_name, workspace=workspace)
+    tx_data_parquet_path = None if workspace is None else workspace.tx_data_parquet_path
+    # Aggregating tx_data is CPU bound, keep it off the event loop
+    summary = await loop.run_in_executor(None, rsu_sim_interface.summarize_tx_data, tx_data_parquet_path)
+    coverage, avg_distance = summary.coverage_and_avg_distance()
+    if evaluator["validate"]:
+        report_native_discrepancy(picked_junctions, rsu_sim_interface, algorithm_name, coverage, avg_distance)
+    return rsu_sim_interface.store_result(result_key, (coverage, avg_distance), summary)
+
+
+def report_native_discrepancy(picked_junctions, rsu_sim_interface, algorithm_name, coverage, avg_distance):
+    native_coverage, native_avg_distance = rsu_sim_interface.evaluate_natively(picked_junctions)
+    print(
+        f"Native evaluator vs. disolv ({algorithm_name}): "
+        f"coverage {native_coverage:.2f}% vs. {coverage:.2f}% ({native_coverage - coverage:+.2f}), "
+        f"avg distance {native_avg_distance:.2f} vs. {avg_distance:.2f} "
+        f"({native_avg_distance - avg_distance:+.2f})"
+    )
 
 
 class VanetSimulatorInterface:
@@ -82,67 +465,517 @@ class VanetSimulatorInterface:
         self.rsu_radius = self.config["General"]["rsu_radius"]
         self.num_rsus = self.config["General"]["num_rsus"]
         self.grid_size = self.config["General"]["grid_size"]
+        self.simulator = self.config["VanetInterface"]["simulator"]
         self.tx_data_parquet_path = (
             self.config["General"]["base_path"]
             + self.config["VanetInterface"]["output_path"]
             + self.config["VanetInterface"]["scenario"]
             + "/tx_data.parquet"
         )
+        self.fcd_parquet_path = (
+            self.config["General"]["base_path"]
+            + self.config["VanetInterface"]["input_path"]
+            + self.config["VanetInterface"]["scenario"]
+            + self.config["VanetInterface"]["fcd_parquet"]
+        )
+        self.workspaces = []
+        self.prep_cache = (
+            PrepDisolvCache(self.config) if self.config["VanetInterface"]["prep_cache"]["enabled"] else None
+        )
+        self.link_cache = (
+            LinkCache(self.config) if self.config["VanetInterface"]["link_cache"]["enabled"] else None
+        )
+        # Numbers the stage logs of async evaluations
+        self.evaluation_counter = itertools.count()
+        result_cache_config = self.config["VanetInterface"]["result_cache"]
+        self.result_cache = (
+            DeploymentResultCache(
+                self.config["General"]["base_path"] + result_cache_config["db_path"],
+                result_cache_config["max_entries"],
+            )
+            if result_cache_config["enabled"]
+            else None
+        )
+        self.simulator_version = None
+        self.trace_fingerprint = None
 
-    def parse_relevant_data(self):
+    def parse_relevant_data(self, tx_data_parquet_path=None):
         # Read the Parquet file into a DataFrame
-        # But only relevant Data: where link-sender is a vehicle, and link-receiver is a rsu
-        df = pd.read_parquet(self.tx_data_parquet_path)
+        # But only the relevant columns and Data: where link-sender is a vehicle, and link-receiver is a rsu
+        return scan_relevant_tx_data(tx_data_parquet_path or self.tx_data_parquet_path).to_table().to_pandas()
+
+    def summarize_tx_data(self, tx_data_parquet_path=None):
+        return TxDataSummary.from_parquet(tx_data_parquet_path or self.tx_data_parquet_path, self.rsu_radius)
+
+    def parse_coverage_and_avg_distance(self, rsu_radius=1000, tx_data_parquet_path=None):
+        # Coverage: share of vehicle -> RSU records within the reach of the RSU
+        summary = TxDataSummary.from_parquet(tx_data_parquet_path or self.tx_data_parquet_path, rsu_radius)
+        return summary.coverage_and_avg_distance()
+
+    def get_metrics_from_simulator(self, tx_data_parquet_path=None):
+        return self.parse_coverage_and_avg_distance(
+            rsu_radius=self.rsu_radius, tx_data_parquet_path=tx_data_parquet_path
+        )
+
+    def evaluate_natively(self, rsu_positions):
+        """
+        Evaluates an RSU deployment in-process on the FCD positions instead of running disolv.
+
+        Unlike disolv, vehicles are never relayed through other vehicles, so every vehicle record counts
+        towards its closest RSU. Use VanetInterface.evaluator.validate to report the discrepancy against
+        disolv.
 
-        relevant_data = df[df["agent_id"] < 200000]
-        relevant_data = relevant_data[relevant_data["selected_agent"] >= 200000]
+        Args:
+            rsu_positions (iterable): (x, y) coordinates of the RSUs.
 
-        return relevant_data
+        Returns:
+            float, float: Coverage percentage and average distance.
+        """
+        _, vehicle_positions = load_vehicle_records(self.fcd_parquet_path)
+        return compute_geometric_metrics(rsu_positions, vehicle_positions, self.rsu_radius)
 
-    def parse_coverage_and_avg_distance(self, rsu_radius=1000):
-        relevant_data = self.parse_relevant_data()
+    def evaluate_natively_cached(self, rsu_positions):
+        """
+        Variant of `evaluate_natively` that goes through the result cache, if enabled.
 
-        # Filter rows where the distance is within the reach of the RSU
-        covered = relevant_data[relevant_data["distance"] <= rsu_radius]
+        Args:
+            rsu_positions (list): (x, y) coordinates of the RSUs.
 
-        # Total number of car records (agent_id > 0)
-        total_car_records = len(relevant_data)
+        Returns:
+            float, float: Coverage percentage and average distance.
+        """
+        result_key, cached_result = self.lookup_result(rsu_positions)
+        if cached_result is not None:
+            return cached_result
+        return self.store_result(result_key, self.evaluate_natively(rsu_positions))
 
-        # Number of covered car records
-        covered_car_records = len(covered)
+    def summarize_natively(self, rsu_positions):
+        """
+        Per time step variant of `evaluate_natively`.
 
-        # Calculate the coverage percentage
-        coverage_percentage = (covered_car_records / total_car_records) * 100 if total_car_records > 0 else 0
+        Args:
+            rsu_positions (iterable): (x, y) coordinates of the RSUs.
 
-        average_distance = relevant_data["distance"].mean() if total_car_records > 0 else float("nan")
+        Returns:
+            TxDataSummary: The aggregates.
+        """
+        time_steps, vehicle_positions = load_vehicle_records(self.fcd_parquet_path)
+        return compute_geometric_summary(rsu_positions, time_steps, vehicle_positions, self.rsu_radius)
 
-        return coverage_percentage, average_distance
+    def summarize_deployment(self, rsu_positions):
+        """
+        Aggregates the metrics of an evaluated deployment per time step.
 
-    def get_metrics_from_simulator(self):
-        return self.parse_coverage_and_avg_distance(rsu_radius=self.rsu_radius)
+        The native evaluator recomputes them from the vehicle positions, as it does not write tx_data.parquet.
+        With the result cache enabled they are taken from the cached result, as a cache hit does not write
+        tx_data.parquet either. Otherwise they are read from the tx_data.parquet of the last simulator run.
+
+        Args:
+            rsu_positions (iterable): (x, y) coordinates of the RSUs.
+
+        Returns:
+            TxDataSummary: The aggregates, or None if they are not available.
+        """
+        evaluator = self.config["VanetInterface"]["evaluator"]
+        if evaluator["type"] == "native" and not evaluator["validate"]:
+            return self.summarize_natively(rsu_positions)
+        if self.result_cache is not None:
+            per_time_step = self.result_cache.get_per_time_step(self.result_key(rsu_positions))
+            if per_time_step is None:
+                print("Deployment not in the result cache, skipping the per time step metrics")
+                return None
+            return TxDataSummary.from_json(per_time_step, self.rsu_radius)
+        if not os.path.exists(self.tx_data_parquet_path):
+            print(f"No simulator output at {self.tx_data_parquet_path}, skipping the per time step metrics")
+            return None
+        return self.summarize_tx_data()
+
+    def get_simulator_version(self):
+        """
+        Returns:
+            str: Identifies the evaluator and, for disolv, the simulator and its current build.
+        """
+        if self.simulator_version is None:
+            evaluator_type = self.config["VanetInterface"]["evaluator"]["type"]
+            if evaluator_type == "native":
+                self.simulator_version = evaluator_type
+            else:
+                _, disolv_path, _, _ = self.stage_paths()
+                if self.simulator == "fake":
+                    binaries = [FAKE_DISOLV_PATH]
+                else:
+                    binaries = [
+                        prep_link_file_command(disolv_path, "")[0],
+                        run_rsu_simulator_command(disolv_path, "")[0],
+                    ]
+                fingerprints = [
+                    file_fingerprint(binary) if os.path.exists(binary) else "missing" for binary in binaries
+                ]
+                self.simulator_version = f"{evaluator_type}:{self.simulator}:{','.join(fingerprints)}"
+        return self.simulator_version
+
+    def get_trace_fingerprint(self):
+        """
+        Returns:
+            str: Fingerprint of the vehicle trace the deployments are evaluated on: the FCD Parquet file if it
+            is read directly (native evaluator, fake simulator), otherwise the raw trace prep-disolv converts
+            on every run.
+        """
+        if self.trace_fingerprint is None:
+            if self.config["VanetInterface"]["evaluator"]["type"] == "native" or self.simulator == "fake":
+                self.trace_fingerprint = file_fingerprint(self.fcd_parquet_path)
+            else:
+                self.trace_fingerprint = directory_fingerprint(
+                    self.config["General"]["base_path"]
+                    + self.config["VanetInterface"]["raw_path"]
+                    + self.config["VanetInterface"]["scenario"]
+                )
+        return self.trace_fingerprint
+
+    def result_key(self, rsu_positions):
+        """
+        Returns:
+            str: Key of a deployment in the result cache.
+        """
+        return deployment_cache_key(
+            self.config["VanetInterface"]["scenario"],
+            rsu_positions,
+            self.rsu_radius,
+            self.get_simulator_version(),
+            self.get_trace_fingerprint(),
+            precision=self.config["VanetInterface"]["result_cache"]["coordinate_precision"],
+        )
+
+    def lookup_result(self, rsu_positions):
+        """
+        Looks up a deployment in the result cache, if enabled.
+
+        Args:
+            rsu_positions (list): (x, y) coordinates of the RSUs.
+
+        Returns:
+            str, tuple: Cache key (None if the cache is disabled) and the cached (coverage, avg_distance) or None.
+        """
+        if self.result_cache is None:
+            return None, None
+        result_key = self.result_key(rsu_positions)
+        return result_key, self.result_cache.get(result_key)
+
+    def store_result(self, result_key, metrics, summary=None):
+        """
+        Stores the metrics of a deployment in the result cache, if enabled.
+
+        Args:
+            result_key (str): Key from `lookup_result`.
+            metrics (tuple): (coverage, avg_distance).
+            summary (TxDataSummary, optional): Per time step aggregates of the deployment.
+
+        Returns:
+            tuple: The metrics.
+        """
+        if result_key is not None:
+            self.result_cache.put(
+                result_key, *metrics, per_time_step=None if summary is None else summary.to_json()
+            )
+        return metrics
+
+    def get_workspaces(self, count):
+        """
+        Returns `count` evaluation workspaces, materializing the ones not created by earlier calls.
+
+        Args:
+            count (int): Number of workspaces.
+
+        Returns:
+            list: EvaluationWorkspace instances.
+        """
+        workspaces_path = (
+            self.config["General"]["base_path"]
+            + self.config["VanetInterface"]["workspaces"]["path"]
+            + self.config["VanetInterface"]["scenario"]
+        )
+        while len(self.workspaces) < count:
+            workspace = EvaluationWorkspace(f"{workspaces_path}/worker_{len(self.workspaces)}", self.config)
+            workspace.materialize()
+            self.workspaces.append(workspace)
+        return self.workspaces[:count]
+
+    def evaluate_many(self, deployments, workers=None, algorithm_name="batch"):
+        """
+        Evaluates several RSU deployments, running up to `workers` disolv pipelines at the same time.
+
+        Every running pipeline gets a private workspace (input, output and configs directories), so the
+        evaluations never share a deployment file or tx_data.parquet. The workspaces are kept and reused by
+        later calls.
+
+        Args:
+            deployments (iterable): One iterable of (x, y) RSU coordinates per deployment.
+            workers (int, optional): Maximum number of concurrent pipelines. Defaults to
+                VanetInterface.workspaces.workers.
+            algorithm_name (str): Name recorded in the execution time CSV.
+
+        Returns:
+            list: (coverage, avg_distance) per deployment, in input order.
+        """
+        deployments = [list(deployment) for deployment in deployments]
+        evaluator = self.config["VanetInterface"]["evaluator"]
+        if evaluator["type"] == "native" and not evaluator["validate"]:
+            return [self.evaluate_natively_cached(deployment) for deployment in deployments]
+        if not deployments:
+            return []
+
+        if workers is None:
+            workers = self.config["VanetInterface"]["workspaces"]["workers"]
+        workers = max(1, min(workers, len(deployments)))
+        free_workspaces = queue.Queue()
+        for workspace in self.get_workspaces(workers):
+            free_workspaces.put(workspace)
+
+        def evaluate(deployment):
+            workspace = free_workspaces.get()
+            try:
+                return run_pipeline(
+                    deployment,
+                    workspace.deployment_csv_path,
+                    workspace.deployment_parquet_path,
+                    self,
+                    algorithm_name,
+                    workspace=workspace,
+                )
+            finally:
+                free_workspaces.put(workspace)
+
+        # The pipelines run in subprocesses, so threads are enough to keep them busy
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(evaluate, deployments))
+
+    def make_stage_runner(self):
+        """
+        Creates an AsyncStageRunner from VanetInterface.async_runner. Has to be called inside the event loop
+        that runs the stages.
+
+        Returns:
+            AsyncStageRunner: The runner.
+        """
+        runner_config = self.config["VanetInterface"]["async_runner"]
+        return AsyncStageRunner(
+            log_path=self.config["General"]["base_path"]
+            + runner_config["log_path"]
+            + self.config["VanetInterface"]["scenario"],
+            max_concurrent_stages=runner_config["max_concurrent_stages"],
+            retries=runner_config["retries"],
+            retry_delay=runner_config["retry_delay"],
+        )
+
+    async def evaluate_many_async(self, deployments, workers=None, algorithm_name="batch"):
+        """
+        Async variant of `evaluate_many`: all deployments are in flight at once, while the shared
+        AsyncStageRunner bounds the number of running stage processes.
+
+        Args:
+            deployments (iterable): One iterable of (x, y) RSU coordinates per deployment.
+            workers (int, optional): Number of workspaces. Defaults to VanetInterface.workspaces.workers.
+            algorithm_name (str): Prefix of the stage logs.
+
+        Returns:
+            list: (coverage, avg_distance) per deployment, in input order.
+        """
+        deployments = [list(deployment) for deployment in deployments]
+        evaluator = self.config["VanetInterface"]["evaluator"]
+        if evaluator["type"] == "native" and not evaluator["validate"]:
+            return [self.evaluate_natively_cached(deployment) for deployment in deployments]
+        if not deployments:
+            return []
+
+        if workers is None:
+            workers = self.config["VanetInterface"]["workspaces"]["workers"]
+        runner = self.make_stage_runner()
+        free_workspaces = asyncio.Queue()
+        for workspace in self.get_workspaces(max(1, min(workers, len(deployments)))):
+            free_workspaces.put_nowait(workspace)
+
+        async def evaluate(deployment):
+            workspace = await free_workspaces.get()
+            try:
+                return await run_pipeline_async(
+                    deployment,
+                    workspace.deployment_csv_path,
+                    workspace.deployment_parquet_path,
+                    self,
+                    algorithm_name,
+                    runner=runner,
+                    workspace=workspace,
+                )
+            finally:
+                free_workspaces.put_nowait(workspace)
+
+        tasks = [asyncio.ensure_future(evaluate(deployment)) for deployment in deployments]
+        try:
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            # Do not leave the other evaluations running in the background
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    def prepare_positions(self, prep_disolv_path, configs_path, input_path):
+        """
+        Runs prep-disolv, reusing the cached vehicle outputs if prep_cache is enabled and warm.
+
+        Args:
+            prep_disolv_path (str): Path to prep-disolv.
+            configs_path (str): Directory of the stage configs.
+            input_path (str): Input directory prep-disolv writes to.
+
+        Returns:
+            bool: Whether prep-disolv succeeded.
+        """
+        config_file = self.start_position_preparation(input_path, configs_path)
+        positions_succeeded = True
+        if config_file is not None:
+            positions_succeeded = prep_position_files(prep_disolv_path, configs_path, config_file=config_file)
+        self.finish_position_preparation(input_path, configs_path, config_file, positions_succeeded)
+        return positions_succeeded
+
+    def start_position_preparation(self, input_path, configs_path):
+        """
+        Restores the cached vehicle outputs if prep_cache is enabled and warm.
+
+        Returns:
+            str: Config file prep-disolv has to run with, or None if it does not run: the fake simulator reads
+            the existing vehicle positions directly.
+        """
+        if self.simulator == "fake":
+            return None
+        if self.prep_cache is not None and not self.prep_cache.has_rsu_config(configs_path):
+            print(f"{self.prep_cache.rsu_config_file} not found in {configs_path}, not using the prep cache")
+        elif self.prep_cache is not None and self.prep_cache.is_warm():
+            self.prep_cache.restore(input_path)
+            return self.prep_cache.rsu_config_file
+        # Never let prep-disolv write into vehicle files linked from the prep cache or the shared input directory
+        vanet_config = self.config["VanetInterface"]
+        for output in {vanet_config["fcd_parquet"], *vanet_config["prep_cache"]["vehicle_outputs"]}:
+            unlink_shared_file(input_path + output)
+        if self.prep_cache is not None:
+            self.prep_cache.restored_input_paths.discard(input_path)
+        return "positions.toml"
+
+    def finish_position_preparation(self, input_path, configs_path, config_file, positions_succeeded=True):
+        """
+        Caches the vehicle outputs after a successful full prep-disolv run if prep_cache is enabled.
+        """
+        if (
+            self.prep_cache is None
+            or config_file in (None, self.prep_cache.rsu_config_file)
+            or not self.prep_cache.has_rsu_config(configs_path)
+        ):
+            return
+        if not positions_succeeded:
+            print("prep-disolv failed, not caching its vehicle outputs")
+            return
+        self.prep_cache.store(input_path)
+
+    def prepare_links(self, disolv_path, configs_path, input_path):
+        """
+        Prepares the link file, running disolv-links only for RSU positions without cached links if
+        link_cache is enabled.
+
+        disolv-links is run on a deployment of just the new positions; the full deployment is restored
+        afterwards and its link file is assembled from the cached slices.
+
+        Args:
+            disolv_path (str): Path to disolv.
+            configs_path (str): Directory of the stage configs.
+            input_path (str): Input directory holding the deployment and link files.
+
+        Returns:
+            bool: Whether the link file has been prepared.
+        """
+        run_links, link_state = self.start_link_preparation(input_path)
+        links_succeeded = prep_link_file(disolv_path, configs_path, self.simulator) if run_links else True
+        return self.finish_link_preparation(input_path, run_links, link_state, links_succeeded)
+
+    def start_link_preparation(self, input_path):
+        """
+        Writes the deployment of the positions without cached links if link_cache is enabled.
+
+        Returns:
+            bool, tuple: Whether disolv-links has to run, and the state for `finish_link_preparation`.
+        """
+        if self.link_cache is None:
+            return True, None
+        deployment_parquet_path = input_path + self.config["VanetInterface"]["deployment_parquet_path"]
+        deployment = pq.read_table(deployment_parquet_path)
+        positions = list(zip(deployment["x"].to_pylist(), deployment["y"].to_pylist()))
+        missing_positions = self.link_cache.missing_positions(positions)
+        run_links = bool(missing_positions) or not self.link_cache.has_vehicle_links()
+        if run_links:
+            pq.write_table(build_deployment_table(missing_positions), deployment_parquet_path)
+            # Never mistake the link file of an earlier deployment for the output of this run
+            link_file_path = input_path + self.link_cache.link_file
+            if os.path.exists(link_file_path):
+                os.remove(link_file_path)
+        return run_links, (deployment, positions, missing_positions)
+
+    def finish_link_preparation(self, input_path, run_links, link_state, links_succeeded=True):
+        """
+        Restores the full deployment, caches the new links and assembles the link file if link_cache is
+        enabled. The links of a failed disolv-links run are neither cached nor assembled, so no link file is
+        left for disolv-v2x.
+
+        Returns:
+            bool: Whether the link file has been prepared.
+        """
+        if link_state is None:
+            return links_succeeded
+        deployment, positions, missing_positions = link_state
+        link_file_path = input_path + self.link_cache.link_file
+        if run_links:
+            pq.write_table(deployment, input_path + self.config["VanetInterface"]["deployment_parquet_path"])
+            if not links_succeeded or not os.path.exists(link_file_path):
+                print("disolv-links failed, not caching its links")
+                return False
+            self.link_cache.store(pq.read_table(link_file_path), missing_positions)
+        self.link_cache.assemble(positions, link_file_path)
+        return True
 
     def trigger_with_time_tracking(
-        self, prep_disolv_path, disolv_path, configs_path, csv_file_path, algorithm_name
+        self, prep_disolv_path, disolv_path, configs_path, csv_file_path, algorithm_name, input_path=None
     ):
         # 1 - prep-disolv (prepare positions file)
         start_segment_time_pipe = time.perf_counter()
-        prep_position_files(prep_disolv_path, configs_path)
+        if not self.prepare_positions(prep_disolv_path, configs_path, input_path):
+            return False
         end_segment_time_pipe = time.perf_counter()
         prep_disolv_time = end_segment_time_pipe - start_segment_time_pipe
 
         # 2 - disolv (prepare link file)
         start_segment_time_pipe = time.perf_counter()
-        prep_link_file(disolv_path, configs_path)
+        if not self.prepare_links(disolv_path, configs_path, input_path):
+            return False
         end_segment_time_pipe = time.perf_counter()
         prep_link_time = end_segment_time_pipe - start_segment_time_pipe
 
         # 3 - run disolv
         start_segment_time_pipe = time.perf_counter()
-        run_rsu_simulator(disolv_path, configs_path)
+        if not run_rsu_simulator(disolv_path, configs_path, self.simulator):
+            return False
         end_segment_time_pipe = time.perf_counter()
         run_disolv_time = end_segment_time_pipe - start_segment_time_pipe
 
-        with open(csv_file_path, "a", newline="") as csvfile:
+        self.record_execution_times(
+            csv_file_path, prep_disolv_time, prep_link_time, run_disolv_time, algorithm_name
+        )
+        return True
+
+    def record_execution_times(
+        self, csv_file_path, prep_disolv_time, prep_link_time, run_disolv_time, algorithm_name
+    ):
+        """
+        Appends the execution times of the pipeline stages of one evaluation to the execution time CSV.
+        """
+        with exec_time_lock, open(csv_file_path, "a", newline="") as csvfile:
             csv_writer = csv.writer(csvfile)
 
             # Write the header if the file is empty
@@ -170,31 +1003,118 @@ class VanetSimulatorInterface:
                 ]
             )
 
-    def trigger(self, prep_disolv_path, disolv_path, configs_path):
+    def trigger(self, prep_disolv_path, disolv_path, configs_path, input_path=None):
         # 1 - prep-disolv (prepare positions file)
-        prep_position_files(prep_disolv_path, configs_path)
+        if not self.prepare_positions(prep_disolv_path, configs_path, input_path):
+            return False
         # 2 - disolv (prepare link file)
-        prep_link_file(disolv_path, configs_path)
+        if not self.prepare_links(disolv_path, configs_path, input_path):
+            return False
         # 3 - run disolv
-        run_rsu_simulator(disolv_path, configs_path)
+        return run_rsu_simulator(disolv_path, configs_path, self.simulator)
 
-    def trigger_rsu_simulator(self, algorithm_name):
+    def stage_paths(self, workspace=None):
+        """
+        Returns:
+            str, str, str, str: prep-disolv, disolv, stage configs and input paths of the (workspace) pipeline.
+        """
         base_path = self.config["General"]["base_path"]
         prep_disolv_path = base_path + self.config["VanetInterface"]["prep_disolv_path"]
         disolv_path = base_path + self.config["VanetInterface"]["disolv_path"]
-        configs_path = (
-            base_path + self.config["VanetInterface"]["configs_path"] + self.config["VanetInterface"]["scenario"]
-        )
-        csv_file_path_run_exec_time = "ExecTime/Pipeline/pipeline_exec_time.csv"
+        if workspace is None:
+            scenario = self.config["VanetInterface"]["scenario"]
+            configs_path = base_path + self.config["VanetInterface"]["configs_path"] + scenario
+            input_path = base_path + self.config["VanetInterface"]["input_path"] + scenario
+        else:
+            configs_path = workspace.configs_path
+            input_path = workspace.paths["input"]
+        return prep_disolv_path, disolv_path, configs_path, input_path
+
+    async def trigger_rsu_simulator_async(self, runner, algorithm_name, workspace=None):
+        """
+        Async variant of `trigger_rsu_simulator`. The stage logs are named after the algorithm, a running
+        evaluation number and the stage.
+
+        Raises:
+            RuntimeError: If a stage still fails after all retries.
+        """
+        prep_disolv_path, disolv_path, configs_path, input_path = self.stage_paths(workspace)
+        timeouts = self.config["VanetInterface"]["async_runner"]["timeouts"]
+        log_prefix = f"{algorithm_name}_{next(self.evaluation_counter)}"
+
+        async def run_stage(stage, command):
+            if not await runner.run(command, f"{log_prefix}_{stage}.log", timeout=timeouts[stage]):
+                raise RuntimeError(f"Stage {stage} of {log_prefix} failed, see {runner.log_path}")
+
+        # The cache preparation copies and assembles large files, keep it off the event loop
+        loop = asyncio.get_running_loop()
+
+        # 1 - prep-disolv (prepare positions file)
+        start_segment_time_pipe = time.perf_counter()
+        config_file = await loop.run_in_executor(None, self.start_position_preparation, input_path, configs_path)
+        if config_file is not None:
+            await run_stage("positions", prep_position_files_command(prep_disolv_path, configs_path, config_file))
+        await loop.run_in_executor(None, self.finish_position_preparation, input_path, configs_path, config_file)
+        prep_disolv_time = time.perf_counter() - start_segment_time_pipe
+
+        # 2 - disolv (prepare link file)
+        start_segment_time_pipe = time.perf_counter()
+        run_links, link_state = await loop.run_in_executor(None, self.start_link_preparation, input_path)
+        if run_links:
+            await run_stage("links", prep_link_file_command(disolv_path, configs_path, self.simulator))
+        if not await loop.run_in_executor(None, self.finish_link_preparation, input_path, run_links, link_state):
+            raise RuntimeError(f"Stage links of {log_prefix} did not write a link file, see {runner.log_path}")
+        prep_link_time = time.perf_counter() - start_segment_time_pipe
+
+        # 3 - run disolv
+        start_segment_time_pipe = time.perf_counter()
+        await loop.run_in_executor(None, self.remove_tx_data, workspace)
+        await run_stage("simulation", run_rsu_simulator_command(disolv_path, configs_path, self.simulator))
+        run_disolv_time = time.perf_counter() - start_segment_time_pipe
+
+        if self.config["VanetInterface"]["track_execution_time"]:
+            await loop.run_in_executor(
+                None,
+                self.record_execution_times,
+                PIPELINE_EXEC_TIME_CSV,
+                prep_disolv_time,
+                prep_link_time,
+                run_disolv_time,
+                algorithm_name,
+            )
+
+    def remove_tx_data(self, workspace=None):
+        """
+        Removes the tx_data.parquet of an earlier run, so it is never mistaken for the output of the next one.
+        """
+        tx_data_parquet_path = self.tx_data_parquet_path if workspace is None else workspace.tx_data_parquet_path
+        if os.path.exists(tx_data_parquet_path):
+            os.remove(tx_data_parquet_path)
+
+    def trigger_rsu_simulator(self, algorithm_name, workspace=None):
+        """
+        Runs the disolv pipeline on the current deployment file of the (workspace) input directory.
+
+        Returns:
+            bool: Whether all stages succeeded. If not, no tx_data.parquet is left behind.
+        """
+        prep_disolv_path, disolv_path, configs_path, input_path = self.stage_paths(workspace)
+        self.remove_tx_data(workspace)
 
         track_execution_time = bool(self.config["VanetInterface"]["track_execution_time"])
         if track_execution_time:
-            self.trigger_with_time_tracking(
+            return self.trigger_with_time_tracking(
                 prep_disolv_path=prep_disolv_path,
                 disolv_path=disolv_path,
                 configs_path=configs_path,
-                csv_file_path=csv_file_path_run_exec_time,
+                csv_file_path=PIPELINE_EXEC_TIME_CSV,
                 algorithm_name=algorithm_name,
+                input_path=input_path,
             )
         else:
-            self.trigger(prep_disolv_path=prep_disolv_path, disolv_path=disolv_path, configs_path=configs_path)
+            return self.trigger(
+                prep_disolv_path=prep_disolv_path,
+                disolv_path=disolv_path,
+                configs_path=configs_path,
+                input_path=input_path,
+            )
@@ -16,7 +16,65 @@ from rsudeploysimcomp.Utils.utils import get_hyperparameter, load_config, update
 # TODO: ExecTime of Pipeline
 
 
-def main():
+# SUMOParser products each algorithm works on, so the ingestion builds only what the enabled algorithms need
+ALGORITHM_PRODUCTS = {
+    "AllJunctions": ("junctions",),
+    "BranchAndBound": ("junctions",),
+    "DensityBased": ("junctions", "vehicle_cells"),
+    "GARSUD": ("junctions",),
+    "PMCP_B": ("junctions", "vehicle_cells", "transition_counts"),
+}
+
+
+# Largest base resolution (cells per axis) the sweep ingests the scenario at
+MAX_BASE_GRID_SIZE = 2000
+
+
+def plan_base_grid_sizes(grid_size_list, base_grid_size=None):
+    """
+    Groups the swept grid sizes by the resolution the scenario is ingested at.
+
+    Grid sizes that divide the base resolution are derived from one parse at it by block aggregation, all
+    others are parsed directly. The base resolution defaults to the largest grid size. An explicit
+    base_grid_size beyond MAX_BASE_GRID_SIZE is ignored, as the cell count grows quadratically with it.
+
+    Args:
+        grid_size_list (list): Grid sizes of the sweep.
+        base_grid_size (int, optional): SUMOInterface.base_grid_size.
+
+    Returns:
+        dict: Ingested grid size -> grid sizes derived from it, in sweep order.
+    """
+    if base_grid_size is not None and base_grid_size > MAX_BASE_GRID_SIZE:
+        print(f"base_grid_size {base_grid_size} exceeds {MAX_BASE_GRID_SIZE}, using the largest grid size")
+        base_grid_size = None
+    if base_grid_size is None:
+        base_grid_size = max(grid_size_list)
+
+    groups = {}
+    for grid_size in grid_size_list:
+        groups.setdefault(base_grid_size if base_grid_size % grid_size == 0 else grid_size, []).append(grid_size)
+    return groups
+
+
+def required_products(config):
+    """
+    Collects the SUMOParser products needed by the enabled algorithms.
+
+    Args:
+        config (dict): Loaded app config.
+
+    Returns:
+        list: Keys of sumoparser.PRODUCT_ATTRIBUTES.
+    """
+    products = set()
+    for algorithm, algorithm_products in ALGORITHM_PRODUCTS.items():
+        if config["Algorithms"][algorithm]["run"]:
+            products.update(algorithm_products)
+    return sorted(products)
+
+
+def main(sumoparser=None):
     config = load_config()
 
     num_rsus = config["General"]["num_rsus"]
@@ -53,7 +111,8 @@ def main():
 
     print("Configuration: num_rsus={} | grid_size={} | rsu_radius={}\n".format(num_rsus, grid_size, rsu_radius))
 
-    sumoparser = SUMOParser()
+    if sumoparser is None:
+        sumoparser = SUMOParser(products=required_products(config))
     sumoparser.check_grid_size_radius_relation()
 
     plotter = Plotter()
@@ -148,12 +207,23 @@ if __name__ == "__main__":
         print(f"  Number of RSUs: {num_rsus_list}")
         print("-" * 40)
 
-        for grid_size_counter in grid_size_list:
-            for rsu_radius_counter in rsu_radius_list:
-                for num_rsus_counter in num_rsus_list:
-                    update_config(num_rsus_counter, rsu_radius_counter, grid_size_counter)
-                    main()
-                    pass
+        # Ingest the scenario once per base resolution and derive the coarser grids that divide it by block
+        # aggregation
+        for base_grid_size, grid_sizes in plan_base_grid_sizes(
+            grid_size_list, conf["SUMOInterface"]["base_grid_size"]
+        ).items():
+            print(f"Ingesting the scenario at base grid_size {base_grid_size} for grid sizes {grid_sizes}")
+            base_sumoparser = SUMOParser(grid_size=base_grid_size, products=required_products(conf))
+
+            for grid_size_counter in grid_sizes:
+                # Shared by all combinations of the grid size, so derived products are only computed once
+                grid_sumoparser = base_sumoparser.for_grid_size(grid_size_counter)
+                for rsu_radius_counter in rsu_radius_list:
+                    for num_rsus_counter in num_rsus_list:
+                        update_config(num_rsus_counter, rsu_radius_counter, grid_size_counter)
+                        grid_sumoparser.reload_config()
+                        main(sumoparser=grid_sumoparser)
+                        pass
 
         update_config(num_rsus_list, rsu_radius_list, grid_size_list)
 
@@ -0,0 +1,137 @@
+import copy
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import rsudeploysimcomp.SUMOInterface.sumoparser as sumoparser
+
+# Extent of the generated network and offset between net and UTM coordinates
+WIDTH, HEIGHT = 500.0, 400.0
+NET_OFFSET = (-355000.0, -5640000.0)
+
+NUM_TIMESTEPS = 60
+# Timestep at which the trace is split into the main FCD and an appended segment
+SEGMENT_START = 25
+
+BASE_GRID_SIZE = 20
+
+
+def write_net(path, rng):
+    with open(path, "w") as file:
+        file.write('<?xml version="1.0"?>\n<net version="1.9">\n')
+        file.write(
+            f'  <location netOffset="{NET_OFFSET[0]:.2f},{NET_OFFSET[1]:.2f}" '
+            f'convBoundary="0.00,0.00,{WIDTH:.2f},{HEIGHT:.2f}" origBoundary="0,0,1,1"/>\n'
+        )
+        for index in range(80):
+            junction_type = rng.choice(["priority", "traffic_light", "internal", "dead_end"])
+            file.write(
+                f'  <junction id="j{index}" type="{junction_type}" x="{rng.uniform(0, WIDTH):.2f}" '
+                f'y="{rng.uniform(0, HEIGHT):.2f}" incLanes="" intLanes="" shape="0,0"/>\n'
+            )
+        file.write("</net>\n")
+
+
+def generate_trace(rng):
+    """
+    Returns:
+        list: (time, [(vehicle id, x, y), ...]) per timestep of random walks, with vehicles entering and
+        leaving the trace over time.
+    """
+    positions = {}
+    trace = []
+    for time_step in range(NUM_TIMESTEPS):
+        records = []
+        for vehicle in range(time_step // 3, min(time_step // 3 + 25, 40)):
+            x, y = positions.get(vehicle, (rng.uniform(0, WIDTH), rng.uniform(0, HEIGHT)))
+            x = float(np.clip(x + rng.uniform(-30, 35), 0, WIDTH - 0.01))
+            y = float(np.clip(y + rng.uniform(-25, 30), 0, HEIGHT - 0.01))
+            positions[vehicle] = (x, y)
+            records.append((vehicle, round(x, 2), round(y, 2)))
+        trace.append((float(time_step), records))
+    return trace
+
+
+def write_fcd_xml(path, timesteps):
+    with open(path, "w") as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n<fcd-export>\n')
+        for time, records in timesteps:
+            file.write(f'    <timestep time="{time:.2f}">\n')
+            for vehicle, x, y in records:
+                file.write(f'        <vehicle id="veh{vehicle}" x="{x:.2f}" y="{y:.2f}" speed="1.0"/>\n')
+            file.write("    </timestep>\n")
+        file.write("</fcd-export>\n")
+
+
+def write_fcd_parquet(path, timesteps):
+    """Writes the trace like prep-disolv does: time in ms, numeric agent ids and UTM coordinates."""
+    rows = [(time, vehicle, x, y) for time, records in timesteps for vehicle, x, y in records]
+    times, vehicles, xs, ys = (list(column) for column in zip(*rows))
+    table = pa.table(
+        {
+            "time_step": pa.array([int(round(time * 1000)) for time in times], pa.uint64()),
+            "agent_id": pa.array(vehicles, pa.uint64()),
+            "x": np.array(xs) - NET_OFFSET[0],
+            "y": np.array(ys) - NET_OFFSET[1],
+        }
+    )
+    # Small row groups, so that timesteps span record batches
+    pq.write_table(table, path, row_group_size=97)
+
+
+@pytest.fixture(scope="session")
+def trace():
+    return generate_trace(np.random.default_rng(1))
+
+
+@pytest.fixture(scope="session")
+def scenario(tmp_path_factory, trace):
+    """Writes a small network and trace: the full FCD (XML and Parquet) and its two segments."""
+    path = tmp_path_factory.mktemp("scenario")
+    write_net(str(path / "koln.net.xml"), np.random.default_rng(0))
+    write_fcd_xml(str(path / "koln_fcd.xml"), trace)
+    write_fcd_parquet(str(path / "koln_fcd.parquet"), trace)
+    write_fcd_xml(str(path / "segment_1.xml"), trace[:SEGMENT_START])
+    write_fcd_xml(str(path / "segment_2.xml"), trace[SEGMENT_START:])
+    return path
+
+
+@pytest.fixture
+def make_parser(scenario, monkeypatch):
+    """
+    Returns a factory of SUMOParsers on the generated scenario, with the scenario cache disabled and the
+    given SUMOInterface settings.
+    """
+    app_config = sumoparser.load_config()
+
+    def factory(
+        grid_size=BASE_GRID_SIZE,
+        fcd_file="koln_fcd.xml",
+        fcd_format="xml",
+        workers=1,
+        products=None,
+        migration_matrix_format="csr",
+        fcd_segments=(),
+    ):
+        config = copy.deepcopy(app_config)
+        config["General"]["base_path"] = str(scenario)
+        config["General"]["grid_size"] = grid_size
+        config["General"]["rsu_radius"] = 75
+        sumo_config = config["SUMOInterface"]
+        sumo_config["cache"]["enabled"] = False
+        sumo_config["fcd_segments"] = list(fcd_segments)
+        sumo_config["fcd_source"]["format"] = fcd_format
+        sumo_config["migration_matrix"]["format"] = migration_matrix_format
+        sumo_config["time_resolved"] = {"enabled": True, "bucket_size": 10}
+        sumo_config["xml_parser"]["workers"] = workers
+        sumo_config["xml_parser"]["skip_internal_junctions"] = False
+
+        monkeypatch.setattr(sumoparser, "load_config", lambda: copy.deepcopy(config))
+        monkeypatch.setattr(sumoparser, "path_to_net_xml_gx", str(scenario / "koln.net.xml"))
+        monkeypatch.setattr(sumoparser, "path_to_fcd_xml", str(scenario / fcd_file))
+        monkeypatch.setattr(sumoparser, "path_to_fcd_parquet", str(scenario / "koln_fcd.parquet"))
+        return sumoparser.SUMOParser(grid_size=grid_size, products=products)
+
+    return factory
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+from scipy.sparse import random as sparse_random
+
+from rsudeploysimcomp.SUMOInterface.migration_matrix import StencilMigrationMatrix
+from rsudeploysimcomp.SUMOInterface.sumoparser import normalize_migration_matrix
+
+
+@pytest.mark.parametrize("grid_size", [20, 10])
+def test_stencil_lookups_match_the_dense_matrix(make_parser, grid_size):
+    dense = make_parser(grid_size=grid_size).P.toarray()
+    parser = make_parser(grid_size=grid_size, migration_matrix_format="stencil")
+    assert isinstance(parser.P, StencilMigrationMatrix)
+    assert np.allclose(parser.P.toarray(), dense)
+
+    num_cells = grid_size * grid_size
+    rng = np.random.default_rng(0)
+    for _ in range(2000):
+        from_cell, to_cell = (int(cell) for cell in rng.integers(0, num_cells, 2))
+        if rng.random() < 0.5:
+            # Half of the lookups are moves to neighbouring cells, which are read from the stencil
+            move = int(
+                rng.choice([-grid_size - 1, -grid_size, -grid_size + 1, -1, 0, 1, grid_size - 1, grid_size])
+            )
+            to_cell = min(num_cells - 1, max(0, from_cell + move))
+        assert parser.P[from_cell, to_cell] == pytest.approx(dense[from_cell, to_cell], abs=1e-12)
+
+
+def test_long_jumps_are_kept_in_the_overflow():
+    grid_size = 15
+    num_cells = grid_size * grid_size
+    transition_counts = sparse_random(num_cells, num_cells, density=0.05, random_state=1, format="csr") * 10
+    stencil = StencilMigrationMatrix.from_transition_counts(transition_counts, grid_size)
+    dense = normalize_migration_matrix(transition_counts).toarray()
+    assert stencil.overflow.nnz > 0
+    assert np.allclose(stencil.toarray(), dense)
+    for from_cell, to_cell in zip(*transition_counts.nonzero()):
+        assert stencil[from_cell, to_cell] == pytest.approx(dense[from_cell, to_cell])
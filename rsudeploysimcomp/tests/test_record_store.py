@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pytest
+
+import rsudeploysimcomp.SUMOInterface.record_store as record_store
+
+
+@pytest.mark.parametrize("sort_block_size", [1 << 20, 100])
+def test_records_are_sorted_by_cell(make_parser, trace, tmp_path, monkeypatch, sort_block_size):
+    monkeypatch.setattr(record_store, "RECORD_SORT_BLOCK_SIZE", sort_block_size)
+    parser = make_parser(products=["vehicle_cells"])
+    store = parser.build_record_store(str(tmp_path / "store"))
+
+    # Brute force: the records of every cell, in trace order
+    records_per_cell = {}
+    for time, records in trace:
+        for vehicle, x, y in records:
+            records_per_cell.setdefault(parser.get_grid_cell(x, y), []).append((time, f"veh{vehicle}", x, y))
+
+    grid_size = parser.grid_size
+    assert store.num_records == sum(len(records) for _, records in trace)
+    assert list(store.vehicle_ids) == list(parser.vehicle_ids)
+    expected_counts = np.zeros((grid_size, grid_size), dtype=int)
+    for cell, records in records_per_cell.items():
+        expected_counts[cell] = len(records)
+    assert np.array_equal(store.count_records_per_cell(), expected_counts)
+    for x_index in range(grid_size):
+        for y_index in range(grid_size):
+            stored = [
+                (record["time"], store.vehicle_ids[record["vehicle"]], record["x"], record["y"])
+                for record in store.records_in_cell((x_index, y_index))
+            ]
+            assert stored == records_per_cell.get((x_index, y_index), [])
+
+    rows = store.records_in_neighborhood((0, 5), radius=2)
+    assert len(rows) == 3
+    assert sum(len(row) for row in rows) == expected_counts[0:3, 3:8].sum()
+
+
+def test_rewrite_replaces_the_records(make_parser, tmp_path):
+    store_path = str(tmp_path / "store")
+    parser = make_parser(products=["vehicle_cells"])
+    first = parser.build_record_store(store_path)
+    first_version = record_store.read_current_version(store_path)
+    second = parser.for_grid_size(10).build_record_store(store_path)
+
+    assert second.grid_size == 10 and second.num_records == first.num_records
+    assert record_store.CellRecordStore(store_path).grid_size == 10
+    assert sorted(os.listdir(store_path)) == sorted(
+        [record_store.CURRENT_VERSION_FILE, record_store.read_current_version(store_path)]
+    )
+    assert first_version != record_store.read_current_version(store_path)
+
+
+def test_failed_write_keeps_the_store(make_parser, tmp_path):
+    store_path = str(tmp_path / "store")
+    parser = make_parser(products=["vehicle_cells"])
+    parser.build_record_store(store_path)
+    version = record_store.read_current_version(store_path)
+
+    def failing_batches():
+        yield 0.0, np.zeros(1, dtype=np.int64), np.zeros(1), np.zeros(1), np.zeros(1, dtype=np.int64)
+        raise OSError("disk full")
+
+    with pytest.raises(OSError):
+        record_store.write_record_store(store_path, failing_batches(), parser.grid_size * parser.grid_size)
+    assert sorted(os.listdir(store_path)) == sorted([record_store.CURRENT_VERSION_FILE, version])
+    assert record_store.CellRecordStore(store_path).num_records > 0
@@ -0,0 +1,276 @@
+import gzip
+import shutil
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import rsudeploysimcomp.SUMOInterface.sumoparser as sumoparser
+from rsudeploysimcomp.tests.conftest import BASE_GRID_SIZE, HEIGHT, NET_OFFSET, NUM_TIMESTEPS, WIDTH
+
+
+def baseline_ingestion(trace, grid_size):
+    """
+    Reference implementation of the original record by record ingestion.
+
+    Returns:
+        numpy.ndarray, numpy.ndarray, dict, dict: M, dense P, the cells visited per vehicle and the vehicles
+        per visited cell.
+    """
+    num_cells = grid_size * grid_size
+    x_step, y_step = WIDTH / grid_size, HEIGHT / grid_size
+    transitions = np.zeros((num_cells, num_cells))
+    vehicle_paths = {}
+    location_vehicles = {}
+    last_cells = {}
+    for _, records in trace:
+        for vehicle, x, y in records:
+            vehicle_id = f"veh{vehicle}"
+            cell = (
+                max(0, min(int(x / x_step), grid_size - 1)),
+                max(0, min(int(y / y_step), grid_size - 1)),
+            )
+            vehicle_paths.setdefault(vehicle_id, set()).add(cell)
+            location_vehicles.setdefault(cell, set()).add(vehicle_id)
+            previous_cell = last_cells.get(vehicle_id)
+            if previous_cell is not None and previous_cell != cell:
+                transitions[previous_cell[0] * grid_size + previous_cell[1], cell[0] * grid_size + cell[1]] += 1
+            last_cells[vehicle_id] = cell
+
+    M = np.zeros((grid_size, grid_size), dtype=int)
+    for cell, vehicles in location_vehicles.items():
+        M[cell] = len(vehicles)
+    row_sums = transitions.sum(axis=1, keepdims=True)
+    P = np.divide(transitions, row_sums, out=np.zeros_like(transitions), where=row_sums > 0)
+    return M, P, vehicle_paths, location_vehicles
+
+
+def assert_same_products(parser, expected):
+    """Asserts that two parsers hold the same grid products, independent of how the vehicles are named."""
+    assert parser.grid_size == expected.grid_size
+    assert parser.num_vehicles == expected.num_vehicles
+    assert np.array_equal(np.asarray(parser.M), np.asarray(expected.M))
+    assert np.allclose(parser.P.toarray(), expected.P.toarray())
+    assert (parser.vehicle_cells != expected.vehicle_cells).nnz == 0
+    assert np.allclose(parser.transition_counts.toarray(), expected.transition_counts.toarray())
+    assert np.array_equal(parser.vehicle_last_cells, expected.vehicle_last_cells)
+    assert np.array_equal(parser.occupancy.toarray(), expected.occupancy.toarray())
+    assert np.array_equal(parser.timesteps_per_bucket, expected.timesteps_per_bucket)
+
+
+def test_trace_is_ingested(make_parser):
+    parser = make_parser()
+    assert parser.num_vehicles == 40
+    assert parser.vehicle_cells.nnz > 0
+    assert parser.transition_counts.sum() > 0
+    assert parser.timesteps_per_bucket.sum() == NUM_TIMESTEPS
+
+
+@pytest.mark.parametrize("read_block_size", [1 << 20, 257])
+def test_parallel_matches_serial(make_parser, monkeypatch, read_block_size):
+    serial = make_parser()
+    # Small read blocks split the trace into many chunks, with timesteps at the chunk borders
+    monkeypatch.setattr(sumoparser, "FCD_READ_BLOCK_SIZE", read_block_size)
+    parallel = make_parser(workers=3)
+    assert list(parallel.vehicle_ids) == list(serial.vehicle_ids)
+    assert_same_products(parallel, serial)
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+@pytest.mark.parametrize("buffer_size", [sumoparser.PAIR_KEY_BUFFER_SIZE, 16])
+def test_m_and_p_match_the_baseline(make_parser, monkeypatch, trace, workers, buffer_size):
+    # A small buffer sums up the transitions, pairs and occupancy many times during the ingestion
+    monkeypatch.setattr(sumoparser, "PAIR_KEY_BUFFER_SIZE", buffer_size)
+    parser = make_parser(workers=workers)
+    M, P, _, _ = baseline_ingestion(trace, parser.grid_size)
+    assert np.array_equal(np.asarray(parser.M), M)
+    assert np.allclose(parser.P.toarray(), P)
+
+
+def test_incidence_matches_the_baseline(make_parser, trace):
+    parser = make_parser()
+    _, _, vehicle_paths, location_vehicles = baseline_ingestion(trace, parser.grid_size)
+    assert list(parser.vehicle_ids) == list(vehicle_paths)
+    for code, vehicle_id in enumerate(parser.vehicle_ids):
+        cells = parser.vehicle_cells[code].indices
+        assert {divmod(int(cell), parser.grid_size) for cell in cells} == vehicle_paths[vehicle_id]
+    for x_index in range(parser.grid_size):
+        for y_index in range(parser.grid_size):
+            vehicles = {str(parser.vehicle_ids[code]) for code in parser.vehicles_in_cell((x_index, y_index))}
+            assert vehicles == location_vehicles.get((x_index, y_index), set())
+
+    subset = np.arange(0, parser.num_vehicles, 3)
+    expected = np.zeros((parser.grid_size, parser.grid_size), dtype=int)
+    for code in subset:
+        for cell in vehicle_paths[str(parser.vehicle_ids[code])]:
+            expected[cell] += 1
+    assert np.array_equal(parser.count_vehicles_per_cell(subset), expected)
+
+
+def closest_junctions(parser, xs, ys):
+    """Linear scan over all junctions, as the original find_closest_junction did per point."""
+    points = np.column_stack((xs, ys))
+    distances = np.linalg.norm(points[:, None, :] - parser.junction_xy[None, :, :], axis=2)
+    return parser.junction_xy[np.argmin(distances, axis=1)]
+
+
+def test_nearest_junctions_match_a_linear_scan(make_parser):
+    parser = make_parser(products=["junctions"])
+    rng = np.random.default_rng(2)
+    xs, ys = rng.uniform(-50, WIDTH + 50, 500), rng.uniform(-50, HEIGHT + 50, 500)
+    assert np.array_equal(parser.nearest_junctions(xs, ys), closest_junctions(parser, xs, ys))
+
+
+@pytest.mark.parametrize("grid_size", [BASE_GRID_SIZE, 10])
+def test_cell_junctions_match_a_linear_scan(make_parser, grid_size):
+    parser = make_parser(grid_size=grid_size, products=["junctions"])
+    x_indices, y_indices = np.divmod(np.arange(grid_size * grid_size), grid_size)
+    expected = closest_junctions(
+        parser, (x_indices + 0.5) * WIDTH / grid_size, (y_indices + 0.5) * HEIGHT / grid_size
+    )
+    assert np.array_equal(parser.cell_junctions, expected - NET_OFFSET)
+
+    genes = np.random.default_rng(3).integers(0, grid_size * grid_size, (4, 6))
+    decoded = parser.decode_population(genes)
+    assert decoded.shape == (4, 6, 2)
+    assert np.array_equal(
+        decoded[1, 2], parser.cell_junctions[(genes[1, 2] % grid_size) * grid_size + genes[1, 2] // grid_size]
+    )
+
+
+@pytest.mark.parametrize("grid_size", [10, 5, BASE_GRID_SIZE])
+def test_coarsened_matches_direct(make_parser, grid_size):
+    coarsened = make_parser().for_grid_size(grid_size)
+    direct = make_parser(grid_size=grid_size)
+    assert_same_products(coarsened, direct)
+    assert np.array_equal(coarsened.cell_junctions, direct.cell_junctions)
+
+
+def test_coarsening_requires_a_divisor(make_parser):
+    with pytest.raises(ValueError):
+        make_parser().for_grid_size(7)
+
+
+def test_occupancy_counts_the_records_per_time_bucket(make_parser, trace):
+    parser = make_parser()
+    grid_size = parser.grid_size
+    records = np.zeros((grid_size, grid_size), dtype=int)
+    num_timesteps = 0
+    for time, timestep_records in trace:
+        # Window [15, 35) is widened to the buckets [10, 20), [20, 30), [30, 40)
+        if 10 <= time < 40:
+            num_timesteps += 1
+            for _, x, y in timestep_records:
+                records[parser.get_grid_cell(x, y)] += 1
+    window_records, window_timesteps = parser.occupancy_in_window(15, 35)
+    assert np.array_equal(window_records, records)
+    assert window_timesteps == num_timesteps
+    assert np.allclose(parser.density_in_window(15, 35), records / num_timesteps)
+
+
+@pytest.mark.parametrize("batch_size", [1 << 20, 50])
+def test_parquet_matches_xml(make_parser, monkeypatch, batch_size):
+    xml = make_parser()
+    monkeypatch.setattr(sumoparser, "FCD_PARQUET_BATCH_SIZE", batch_size)
+    parquet = make_parser(fcd_format="parquet")
+    # prep-disolv numbers the vehicles, so only the ids differ
+    assert list(parquet.vehicle_ids) == [vehicle_id[len("veh") :] for vehicle_id in xml.vehicle_ids]
+    assert_same_products(parquet, xml)
+
+
+def test_unordered_parquet_is_rejected(tmp_path):
+    parquet_path = str(tmp_path / "unordered.parquet")
+    table = pa.table({"time": [0.0, 2.0, 1.0], "id": [1, 2, 3], "x": [0.0] * 3, "y": [0.0] * 3})
+    pq.write_table(table, parquet_path)
+    columns = {"time": "time", "id": "id", "x": "x", "y": "y"}
+    with pytest.raises(ValueError):
+        list(sumoparser.iter_fcd_parquet_timesteps(parquet_path, columns))
+
+
+@pytest.mark.parametrize("skip_internal_junctions", [False, True])
+def test_net_file_is_parsed_like_the_element_tree(scenario, tmp_path, skip_internal_junctions):
+    net_path = str(scenario / "koln.net.xml")
+    gzip_path = str(tmp_path / "koln.net.xml.gz")
+    with open(net_path, "rb") as source, gzip.open(gzip_path, "wb") as target:
+        shutil.copyfileobj(source, target)
+    junctions = [
+        junction
+        for junction in ET.parse(net_path).getroot().findall("junction")
+        if not (skip_internal_junctions and junction.get("type") == "internal")
+    ]
+
+    for path in (net_path, gzip_path):
+        net = sumoparser.parse_net_file(path, skip_internal_junctions)
+        assert net.conv_boundary == (0.0, 0.0, WIDTH, HEIGHT)
+        assert net.net_offset == NET_OFFSET
+        assert list(net.junction_ids) == [junction.get("id") for junction in junctions]
+        assert np.array_equal(
+            net.junction_xy, [(float(junction.get("x")), float(junction.get("y"))) for junction in junctions]
+        )
+        types = net.junction_type_names[net.junction_types]
+        assert list(types) == [junction.get("type") for junction in junctions]
+
+    location = sumoparser.parse_net_file(gzip_path, location_only=True)
+    assert location.net_offset == NET_OFFSET
+    assert len(location.junction_ids) == 0
+
+
+def count_ingestions(monkeypatch):
+    """Records the products of every FCD ingestion pass."""
+    ingestions = []
+    generate_matrix_m_and_p = sumoparser.SUMOParser.generate_matrix_m_and_p
+
+    def counting(self, products=sumoparser.FCD_PRODUCTS):
+        ingestions.append(sorted(products))
+        return generate_matrix_m_and_p(self, products)
+
+    monkeypatch.setattr(sumoparser.SUMOParser, "generate_matrix_m_and_p", counting)
+    return ingestions
+
+
+def test_products_are_built_on_first_access(make_parser, monkeypatch):
+    ingestions = count_ingestions(monkeypatch)
+    parser = make_parser(products=["junctions"])
+    assert parser.products == {"junctions"} and not ingestions
+
+    assert parser.M.sum() > 0
+    assert ingestions == [["vehicle_cells"]]
+    assert parser.vehicle_cells.shape[0] == len(parser.vehicle_ids)
+    assert ingestions == [["vehicle_cells"]]
+    with pytest.raises(AttributeError):
+        parser.nonexistent
+
+
+def test_failed_products_are_not_rebuilt(make_parser, monkeypatch):
+    ingestions = count_ingestions(monkeypatch)
+    parser = make_parser(fcd_file="missing.xml", products=["junctions"])
+    assert parser.num_vehicles == 0
+    assert parser.vehicle_last_cells.shape == (0,)
+    assert parser.M.sum() == 0 and parser.P.nnz == 0
+    assert ingestions == [["vehicle_cells"], ["transition_counts"]]
+    assert parser.failed_products == {"vehicle_cells", "transition_counts"}
+
+    coarsened = parser.for_grid_size(10)
+    assert coarsened.M.shape == (10, 10) and coarsened.P.shape == (100, 100)
+    assert len(ingestions) == 2
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_append_matches_full(make_parser, scenario, workers):
+    full = make_parser()
+    appended = make_parser(fcd_file="segment_1.xml", workers=workers)
+    assert appended.num_vehicles < full.num_vehicles
+    appended.append_fcd(str(scenario / "segment_2.xml"))
+    assert list(appended.vehicle_ids) == list(full.vehicle_ids)
+    assert_same_products(appended, full)
+    assert_same_products(appended.for_grid_size(10), make_parser(grid_size=10))
+
+
+def test_configured_segments_match_full(make_parser):
+    full = make_parser()
+    segmented = make_parser(fcd_file="segment_1.xml", fcd_segments=["/segment_2.xml"])
+    assert segmented.timesteps_per_bucket.sum() == NUM_TIMESTEPS
+    assert list(segmented.vehicle_ids) == list(full.vehicle_ids)
+    assert_same_products(segmented, full)
@@ -0,0 +1,372 @@
+import asyncio
+import copy
+import functools
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+import toml
+
+import rsudeploysimcomp.VanetSimulatorInterface.vanet_sim_interface as vanet_sim_interface
+from rsudeploysimcomp.tests.conftest import NET_OFFSET, SEGMENT_START, write_fcd_parquet, write_fcd_xml
+from rsudeploysimcomp.VanetSimulatorInterface import fake_disolv
+
+RSU_RADIUS = 75
+
+# disolv output of the Koln scenario
+KOLN_TX_DATA_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Koln_v1", "disolv", "tx_data.parquet"
+)
+
+
+@pytest.fixture
+def make_interface(tmp_path, trace, monkeypatch):
+    """
+    Returns a factory of VanetSimulatorInterfaces on the generated trace, running in tmp_path with the given
+    simulator, evaluator and caches.
+    """
+    app_config = vanet_sim_interface.load_config()
+    vanet_config = app_config["VanetInterface"]
+    base_path = str(tmp_path)
+    scenario = vanet_config["scenario"]
+    input_path = base_path + vanet_config["input_path"] + scenario
+    output_path = base_path + vanet_config["output_path"] + scenario
+    configs_path = base_path + vanet_config["configs_path"] + scenario
+    raw_path = base_path + vanet_config["raw_path"] + scenario
+    for path in (os.path.dirname(input_path + vanet_config["fcd_parquet"]), output_path, configs_path, raw_path):
+        os.makedirs(path, exist_ok=True)
+    write_fcd_xml(raw_path + "/koln_fcd.xml", trace)
+    write_fcd_parquet(input_path + vanet_config["fcd_parquet"], trace)
+
+    common = (
+        f'deployment = "{input_path + vanet_config["deployment_parquet_path"]}"\n'
+        f'fcd = "{input_path + vanet_config["fcd_parquet"]}"\n'
+    )
+    with open(configs_path + "/links.toml", "w") as file:
+        file.write(
+            f'[fake_disolv]\n{common}links = "{input_path + vanet_config["link_cache"]["link_file"]}"\n'
+            "link_radius = 150.0\n"
+        )
+    with open(configs_path + "/disolv.toml", "w") as file:
+        file.write(f'[fake_disolv]\n{common}output_path = "{output_path}"\nv2v_radius = 50.0\n')
+    with open(configs_path + "/positions.toml", "w") as file:
+        file.write(f'[input_files]\nfcd = "{raw_path}/koln_fcd.xml"\n')
+
+    def factory(
+        evaluator="disolv",
+        result_cache=False,
+        link_cache=False,
+        prep_cache=False,
+        simulator="fake",
+        track_execution_time=False,
+    ):
+        config = copy.deepcopy(app_config)
+        config["General"]["base_path"] = base_path
+        config["General"]["rsu_radius"] = RSU_RADIUS
+        vanet = config["VanetInterface"]
+        vanet["simulator"] = simulator
+        vanet["track_execution_time"] = track_execution_time
+        vanet["evaluator"] = {"type": evaluator, "validate": False}
+        vanet["result_cache"]["enabled"] = result_cache
+        vanet["link_cache"]["enabled"] = link_cache
+        vanet["prep_cache"]["enabled"] = prep_cache
+        vanet["async_runner"]["retry_delay"] = 0
+
+        monkeypatch.setattr(vanet_sim_interface, "load_config", lambda: copy.deepcopy(config))
+        return vanet_sim_interface.VanetSimulatorInterface()
+
+    return factory
+
+
+def make_deployments(trace, sizes=(1, 3, 5, 8)):
+    """
+    Returns:
+        list: One deployment of RSUs at random vehicle positions (in UTM coordinates) per size.
+    """
+    rng = np.random.default_rng(2)
+    positions = [(x - NET_OFFSET[0], y - NET_OFFSET[1]) for _, records in trace for _, x, y in records]
+    return [[positions[index] for index in rng.choice(len(positions), size, replace=False)] for size in sizes]
+
+
+def vehicle_positions(timesteps):
+    return np.array([(x - NET_OFFSET[0], y - NET_OFFSET[1]) for _, records in timesteps for _, x, y in records])
+
+
+def test_native_evaluations_go_through_the_result_cache(make_interface, trace, monkeypatch):
+    interface = make_interface(evaluator="native", result_cache=True)
+    deployments = make_deployments(trace)
+    expected = [
+        vanet_sim_interface.compute_geometric_metrics(deployment, vehicle_positions(trace), RSU_RADIUS)
+        for deployment in deployments
+    ]
+    assert np.allclose(interface.evaluate_many(deployments), expected)
+
+    def evaluate_natively(rsu_positions):
+        raise AssertionError("Cached deployment evaluated again")
+
+    monkeypatch.setattr(interface, "evaluate_natively", evaluate_natively)
+    assert np.allclose(interface.evaluate_many(deployments), expected)
+    assert np.allclose(asyncio.run(interface.evaluate_many_async(deployments)), expected)
+    assert interface.result_cache.hits == 2 * len(deployments)
+
+
+def test_rewritten_fcd_is_loaded_again(make_interface, trace):
+    interface = make_interface(evaluator="native")
+    deployment = make_deployments(trace)[2]
+    assert np.allclose(
+        interface.evaluate_natively(deployment),
+        vanet_sim_interface.compute_geometric_metrics(deployment, vehicle_positions(trace), RSU_RADIUS),
+    )
+    write_fcd_parquet(interface.fcd_parquet_path, trace[:SEGMENT_START])
+    assert np.allclose(
+        interface.evaluate_natively(deployment),
+        vanet_sim_interface.compute_geometric_metrics(
+            deployment, vehicle_positions(trace[:SEGMENT_START]), RSU_RADIUS
+        ),
+    )
+
+
+def run_sequentially(interface, deployments):
+    _, _, _, input_path = interface.stage_paths()
+    vanet_config = interface.config["VanetInterface"]
+    return [
+        vanet_sim_interface.run_pipeline(
+            deployment,
+            input_path + vanet_config["deployment_csv_path"],
+            input_path + vanet_config["deployment_parquet_path"],
+            interface,
+            "test",
+        )
+        for deployment in deployments
+    ]
+
+
+def test_workspaces_match_sequential_runs(make_interface, trace):
+    deployments = make_deployments(trace)
+    expected = run_sequentially(make_interface(), deployments)
+    assert np.allclose(make_interface().evaluate_many(deployments, workers=2), expected)
+
+    # Workspaces materialized again reuse the linked vehicle inputs and hold nothing else
+    interface = make_interface()
+    assert np.allclose(interface.evaluate_many(deployments, workers=2), expected)
+    for workspace in interface.workspaces:
+        input_files = {
+            os.path.relpath(os.path.join(directory, file_name), workspace.paths["input"])
+            for directory, _, file_names in os.walk(workspace.paths["input"])
+            for file_name in file_names
+        }
+        vanet_config = interface.config["VanetInterface"]
+        assert input_files == {
+            path.lstrip("/")
+            for path in (
+                vanet_config["fcd_parquet"],
+                vanet_config["deployment_parquet_path"],
+                vanet_config["link_cache"]["link_file"],
+            )
+        }
+        assert os.path.samefile(workspace.paths["input"] + vanet_config["fcd_parquet"], interface.fcd_parquet_path)
+
+
+@pytest.mark.parametrize("write_csv", [False, True])
+def test_deployment_file_matches_the_csv_export(tmp_path, trace, write_csv):
+    deployment = make_deployments(trace)[3]
+    csv_path, parquet_path = str(tmp_path / "rsu_deployment.csv"), str(tmp_path / "rsu_deployment.parquet")
+    vanet_sim_interface.generate_deployment_file(deployment, csv_path, parquet_path, write_csv=write_csv)
+
+    table = pq.read_table(parquet_path)
+    assert table.schema.equals(vanet_sim_interface.DEPLOYMENT_SCHEMA)
+    # Formerly written as CSV and converted to Parquet with pandas
+    vanet_sim_interface.export_picked_locations_to_csv(str(tmp_path / "expected.csv"), deployment)
+    pd.testing.assert_frame_equal(table.to_pandas(), pd.read_csv(str(tmp_path / "expected.csv")))
+    assert os.path.exists(csv_path) == write_csv
+
+
+def test_prep_cache_reuses_the_vehicle_outputs(make_interface, monkeypatch):
+    interface = make_interface(simulator="disolv", prep_cache=True)
+    prep_disolv_path, _, configs_path, input_path = interface.stage_paths()
+    vehicle_output = input_path + interface.config["VanetInterface"]["fcd_parquet"]
+    rsu_config_file = interface.prep_cache.rsu_config_file
+    runs = []
+    failing_runs = {2}
+
+    def prep_position_files(prep_disolv_path, configs_path, config_file="positions.toml"):
+        runs.append(config_file)
+        if config_file == "positions.toml":
+            with open(vehicle_output, "w") as file:
+                file.write(f"vehicles of run {len(runs)}")
+        return len(runs) not in failing_runs
+
+    def prepare_positions(interface):
+        interface.prepare_positions(prep_disolv_path, configs_path, input_path)
+        with open(vehicle_output) as file:
+            return file.read()
+
+    monkeypatch.setattr(vanet_sim_interface, "prep_position_files", prep_position_files)
+
+    # Without the RSU-only config, the cache is not used
+    assert prepare_positions(interface) == "vehicles of run 1"
+    assert not interface.prep_cache.is_warm()
+    with open(os.path.join(configs_path, rsu_config_file), "w") as file:
+        file.write("")
+    # Nor are the outputs of a failed run cached
+    prepare_positions(interface)
+    assert not interface.prep_cache.is_warm()
+    assert prepare_positions(interface) == "vehicles of run 3"
+    assert interface.prep_cache.is_warm()
+
+    cached_output = interface.prep_cache.get_entry_path() + interface.config["VanetInterface"]["fcd_parquet"]
+    warm_interface = make_interface(simulator="disolv", prep_cache=True)
+    assert prepare_positions(warm_interface) == "vehicles of run 3"
+    assert runs[3:] == [rsu_config_file]
+    assert os.path.samefile(vehicle_output, cached_output)
+
+    # A new raw trace misses the cache, and its full run does not write into the cached outputs
+    with open(interface.prep_cache.raw_path + "/koln.rou.xml", "w") as file:
+        file.write("<routes/>")
+    new_trace_interface = make_interface(simulator="disolv", prep_cache=True)
+    assert prepare_positions(new_trace_interface) == "vehicles of run 5"
+    assert runs[4:] == ["positions.toml"]
+    with open(cached_output) as file:
+        assert file.read() == "vehicles of run 3"
+
+
+def test_link_cache_assembles_the_links_of_a_direct_run(make_interface, trace, monkeypatch):
+    interface = make_interface(link_cache=True)
+    _, _, configs_path, input_path = interface.stage_paths()
+    vanet_config = interface.config["VanetInterface"]
+    link_file_path = input_path + vanet_config["link_cache"]["link_file"]
+    link_runs = []
+    run_links = vanet_sim_interface.prep_link_file
+
+    def prep_link_file(*args):
+        link_runs.append(args)
+        return run_links(*args)
+
+    monkeypatch.setattr(vanet_sim_interface, "prep_link_file", prep_link_file)
+    positions = make_deployments(trace, sizes=(8,))[0]
+    key = ["time_step", "agent_id", "target_id"]
+    for deployment in (positions[:4], positions[2:7], positions[5::-1]):
+        run_sequentially(interface, [deployment])
+        cached = pq.read_table(link_file_path).to_pandas().sort_values(key).reset_index(drop=True)
+        fake_disolv.compute_links(toml.load(configs_path + "/links.toml")["fake_disolv"])
+        direct = pq.read_table(link_file_path).to_pandas().sort_values(key).reset_index(drop=True)
+        pd.testing.assert_frame_equal(cached, direct)
+    # The last deployment only consists of cached positions
+    assert len(link_runs) == 2
+
+    # prep-disolv rewriting the same vehicle positions keeps the entry, a new raw trace does not
+    entry_path = interface.link_cache.get_entry_path()
+    write_fcd_parquet(interface.fcd_parquet_path, trace)
+    assert make_interface(link_cache=True).link_cache.get_entry_path() == entry_path
+    with open(interface.link_cache.raw_path + "/koln.rou.xml", "w") as file:
+        file.write("<routes/>")
+    assert make_interface(link_cache=True).link_cache.get_entry_path() != entry_path
+
+
+@pytest.mark.parametrize("batch_size", [vanet_sim_interface.TX_DATA_BATCH_SIZE, 1000])
+@pytest.mark.parametrize("rsu_radius", [500, 1000])
+def test_tx_data_summary_matches_pandas(monkeypatch, batch_size, rsu_radius):
+    monkeypatch.setattr(
+        vanet_sim_interface,
+        "scan_relevant_tx_data",
+        functools.partial(vanet_sim_interface.scan_relevant_tx_data, batch_size=batch_size),
+    )
+    summary = vanet_sim_interface.TxDataSummary.from_parquet(KOLN_TX_DATA_PATH, rsu_radius)
+
+    tx_data = pd.read_parquet(KOLN_TX_DATA_PATH)
+    relevant = tx_data[
+        (tx_data["agent_id"] < vanet_sim_interface.RSU_AGENT_ID_OFFSET)
+        & (tx_data["selected_agent"] >= vanet_sim_interface.RSU_AGENT_ID_OFFSET)
+    ].assign(distance=lambda frame: frame["distance"].astype(np.float64))
+    relevant = relevant.assign(covered=relevant["distance"] <= rsu_radius)
+    assert 0 < len(relevant) < len(tx_data)
+    assert summary.total_records == len(relevant)
+    assert np.allclose(
+        summary.coverage_and_avg_distance(), (relevant["covered"].mean() * 100, relevant["distance"].mean())
+    )
+    per_time_step = relevant.groupby("time_step").mean()
+    assert np.allclose(summary.coverage_per_time_step(), per_time_step["covered"] * 100)
+    assert np.allclose(summary.avg_distance_per_time_step(), per_time_step["distance"])
+
+    restored = vanet_sim_interface.TxDataSummary.from_json(summary.to_json(), rsu_radius)
+    assert restored.coverage_and_avg_distance() == pytest.approx(summary.coverage_and_avg_distance())
+
+
+def test_async_evaluations_match_sequential_runs(make_interface, trace, tmp_path, monkeypatch):
+    deployments = make_deployments(trace)
+    expected = run_sequentially(make_interface(), deployments)
+    exec_time_csv = str(tmp_path / "pipeline_exec_time.csv")
+    monkeypatch.setattr(vanet_sim_interface, "PIPELINE_EXEC_TIME_CSV", exec_time_csv)
+
+    interface = make_interface(link_cache=True, track_execution_time=True)
+    assert np.allclose(asyncio.run(interface.evaluate_many_async(deployments, workers=2)), expected)
+    execution_times = pd.read_csv(exec_time_csv)
+    assert len(execution_times) == len(deployments)
+    assert (execution_times["run_disolv_time"] > 0).all()
+
+
+def test_failed_async_evaluation_cancels_the_others(make_interface, trace, monkeypatch):
+    interface = make_interface()
+    commands = iter(
+        [
+            [sys.executable, "-c", "import time; time.sleep(60)"],
+            [sys.executable, "-c", "import sys; sys.exit(1)"],
+        ]
+    )
+    monkeypatch.setattr(vanet_sim_interface, "run_rsu_simulator_command", lambda *args: next(commands))
+
+    async def evaluate_many():
+        with pytest.raises(RuntimeError):
+            await interface.evaluate_many_async(make_deployments(trace, sizes=(1, 3)), workers=2)
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+
+    start_time = time.perf_counter()
+    asyncio.run(evaluate_many())
+    assert time.perf_counter() - start_time < 30
+
+
+def test_failed_run_is_not_cached(make_interface, trace, monkeypatch):
+    interface = make_interface(result_cache=True)
+    first, second = make_deployments(trace, sizes=(3, 5))
+    run_sequentially(interface, [first])
+    assert os.path.exists(interface.tx_data_parquet_path)
+
+    run_simulator_command = vanet_sim_interface.run_rsu_simulator_command
+    monkeypatch.setattr(
+        vanet_sim_interface,
+        "run_rsu_simulator_command",
+        lambda *args: [sys.executable, "-c", "import sys; sys.exit(1)"],
+    )
+    with pytest.raises(RuntimeError):
+        run_sequentially(interface, [second])
+    # The output of the first deployment is gone, instead of being taken for the one of the second
+    assert not os.path.exists(interface.tx_data_parquet_path)
+    assert interface.lookup_result(second)[1] is None
+
+    monkeypatch.setattr(vanet_sim_interface, "run_rsu_simulator_command", run_simulator_command)
+    assert run_sequentially(interface, [second]) == run_sequentially(make_interface(), [second])
+    assert interface.lookup_result(second)[1] is not None
+
+
+def test_fake_disolv_matches_the_native_evaluator(make_interface, trace):
+    interface = make_interface()
+    deployments = make_deployments(trace)
+    native = [interface.evaluate_natively(deployment) for deployment in deployments]
+    # The relayed transmissions go to vehicles, only the ones to the closest RSU count
+    assert np.allclose(run_sequentially(interface, deployments), native)
+
+    tx_data = pq.read_table(interface.tx_data_parquet_path)
+    assert tx_data.schema.equals(pq.read_schema(KOLN_TX_DATA_PATH))
+    selected_agents = tx_data["selected_agent"].to_numpy()
+    rsu_ids = selected_agents[selected_agents >= fake_disolv.RSU_AGENT_ID_OFFSET]
+    assert set(rsu_ids) == set(range(fake_disolv.RSU_AGENT_ID_OFFSET, fake_disolv.RSU_AGENT_ID_OFFSET + 8))
+
+    _, _, configs_path, _ = interface.stage_paths()
+    settings = toml.load(configs_path + "/links.toml")["fake_disolv"]
+    links = pq.read_table(settings["links"])
+    assert links.schema.equals(fake_disolv.LINKS_SCHEMA)
+    assert len(links) > 0 and (links["distance"].to_numpy() <= settings["link_radius"]).all()
@@ -51,7 +51,8 @@ setup(
     packages=find_packages(exclude=["docs", "tests"]),
     entry_points={
         "console_scripts": [
-            # 'command = some.module:some_function',
+            "fake-disolv-links = rsudeploysimcomp.VanetSimulatorInterface.fake_disolv:links_main",
+            "fake-disolv-v2x = rsudeploysimcomp.VanetSimulatorInterface.fake_disolv:v2x_main",
         ],
     },
     include_package_data=True,